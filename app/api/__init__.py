@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.api.v1 import login, users, items, filepond
+from app.api.v1 import login, users, items, filepond, events
 from app import utils
 
 
@@ -34,3 +34,4 @@ api_router.include_router(login.router, tags=["login"])
 api_router.include_router(users.router, prefix="/users", tags=["users"])
 api_router.include_router(items.router, prefix="/items", tags=["items"])
 api_router.include_router(filepond.router, prefix="/upload", tags=["upload"])
+api_router.include_router(events.router, prefix="/events", tags=["events"])
@@ -1,17 +1,25 @@
-from typing import Generator, Any
+import hashlib
+import time
+from typing import AsyncGenerator, Dict, Generator, Any, Optional
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, APIKeyCookie
 from jose import jwt
 from pydantic import ValidationError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+import sqlalchemy as sa
 from loguru import logger
 
-from app import crud, models, schemas
+from app import crud, models, schemas, sse
+from app.cache import principal_cache
 from app.config import settings
-from app.database import SessionLocal
-
-SSE_CLIENTS = set()
+from app.database import (
+    AsyncReadSessionLocal,
+    AsyncSessionLocal,
+    ReadSessionLocal,
+    SessionLocal,
+)
 
 reusable_oauth2 = OAuth2PasswordBearer(
     tokenUrl=f"/api{settings.API_V1_STR}/login/access-token", auto_error=False
@@ -27,46 +35,85 @@ def get_db() -> Generator:
         db.close()
 
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def get_read_db() -> Generator:
+    """a session on the read-only engine, for routes that never write"""
+    try:
+        db = ReadSessionLocal()
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_read_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncReadSessionLocal() as db:
+        yield db
+
+
+def _decode_token(token: str, source: str) -> Optional[Dict[str, Any]]:
+    try:
+        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+        schemas.TokenPayload(**payload)
+        return payload
+    except (jwt.JWTError, ValidationError) as e:
+        logger.error(f"invalid jwt token in {source}: {e}")
+        return None
+
+
+def _user_snapshot(user: models.User) -> Dict[str, Any]:
+    # hashed_password stays out of the cache, it is loaded on access
+    return {
+        attr.key: getattr(user, attr.key)
+        for attr in sa.inspect(models.User).column_attrs
+        if attr.key != "hashed_password"
+    }
+
+
+def _attach_user(db: Session, snapshot: Dict[str, Any]) -> models.User:
+    """a session bound user built from a cached snapshot, without a query"""
+    user = models.User(**snapshot)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
+
+
 def get_current_user(
     db: Session = Depends(get_db),
     token: str = Depends(reusable_oauth2),
     session: str = Depends(cookie_sec),
 ) -> models.User:
-    has_valid_token = False
-
     if not (token or session):
         logger.error(f"no token {token} or session {session}")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
-    if token:
-        try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-            token_data = schemas.TokenPayload(**payload)
-            has_valid_token = True
-        except (jwt.JWTError, ValidationError) as e:
-            # logger.info(f"token {token}, payload {payload}")
-            logger.error(f"invalid jwt token in headers: {e}")
-
-    if not has_valid_token and session:
-        try:
-            payload = jwt.decode(session, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-            token_data = schemas.TokenPayload(**payload)
-            has_valid_token = True
-        except (jwt.JWTError, ValidationError) as e:
-            # logger.info(f"token {token}, payload {payload}")
-            logger.error(f"invalid jwt token in session: {e}")
-
-    if not has_valid_token:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Could not validate credentials",
-        )
-
-    logger.info(f"token is valid {token_data}")
-    user = crud.user.get(db, id=token_data.sub)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
+    for credential, source in ((token, "headers"), (session, "session")):
+        if not credential:
+            continue
+        key = hashlib.sha256(credential.encode()).digest()
+        snapshot = principal_cache.get(key)
+        if snapshot is not None:
+            return _attach_user(db, snapshot)
+
+        payload = _decode_token(credential, source)
+        if payload is None:
+            continue
+        token_data = schemas.TokenPayload(**payload)
+        logger.info(f"token is valid {token_data}")
+        user = crud.user.get(db, id=token_data.sub)
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        ttl = min(principal_cache.ttl, payload.get("exp", 0) - time.time())
+        if ttl > 0:
+            principal_cache.set(key, _user_snapshot(user), ttl=ttl)
+        return user
+
+    raise HTTPException(
+        status_code=status.HTTP_403_FORBIDDEN,
+        detail="Could not validate credentials",
+    )
 
 
 def get_current_active_user(
@@ -89,5 +136,4 @@ def get_current_active_superuser(
 
 
 async def sse_notify(event: str, data: Any):
-    for client in SSE_CLIENTS:
-        await client.put({"event": event, "data": data})
+    sse.notify(event, data)
@@ -0,0 +1,29 @@
+"""
+server-sent events stream
+https://html.spec.whatwg.org/multipage/server-sent-events.html
+"""
+from typing import Optional
+
+from fastapi import APIRouter, Header, Query
+from fastapi.responses import StreamingResponse
+
+from app import sse
+
+router = APIRouter()
+
+
+@router.get("/", response_class=StreamingResponse)
+async def stream_events(
+    last_event_id: Optional[str] = Header(None),
+    last_id: Optional[str] = Query(
+        None, description="Last-Event-ID for clients that can't set headers"
+    ),
+):
+    """
+    Stream item updates, reconnect with `Last-Event-ID` to replay missed events.
+    """
+    return StreamingResponse(
+        sse.stream(last_event_id if last_event_id is not None else last_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,15 +1,134 @@
 """
 endpoint for handling filepond file upload
 https://pqina.nl/filepond/docs/api/server/#url
+https://pqina.nl/filepond/docs/api/server/#process-chunks
 """
-from datetime import datetime
-from fastapi import APIRouter, File, UploadFile
-from fastapi.responses import PlainTextResponse
+from typing import Optional
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, PlainTextResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.datastructures import UploadFile
 from loguru import logger
 
+from app import images, models, uploads
+from app.api import deps
+
 router = APIRouter()
 
+# name of the FilePond input, carries the metadata and the file itself
+FIELD = "filepond"
+# derivatives never change, their name is derived from the content
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+async def get_upload(db: AsyncSession, upload_id: UUID, user: models.User) -> models.Upload:
+    """the upload if `user` started it, superusers see every upload"""
+    upload = await db.get(models.Upload, upload_id)
+    if upload is None or not (upload.created_by_id == user.id or user.is_superuser):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+
+def completed(upload: models.Upload) -> None:
+    logger.info(f"upload {upload.id} complete, {upload.sha256}")
+    # not awaited, derivatives render in the background
+    images.pipeline.submit(upload.sha256)
+
+
 @router.post("/", response_class=PlainTextResponse)
-async def process(filepond: UploadFile = File(...)):
-    logger.info(f'filepond {filepond.__dict__}')
-    return f"{filepond.filename}_{int(datetime.now().timestamp())}"
\ No newline at end of file
+async def process(
+    request: Request,
+    upload_length: Optional[int] = Header(None),
+    db: AsyncSession = Depends(deps.get_async_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """
+    Store a whole file, or with `Upload-Length` and no file start a chunked
+    upload. Returns the upload id either way.
+    """
+    form = await request.form()
+    files = [value for value in form.getlist(FIELD) if isinstance(value, UploadFile)]
+    try:
+        if files:
+            upload = await uploads.store(db, files[-1], owner_id=current_user.id)
+        elif upload_length is not None:
+            upload = await uploads.start(db, length=upload_length, owner_id=current_user.id)
+        else:
+            raise HTTPException(status_code=400, detail="Expected a file or an Upload-Length header")
+    except uploads.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except uploads.TooManyUploads as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    if upload.complete:
+        completed(upload)
+    return str(upload.id)
+
+
+@router.patch("/", status_code=204, response_class=Response)
+async def patch(
+    request: Request,
+    patch: UUID = Query(...),
+    upload_offset: int = Header(...),
+    upload_name: Optional[str] = Header(None),
+    db: AsyncSession = Depends(deps.get_async_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """Append the chunk in the body at `Upload-Offset`"""
+    upload = await get_upload(db, patch, current_user)
+    if upload_name and not upload.filename:
+        upload.filename = upload_name
+    try:
+        upload = await uploads.append(db, upload, upload_offset, request.stream())
+    except uploads.OffsetMismatch as e:
+        raise HTTPException(
+            status_code=409, detail=str(e), headers={"Upload-Offset": str(e.expected)}
+        )
+    except uploads.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if upload.complete:
+        completed(upload)
+    return Response(status_code=204, headers={"Upload-Offset": str(upload.received)})
+
+
+@router.head("/")
+async def offset(
+    patch: UUID = Query(...),
+    db: AsyncSession = Depends(deps.get_async_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """Offset reached by a chunked upload, where FilePond resumes"""
+    upload = await get_upload(db, patch, current_user)
+    return Response(headers={"Upload-Offset": str(upload.received)})
+
+
+@router.delete("/", status_code=204, response_class=Response)
+async def revert(
+    request: Request,
+    db: AsyncSession = Depends(deps.get_async_db),
+    current_user: models.User = Depends(deps.get_current_active_user),
+):
+    """Undo an upload, FilePond sends its id as the body"""
+    try:
+        upload_id = UUID((await request.body()).decode().strip())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Expected an upload id")
+    upload = await get_upload(db, upload_id, current_user)
+    if await uploads.remove(db, upload):
+        images.remove_derivatives(upload.sha256)
+    return Response(status_code=204)
+
+
+@router.get("/{digest}/{variant}.jpg", response_class=FileResponse)
+async def derivative(digest: str, variant: str):
+    """Thumbnail or preview of an uploaded image, rendered on demand if not ready yet"""
+    if variant not in images.DERIVATIVES or not uploads.DIGEST.match(digest):
+        raise HTTPException(status_code=404, detail="Not found")
+    path = images.derivative_path(digest, variant)
+    if not path.exists():
+        if not uploads.blob_path(digest).exists():
+            raise HTTPException(status_code=404, detail="Not found")
+        if not await images.pipeline.submit(digest):
+            raise HTTPException(status_code=415, detail="Upload is not an image")
+    return FileResponse(path, media_type="image/jpeg", headers={"Cache-Control": IMMUTABLE})
@@ -1,34 +1,163 @@
 import json
+from datetime import datetime, timezone
 from typing import Any, List, Optional
 from loguru import logger
 
-from fastapi import APIRouter, Depends, HTTPException, Request
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, load_only, raiseload
 
 
 from app import crud, models, schemas
 from app.api import deps
+from app.cache import item_responses
+from app.serialize import item_rows
 
 
 router = APIRouter()
 
+# What each endpoint loads for its response model: only the columns it
+# serializes, and any relationship that is not loaded up front raises instead
+# of lazy loading one query per row.
+ITEM_OUT_OPTIONS = (
+    load_only(
+        models.Item.doh_code,
+        models.Item.name,  # clean_name
+        models.Item.address,
+        models.Item.region,
+        models.Item.municipality,
+        models.Item.lat,
+        models.Item.lng,
+        models.Item.website,
+        models.Item.phone,
+    ),
+    raiseload("*"),
+)
+ITEM_OPTIONS = (raiseload("*"),)
+ITEM_ID_OPTIONS = (load_only(models.Item.id), raiseload("*"))
+
 
 @router.get("/", response_model=List[schemas.ItemOut])
-def read_itemss(
+async def read_itemss(
     request: Request,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_read_db),
     after_field: str = "doh_code",
     after_value: Any = None,
-    limit: int = 500,
+    cursor: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=500),
 ) -> Any:
     """
     Retrieve item information.
+
+    Pages are ordered by `after_field`, follow the `X-Next-Cursor`/`X-Prev-Cursor`
+    response headers with `cursor` to move between pages. Responses carry an
+    `ETag`, send it back in `If-None-Match` to get a 304 while nothing changed.
+    """
+    key = item_responses.key(request)
+    cached = item_responses.get(key)
+    if cached is None:
+        try:
+            page = await crud.async_item.get_page(
+                db,
+                sort_key=after_field,
+                cursor=cursor,
+                after_value=after_value,
+                limit=limit,
+                columns=item_rows.columns,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        cached = item_responses.set(key, item_rows.encode(page.items), page.headers)
+    return cached.response(request.headers.get("if-none-match"))
+
+
+@router.get("/beds/latest", response_model=List[schemas.BedLatest])
+def read_latest_beds(
+    db: Session = Depends(deps.get_read_db),
+) -> Any:
+    """
+    Current bed availability of every hospital.
+    """
+    return crud.bed.get_latest(db)
+
+
+def naive_utc(dt: datetime) -> datetime:
+    """bed reports and rollups are stored as naive UTC"""
+    if dt.tzinfo is not None:
+        return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+@router.get("/beds/trend", response_model=schemas.BedTrend)
+def read_bed_trend(
+    db: Session = Depends(deps.get_read_db),
+    scope: str = Query("facility", regex="^(facility|region|municipality)$"),
+    key: str = Query(..., description="doh_code of a facility, or a region/municipality name"),
+    start: datetime = Query(...),
+    end: datetime = Query(None),
+    max_points: int = Query(500, ge=1, le=5000),
+) -> Any:
+    """
+    Bed vacancy min/max/avg over time, bucketed by hour, day or week
+    depending on the length of the requested range.
     """
-    results = crud.item.get_multi(
-        db, limit=limit, after_field=after_field, after_value=after_value
+    start = naive_utc(start)
+    end = naive_utc(end) if end else datetime.utcnow()
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+    if scope == "facility":
+        hospital = crud.hospital.get_by_doh_code(db, doh_code=key, options=ITEM_ID_OPTIONS)
+        if not hospital:
+            raise HTTPException(status_code=404, detail="Item not found")
+        key = str(hospital.id)
+    return crud.bed.get_trend(
+        db, scope=scope, key=key, start=start, end=end, max_points=max_points
     )
 
-    return results
+
+@router.get("/near", response_model=List[schemas.ItemNear])
+def read_items_near(
+    db: Session = Depends(deps.get_read_db),
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius: float = Query(50, gt=0, le=500, description="Search radius in km"),
+    k: int = Query(10, ge=1, le=100),
+) -> Any:
+    """
+    Retrieve the k nearest items within radius km of a point, nearest first.
+    """
+    nearest = crud.item.get_near(
+        db, lat=lat, lng=lng, radius=radius, k=k, options=ITEM_OUT_OPTIONS
+    )
+    return [
+        schemas.ItemNear(**schemas.ItemOut.from_orm(item).dict(), distance=distance)
+        for distance, item in nearest
+    ]
+
+
+@router.get("/bbox", response_model=List[schemas.ItemOut])
+def read_items_in_bbox(
+    db: Session = Depends(deps.get_read_db),
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lng: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lng: float = Query(..., ge=-180, le=180),
+    limit: int = Query(500, ge=1, le=500),
+) -> Any:
+    """
+    Retrieve items inside a bounding box.
+    """
+    if min_lat > max_lat or min_lng > max_lng:
+        raise HTTPException(status_code=400, detail="Invalid bounding box")
+    return crud.item.get_in_bbox(
+        db,
+        min_lat=min_lat,
+        min_lng=min_lng,
+        max_lat=max_lat,
+        max_lng=max_lng,
+        limit=limit,
+        options=ITEM_OUT_OPTIONS,
+    )
 
 
 # @router.post("/", response_model=schemas.Item)
@@ -52,14 +181,16 @@ def read_itemss(
 
 
 @router.get("/{doh_code}", response_model=schemas.Item)
-def read_hospital_by_id(
+async def read_hospital_by_id(
     doh_code: str,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_read_db),
 ) -> Any:
     """
     Get a specific hospital by doh_code.
     """
-    hospital = crud.hospital.get_by_doh_code(db, doh_code=doh_code)
+    hospital = await crud.async_item.get_by_doh_code(
+        db, doh_code=doh_code, options=ITEM_OPTIONS
+    )
     if not hospital:
         raise HTTPException(status_code=404, detail="Item not found")
     logger.debug(f"Item {hospital}")
@@ -3,36 +3,37 @@ from typing import Any
 
 from fastapi import APIRouter, Depends, HTTPException, Body, Response
 from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from loguru import logger
 from app import crud, models, schemas
 from app.api import deps
 from app.config import settings
+from app.hashing import password_hasher
 
 from app.utils import (
     generate_password_reset_token,
     send_reset_password_email,
     verify_password_reset_token,
     create_access_token,
-    get_password_hash,
 )
 
 router = APIRouter()
 
 
-
-
 @router.post("/login/access-token", response_model=schemas.Token)
-def login_access_token(
+async def login_access_token(
     response: Response,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_db),
     form_data: OAuth2PasswordRequestForm = Depends(),
 ) -> Any:
     """
     OAuth2 compatible token login, get an access token for future requests
     """
-    user = crud.user.authenticate(db, email=form_data.username, password=form_data.password)
+    user = await crud.async_user.authenticate(
+        db, email=form_data.username, password=form_data.password
+    )
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect email or password")
     elif not crud.user.is_active(user):
@@ -76,10 +77,10 @@ def recover_password(email: str, db: Session = Depends(deps.get_db)) -> Any:
 
 
 @router.post("/reset-password/", response_model=schemas.Msg)
-def reset_password(
+async def reset_password(
     token: str = Body(...),
     new_password: str = Body(...),
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_db),
 ) -> Any:
     """
     Reset password
@@ -87,7 +88,7 @@ def reset_password(
     email = verify_password_reset_token(token)
     if not email:
         raise HTTPException(status_code=400, detail="Invalid token")
-    user = crud.user.get_by_email(db, email=email)
+    user = await crud.async_user.get_by_email(db, email=email)
     if not user:
         raise HTTPException(
             status_code=404,
@@ -95,8 +96,8 @@ def reset_password(
         )
     elif not crud.user.is_active(user):
         raise HTTPException(status_code=400, detail="Inactive user")
-    hashed_password = get_password_hash(new_password)
+    hashed_password = await password_hasher.hash(new_password)
     user.hashed_password = hashed_password
     db.add(user)
-    db.commit()
+    await db.commit()
     return {"msg": "Password updated successfully"}
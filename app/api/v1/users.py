@@ -1,33 +1,60 @@
-from typing import Any, List
+from typing import Any, List, Optional
+from uuid import UUID
 
-from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
 from pydantic.networks import EmailStr
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, load_only, raiseload
 
 from app import crud, models, schemas
 from app.api import deps
 from app.config import settings
+from app.metrics import run_in_threadpool
+from app.serialize import user_rows
 from loguru import logger
 
 from app import utils
 
 router = APIRouter()
 
+# columns of schemas.User, the password hash stays in the database
+USER_OPTIONS = (
+    load_only(
+        models.User.email,
+        models.User.is_active,
+        models.User.is_verified,
+        models.User.is_superuser,
+        models.User.full_name,
+    ),
+    raiseload("*"),
+)
+
 
 @router.get("/", response_model=List[schemas.User])
-def read_users(
-    db: Session = Depends(deps.get_db),
-    skip: int = 0,
-    limit: int = 100,
+async def read_users(
+    db: AsyncSession = Depends(deps.get_async_read_db),
+    sort: str = "email",
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=500),
     # current_user: models.User = Depends(deps.get_current_active_superuser),
 ) -> Any:
     """
     Retrieve users.
+
+    Follow the `X-Next-Cursor`/`X-Prev-Cursor` response headers with `cursor`
+    to move between pages.
     """
-    users = crud.user.get_multi(db, skip=skip, limit=limit)
-    return users
+    try:
+        page = await crud.async_user.get_page(
+            db, sort_key=sort, cursor=cursor, limit=limit, columns=user_rows.columns
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return Response(
+        user_rows.encode(page.items), media_type="application/json", headers=page.headers
+    )
 
 
 @router.post("/", response_model=schemas.User)
@@ -77,7 +104,7 @@ def update_user_me(
 
 @router.get("/me", response_model=schemas.User)
 def read_user_me(
-    db: Session = Depends(deps.get_db),
+    db: Session = Depends(deps.get_read_db),
     current_user: models.User = Depends(deps.get_current_active_user),
 ) -> Any:
     """
@@ -87,9 +114,9 @@ def read_user_me(
 
 
 @router.post("/open", response_model=schemas.User)
-def create_user_open(
+async def create_user_open(
     *,
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_db),
     password: str = Body(...),
     email: EmailStr = Body(...),
     full_name: str = Body(None),
@@ -103,7 +130,7 @@ def create_user_open(
         raise HTTPException(
             status_code=403, detail="Open user registration is forbidden on this server."
         )
-    user = crud.user.get_by_email(db, email=email)
+    user = await crud.async_user.get_by_email(db, email=email)
     if user:
         raise HTTPException(
             status_code=400,
@@ -113,10 +140,16 @@ def create_user_open(
         password=password, email=email, full_name=full_name, is_hospital_staff=is_hospital_staff
     )
 
-    user = crud.user.create(db, obj_in=user_in)
+    user = await crud.async_user.create(db, obj_in=user_in)
     token = utils.generate_verification_token(user.id)
-    utils.send_new_account_email(email_to=user_in.email, username=user_in.email, token=token)
-    utils.send_new_account_info(
+    await run_in_threadpool(
+        utils.send_new_account_email,
+        email_to=user_in.email,
+        username=user_in.email,
+        token=token,
+    )
+    await run_in_threadpool(
+        utils.send_new_account_info,
         email_to=settings.EMAILS_FROM_EMAIL,
         username=user_in.email,
         full_name=user_in.full_name,
@@ -187,20 +220,19 @@ def cancel_me(
 
 
 @router.get("/{user_id}", response_model=schemas.User)
-def read_user_by_id(
-    user_id: str,
+async def read_user_by_id(
+    user_id: UUID,
     current_user: models.User = Depends(deps.get_current_active_user),
-    db: Session = Depends(deps.get_db),
+    db: AsyncSession = Depends(deps.get_async_read_db),
 ) -> Any:
     """
     Get a specific user by id.
     """
-    user = crud.user.get(db, id=user_id)
-    if user == current_user:
-        return user
+    if user_id == current_user.id:
+        return current_user
     if not crud.user.is_superuser(current_user):
         raise HTTPException(status_code=400, detail="The user doesn't have enough privileges.")
-    return user
+    return await crud.async_user.get(db, id=user_id, options=USER_OPTIONS)
 
 
 @router.put("/{user_id}", response_model=schemas.User)
@@ -0,0 +1,148 @@
+"""
+Small in-process caches
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.config import settings
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread safe LRU cache whose entries expire `ttl` seconds after being set"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def discard_if(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """drop the entries for which `predicate(key, value)` holds"""
+        with self._lock:
+            keys = [k for k, (_, v) in self._data.items() if predicate(k, v)]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+# digest of a verified access token -> snapshot of its user's columns, see
+# `deps.get_current_user`. Evicted locally on user update/removal, the TTL
+# bounds how long other workers may serve a stale snapshot.
+principal_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL
+)
+
+
+def evict_principal(user_id: Any) -> None:
+    principal_cache.discard_if(lambda _, snapshot: snapshot["id"] == user_id)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """weak comparison of `etag` with an If-None-Match header"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+    media_type: str
+
+    def response(self, if_none_match: Optional[str] = None) -> Response:
+        headers = {**self.headers, "ETag": self.etag, "Cache-Control": "no-cache"}
+        if etag_matches(if_none_match, self.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(self.body, media_type=self.media_type, headers=headers)
+
+
+class ResponseCache:
+    """
+    Rendered responses by path and query string, with a strong ETag each
+
+    `invalidate` bumps the version that is part of every key, so a response
+    still being rendered from data read before a write is never served.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.version = 0
+        self._responses = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def key(self, request: Request) -> Hashable:
+        return (self.version, request.url.path, tuple(sorted(request.query_params.multi_items())))
+
+    def get(self, key: Hashable) -> Optional[CachedResponse]:
+        return self._responses.get(key)
+
+    def set(
+        self,
+        key: Hashable,
+        body: bytes,
+        headers: Optional[Dict[str, str]] = None,
+        media_type: str = "application/json",
+    ) -> CachedResponse:
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        cached = CachedResponse(body, etag, dict(headers or {}), media_type)
+        self._responses.set(key, cached)
+        return cached
+
+    def invalidate(self) -> None:
+        self.version += 1
+        self._responses.clear()
+
+
+# GET /items pages, invalidated by item writes through `crud.item`. The TTL
+# bounds how long other workers serve a page from before the write.
+item_responses = ResponseCache(maxsize=settings.ITEM_CACHE_SIZE, ttl=settings.ITEM_CACHE_TTL)
@@ -1,19 +1,26 @@
 from app.schemas.item import ItemCreate
-from typing import Any, Dict, Generic, List, Optional, Type, TypeVar, Union
+from typing import Any, Dict, Generic, List, Optional, Sequence, Tuple, Type, TypeVar, Union
 from uuid import UUID
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 import sqlalchemy as sa
 from loguru import logger
-from app.utils import get_password_hash, verify_password
 
+from app.cache import evict_principal, item_responses
 from app.database import Base
+from app.hashing import password_hasher
+from app.pagination import Page, keyset_page, keyset_query
+from app import projections, spatial
 
-from app.models import User, Item
-from app.schemas import UserCreate, UserUpdate, ItemCreate, ItemUpdate
+from app.models import Bed, User, Item
+from app.schemas import BedCreate, UserCreate, UserUpdate, ItemCreate, ItemUpdate
 
 
+# loader options of a read: selectinload/joinedload/raiseload/load_only/...
+Options = Sequence[Any]
+
 ModelType = TypeVar("ModelType", bound=Base)
 CreateSchemaType = TypeVar("CreateSchemaType", bound=BaseModel)
 UpdateSchemaType = TypeVar("UpdateSchemaType", bound=BaseModel)
@@ -31,8 +38,11 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         """
         self.model = model
 
-    def get(self, db: Session, id: Any) -> Optional[ModelType]:
-        return db.query(self.model).filter(self.model.id == id).first()
+    # columns `get_page` may order by, each backed by a (column, id) index
+    sort_keys: Sequence[str] = ("id",)
+
+    def get(self, db: Session, id: Any, *, options: Options = ()) -> Optional[ModelType]:
+        return db.query(self.model).options(*options).filter(self.model.id == id).first()
 
     def get_multi(
         self,
@@ -42,16 +52,81 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         after_value=None,
         skip: int = 0,
         limit: int = 100,
+        options: Options = (),
     ) -> List[ModelType]:
-        q = db.query(self.model)
+        q = db.query(self.model).options(*options)
         if after_field:
-            q.order_by(getattr(self.model, after_field))
+            q = q.order_by(getattr(self.model, after_field))
         if after_value and after_field:
             q = q.filter(getattr(self.model, after_field) >= after_value)
         q = q.offset(skip).limit(limit)
         logger.debug(f"multi {self.model} {q}")
         return q.all()
 
+    def get_page(
+        self,
+        db: Session,
+        *,
+        sort_key: str = "id",
+        cursor: Optional[str] = None,
+        after_value: Any = None,
+        limit: int = 100,
+        columns: Optional[Sequence[Any]] = None,
+        options: Options = (),
+    ) -> Page:
+        """
+        Keyset paginated read, see `app.pagination`.
+
+        `cursor` is the `next_cursor`/`prev_cursor` of a previous page,
+        `after_value` seeks the first page to `sort_key >= after_value`.
+        With `columns` the page holds row tuples of those columns instead of
+        model instances, see `app.serialize`, otherwise `options` apply to
+        the loaded instances.
+        """
+        stmt, direction = self.page_query(
+            sort_key=sort_key,
+            cursor=cursor,
+            after_value=after_value,
+            limit=limit,
+            columns=columns,
+            options=options,
+        )
+        result = db.execute(stmt)
+        rows = result.scalars().all() if columns is None else result.all()
+        return keyset_page(
+            rows, sort_key=sort_key, limit=limit, direction=direction, has_cursor=bool(cursor)
+        )
+
+    def page_query(
+        self,
+        *,
+        sort_key: str,
+        cursor: Optional[str],
+        after_value: Any,
+        limit: int,
+        columns: Optional[Sequence[Any]] = None,
+        options: Options = (),
+    ) -> Tuple[sa.sql.Select, str]:
+        if sort_key not in self.sort_keys:
+            raise ValueError(f"Cannot sort by {sort_key!r}, expected one of {self.sort_keys}")
+        if columns is None:
+            stmt = sa.select(self.model).options(*options)
+        else:
+            # the page cursors are read from the sort key and id of the edge rows
+            selected = {column.key for column in columns}
+            keys = [getattr(self.model, k) for k in (sort_key, "id") if k not in selected]
+            stmt = sa.select(*columns, *keys)
+        stmt, direction = keyset_query(
+            stmt,
+            self.model,
+            sort_key=sort_key,
+            cursor=cursor,
+            after_value=after_value,
+            limit=limit,
+        )
+        logger.debug(f"page {self.model} {stmt}")
+        return stmt, direction
+
     def create(self, db: Session, *, obj_in: CreateSchemaType) -> ModelType:
         obj_in_data = jsonable_encoder(obj_in)
         db_obj = self.model(**obj_in_data)  # type: ignore
@@ -88,13 +163,15 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
 
 
 class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
+    sort_keys = ("email", "created", "id")
+
     def get_by_email(self, db: Session, *, email: str) -> Optional[User]:
         return db.query(User).filter(User.email == email).first()
 
     def create(self, db: Session, *, obj_in: UserCreate) -> User:
         db_obj = User(
             email=obj_in.email,
-            hashed_password=get_password_hash(obj_in.password),
+            hashed_password=password_hasher.hash_blocking(obj_in.password),
             full_name=obj_in.full_name,
             is_superuser=obj_in.is_superuser,
             is_active=obj_in.is_active,
@@ -113,17 +190,24 @@ class CRUDUser(CRUDBase[User, UserCreate, UserUpdate]):
         else:
             update_data = obj_in.dict(exclude_unset=True)
         if "password" in update_data:
-            hashed_password = get_password_hash(update_data["password"])
+            hashed_password = password_hasher.hash_blocking(update_data["password"])
             del update_data["password"]
             update_data["hashed_password"] = hashed_password
-        return super().update(db, db_obj=db_obj, obj_in=update_data)
+        user = super().update(db, db_obj=db_obj, obj_in=update_data)
+        evict_principal(user.id)
+        return user
+
+    def remove(self, db: Session, *, id: Any) -> User:
+        user = super().remove(db, id=id)
+        evict_principal(id)
+        return user
 
     def authenticate(self, db: Session, *, email: str, password: str) -> Optional[User]:
         user = self.get_by_email(db, email=email)
         logger.info(f"authenticating email {email} -> {user}")
         if not user:
             return None
-        if not verify_password(password, user.hashed_password):
+        if not password_hasher.verify_blocking(password, user.hashed_password):
             logger.error("password does not match")
             return None
         return user
@@ -139,6 +223,52 @@ user = CRUDUser(User)
 
 
 class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
+    sort_keys = ("doh_code", "name", "id")
+
+    def get_by_doh_code(
+        self, db: Session, *, doh_code: str, options: Options = ()
+    ) -> Optional[Item]:
+        return db.query(Item).options(*options).filter(Item.doh_code == doh_code).first()
+
+    def get_many(self, db: Session, ids: Sequence[Any], *, options: Options = ()) -> List[Item]:
+        """items by id, in the order of `ids`"""
+        if not ids:
+            return []
+        found = {obj.id: obj for obj in db.query(Item).options(*options).filter(Item.id.in_(ids))}
+        return [found[id] for id in ids if id in found]
+
+    def get_near(
+        self,
+        db: Session,
+        *,
+        lat: float,
+        lng: float,
+        radius: float,
+        k: int = 10,
+        options: Options = (),
+    ) -> List[Tuple[float, Item]]:
+        """k nearest items within `radius` km as `(distance, item)` pairs"""
+        nearest = spatial.ensure_loaded(db).near(lat, lng, radius=radius, k=k)
+        items = {
+            obj.id: obj
+            for obj in self.get_many(db, [id for _, id in nearest], options=options)
+        }
+        return [(distance, items[id]) for distance, id in nearest if id in items]
+
+    def get_in_bbox(
+        self,
+        db: Session,
+        *,
+        min_lat: float,
+        min_lng: float,
+        max_lat: float,
+        max_lng: float,
+        limit: int = 500,
+        options: Options = (),
+    ) -> List[Item]:
+        ids = spatial.ensure_loaded(db).bbox(min_lat, min_lng, max_lat, max_lng, limit=limit)
+        return self.get_many(db, ids, options=options)
+
     def get_by_code(self, db: Session, *, code: str) -> Optional[Item]:
         return db.query(Item).filter(Item.code == code).first()
 
@@ -152,6 +282,7 @@ class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
         db.add(db_obj)
         db.commit()
         db.refresh(db_obj)
+        item_responses.invalidate()
         return db_obj
 
     def update(
@@ -161,7 +292,126 @@ class CRUDItem(CRUDBase[Item, ItemCreate, ItemUpdate]):
             update_data = obj_in
         else:
             update_data = obj_in.dict(exclude_unset=True)
-        return super().update(db, db_obj=db_obj, obj_in=update_data)
+        item = super().update(db, db_obj=db_obj, obj_in=update_data)
+        item_responses.invalidate()
+        return item
+
+    def remove(self, db: Session, *, id: Any) -> Item:
+        item = super().remove(db, id=id)
+        item_responses.invalidate()
+        return item
 
 
 item = CRUDItem(Item)
+hospital = item
+
+
+class CRUDBed(CRUDBase[Bed, BedCreate, BedCreate]):
+    def get_latest(self, db: Session) -> List[Dict[str, Any]]:
+        """newest report of every hospital, from the bed_latest projection"""
+        return projections.get_latest(db)
+
+    def get_trend(self, db: Session, **kwargs: Any) -> Dict[str, Any]:
+        """vacancy over time from the bed_rollup tables, see `projections.get_trend`"""
+        return projections.get_trend(db, **kwargs)
+
+
+bed = CRUDBed(Bed)
+
+
+class AsyncCRUDBase(Generic[ModelType]):
+    def __init__(self, crud: CRUDBase):
+        """
+        CRUD object over an `AsyncSession`, mirroring the reads of the
+        synchronous `crud`.
+        """
+        self.crud = crud
+        self.model = crud.model
+
+    async def get(
+        self, db: AsyncSession, id: Any, *, options: Options = ()
+    ) -> Optional[ModelType]:
+        return await db.get(self.model, id, options=options)
+
+    async def get_multi(
+        self, db: AsyncSession, *, skip: int = 0, limit: int = 100, options: Options = ()
+    ) -> List[ModelType]:
+        stmt = (
+            sa.select(self.model)
+            .options(*options)
+            .order_by(self.model.id)
+            .offset(skip)
+            .limit(limit)
+        )
+        return (await db.execute(stmt)).scalars().all()
+
+    async def get_page(
+        self,
+        db: AsyncSession,
+        *,
+        sort_key: str = "id",
+        cursor: Optional[str] = None,
+        after_value: Any = None,
+        limit: int = 100,
+        columns: Optional[Sequence[Any]] = None,
+        options: Options = (),
+    ) -> Page:
+        """Keyset paginated read, see `CRUDBase.get_page`"""
+        stmt, direction = self.crud.page_query(
+            sort_key=sort_key,
+            cursor=cursor,
+            after_value=after_value,
+            limit=limit,
+            columns=columns,
+            options=options,
+        )
+        result = await db.execute(stmt)
+        rows = result.scalars().all() if columns is None else result.all()
+        return keyset_page(
+            rows, sort_key=sort_key, limit=limit, direction=direction, has_cursor=bool(cursor)
+        )
+
+
+class AsyncCRUDUser(AsyncCRUDBase[User]):
+    async def get_by_email(self, db: AsyncSession, *, email: str) -> Optional[User]:
+        return (await db.execute(sa.select(User).where(User.email == email))).scalars().first()
+
+    async def create(self, db: AsyncSession, *, obj_in: UserCreate) -> User:
+        db_obj = User(
+            email=obj_in.email,
+            hashed_password=await password_hasher.hash(obj_in.password),
+            full_name=obj_in.full_name,
+            is_superuser=obj_in.is_superuser,
+            is_active=obj_in.is_active,
+            is_verified=obj_in.is_verified,
+        )
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def authenticate(
+        self, db: AsyncSession, *, email: str, password: str
+    ) -> Optional[User]:
+        user = await self.get_by_email(db, email=email)
+        logger.info(f"authenticating email {email} -> {user}")
+        if not user:
+            return None
+        if not await password_hasher.verify(password, user.hashed_password):
+            logger.error("password does not match")
+            return None
+        return user
+
+
+async_user = AsyncCRUDUser(user)
+
+
+class AsyncCRUDItem(AsyncCRUDBase[Item]):
+    async def get_by_doh_code(
+        self, db: AsyncSession, *, doh_code: str, options: Options = ()
+    ) -> Optional[Item]:
+        stmt = sa.select(Item).options(*options).where(Item.doh_code == doh_code)
+        return (await db.execute(stmt)).scalars().first()
+
+
+async_item = AsyncCRUDItem(item)
@@ -1,15 +1,204 @@
-# import databases
-from sqlalchemy import create_engine, MetaData
+import time
+from typing import Any, Dict, List
+
+from sqlalchemy import create_engine, event, MetaData
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
+from app import metrics
 from app.config import settings
 
-engine = create_engine(
-    settings.SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def async_database_url(url: str) -> str:
+    """the asyncio driver variant of a database url"""
+    url = make_url(url)
+    return str(url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)))
+
+
+# pragma -> allowed values, checked before they are interpolated into SQL
+JOURNAL_MODES = {"delete", "truncate", "persist", "memory", "wal", "off"}
+SYNCHRONOUS = {"off", "normal", "full", "extra"}
+
+
+def is_sqlite_file(url: str) -> bool:
+    url = make_url(url)
+    return (
+        url.get_backend_name() == "sqlite"
+        and url.database not in (None, "", ":memory:")
+        and url.query.get("mode") != "memory"
+    )
+
+
+def sqlite_pragmas(read_only: bool = False) -> List[str]:
+    """the SQLITE_* connection profile as PRAGMA statements"""
+    pragmas = []
+    if settings.SQLITE_JOURNAL_MODE:
+        mode = settings.SQLITE_JOURNAL_MODE.lower()
+        if mode not in JOURNAL_MODES:
+            raise ValueError(f"unknown SQLite journal mode {mode}")
+        pragmas.append(f"PRAGMA journal_mode = {mode}")
+    if settings.SQLITE_SYNCHRONOUS:
+        synchronous = settings.SQLITE_SYNCHRONOUS.lower()
+        if synchronous not in SYNCHRONOUS:
+            raise ValueError(f"unknown SQLite synchronous setting {synchronous}")
+        pragmas.append(f"PRAGMA synchronous = {synchronous}")
+    for pragma, value in (
+        ("mmap_size", settings.SQLITE_MMAP_SIZE),
+        ("cache_size", settings.SQLITE_CACHE_SIZE),
+        ("busy_timeout", settings.SQLITE_BUSY_TIMEOUT_MS),
+    ):
+        if value is not None:
+            pragmas.append(f"PRAGMA {pragma} = {int(value)}")
+    if read_only:
+        pragmas.append("PRAGMA query_only = ON")
+    return pragmas
+
+
+pool_wait = metrics.Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time to get a connection from a database pool, connecting included",
+    ["pool"],
+)
+# newest pool of each name, dispose() replaces an engine's pool
+_pools: Dict[str, QueuePool] = {}
+
+
+class TimedPool:
+    """QueuePool mixin recording checkout waits in `pool_wait`"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _pools[self._orig_logging_name] = self
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_wait.observe(time.perf_counter() - started, self._orig_logging_name)
+
+
+class TimedQueuePool(TimedPool, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(TimedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def _pool_connections() -> Dict[Any, int]:
+    connections = {}
+    for name, pool in _pools.items():
+        connections[(name, "size")] = pool.size()
+        connections[(name, "idle")] = pool.checkedin()
+        connections[(name, "checked_out")] = pool.checkedout()
+        # counts up from -size while the pool fills
+        connections[(name, "overflow")] = max(pool.overflow(), 0)
+    return connections
+
+
+metrics.Collected(
+    "db_pool_connections",
+    "Connections of each database pool (size, idle, checked_out, overflow)",
+    ["pool", "state"],
+    collect=_pool_connections,
+)
+
+
+def engine_options(url: str, read_only: bool = False, asyncio: bool = False) -> Dict[str, Any]:
+    """create_engine arguments for the backend of `url`"""
+    backend = make_url(url).get_backend_name()
+    options: Dict[str, Any] = {}
+    if backend == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+        if not is_sqlite_file(url):
+            return options
+        # keep connections open, by default every checkout opens the file
+        # again and loses its page cache and pragmas
+    else:
+        # server connections go stale behind proxies and failovers
+        options["pool_pre_ping"] = settings.DATABASE_POOL_PRE_PING
+        options["pool_recycle"] = settings.DATABASE_POOL_RECYCLE
+        if read_only and backend == "postgresql":
+            options["execution_options"] = {"postgresql_readonly": True}
+    options["poolclass"] = TimedAsyncQueuePool if asyncio else TimedQueuePool
+    options["pool_logging_name"] = f"{'async_' if asyncio else ''}{'read' if read_only else 'write'}"
+    options["pool_size"] = settings.READ_POOL_SIZE if read_only else settings.DATABASE_POOL_SIZE
+    options["max_overflow"] = settings.DATABASE_MAX_OVERFLOW
+    options["pool_timeout"] = settings.DATABASE_POOL_TIMEOUT
+    return options
+
+
+def configure_engine(engine: Engine, read_only: bool = False) -> Engine:
+    """apply the SQLite connection profile to every new connection of `engine`"""
+    if engine.dialect.name != "sqlite":
+        return engine
+    pragmas = sqlite_pragmas(read_only)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return engine
+
+
+def read_database_url() -> str:
+    return settings.READ_DATABASE_URL or settings.SQLALCHEMY_DATABASE_URL
+
+
+engine = configure_engine(
+    create_engine(
+        settings.SQLALCHEMY_DATABASE_URL, **engine_options(settings.SQLALCHEMY_DATABASE_URL)
+    )
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+_async_url = settings.ASYNC_DATABASE_URL or async_database_url(settings.SQLALCHEMY_DATABASE_URL)
+async_engine = create_async_engine(_async_url, **engine_options(_async_url, asyncio=True))
+configure_engine(async_engine.sync_engine)
+AsyncSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=async_engine,
+    class_=AsyncSession,
+)
+
+# Read-only engines for GET routes, with their own pools so readers never
+# queue behind writers for a connection; on SQLite in WAL mode they do not
+# wait for the write lock either. An in-memory SQLite database only exists
+# within its connection, reads share the main engine there.
+_in_memory = make_url(settings.SQLALCHEMY_DATABASE_URL).get_backend_name() == "sqlite" and not (
+    is_sqlite_file(settings.SQLALCHEMY_DATABASE_URL)
+)
+if settings.READ_DATABASE_URL or not _in_memory:
+    read_engine = configure_engine(
+        create_engine(read_database_url(), **engine_options(read_database_url(), read_only=True)),
+        read_only=True,
+    )
+    _async_read_url = async_database_url(read_database_url())
+    async_read_engine = create_async_engine(
+        _async_read_url, **engine_options(_async_read_url, read_only=True, asyncio=True)
+    )
+    configure_engine(async_read_engine.sync_engine, read_only=True)
+else:
+    read_engine, async_read_engine = engine, async_engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+AsyncReadSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=async_read_engine,
+    class_=AsyncSession,
+)
 
 convention = {
     "ix": "ix_%(column_0_label)s",
@@ -19,7 +208,20 @@ convention = {
     "pk": "pk_%(table_name)s",
 }
 
+
+def dialect_insert(bind):
+    """
+    `insert()` construct of the bound dialect, which supports
+    `on_conflict_do_update`/`on_conflict_do_nothing` upserts.
+    """
+    if bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif bind.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"upserts are not supported on {bind.dialect.name}")
+    return insert
+
+
 Base = declarative_base()
 # Base.metadata = MetaData(naming_convention=convention)
-
-# async_db = databases.Database(settings.SQLALCHEMY_DATABASE_URL)
@@ -0,0 +1,141 @@
+"""
+bcrypt hashing off the event loop and the shared threadpool
+
+Password hashes run in a dedicated process pool, so a burst of logins burns
+its own cores instead of holding the GIL and threadpool slots that every
+other endpoint needs. At most `HASHING_MAX_IN_FLIGHT` hashes are admitted at
+a time; callers waiting longer than `HASHING_QUEUE_TIMEOUT` for a slot get
+`HashingOverloaded`, which the api turns into a 503.
+
+Sync code on the threadpool, the sync `crud.user`, goes through the same pool
+and admission with the `_blocking` variants. Without a running app, in
+scripts and `manage.py`, they hash inline.
+"""
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+
+from loguru import logger
+
+from app import metrics, utils
+from app.config import settings
+
+
+class HashingOverloaded(Exception):
+    pass
+
+
+queue_seconds = metrics.Histogram(
+    "password_hashing_queue_seconds", "Time password hashes wait for a slot"
+)
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_in_flight: int, queue_timeout: float):
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.in_flight = self.waiting = 0
+        self.completed = self.rejected = 0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn, forking a process that runs threads and an event loop is unsafe
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def start(self) -> None:
+        """bring the worker processes up before the first login"""
+        self._loop = asyncio.get_running_loop()
+        await asyncio.gather(
+            *(
+                asyncio.get_running_loop().run_in_executor(self.executor, time.sleep, 0)
+                for _ in range(self.workers)
+            )
+        )
+
+    async def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._loop = None
+
+    async def _run(self, fn: Callable, *args: Any) -> Any:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        queued_at = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning(f"password hashing overloaded, {self.waiting} waiting")
+            raise HashingOverloaded()
+        finally:
+            self.waiting -= 1
+
+        queue_seconds.observe(time.perf_counter() - queued_at)
+        self.in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self._slots.release()
+
+    def _run_blocking(self, fn: Callable, *args: Any) -> Any:
+        """`_run` from a thread other than the event loop's"""
+        loop = self._loop
+        if loop is None or not loop.is_running():
+            return fn(*args)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run_coroutine_threadsafe(self._run(fn, *args), loop).result()
+        # waiting on the loop from the loop itself would never return
+        return fn(*args)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(utils.get_password_hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(utils.verify_password, password, hashed_password)
+
+    def hash_blocking(self, password: str) -> str:
+        return self._run_blocking(utils.get_password_hash, password)
+
+    def verify_blocking(self, password: str, hashed_password: str) -> bool:
+        return self._run_blocking(utils.verify_password, password, hashed_password)
+
+
+password_hasher = PasswordHasher(
+    settings.HASHING_WORKERS, settings.HASHING_MAX_IN_FLIGHT, settings.HASHING_QUEUE_TIMEOUT
+)
+
+metrics.Collected(
+    "password_hashing_requests",
+    "Password hashes by state (in_flight, waiting)",
+    ["state"],
+    collect=lambda: {
+        ("in_flight",): password_hasher.in_flight,
+        ("waiting",): password_hasher.waiting,
+    },
+)
+metrics.Collected(
+    "password_hashing_total",
+    "Password hashes completed, or rejected as overloaded",
+    ["outcome"],
+    type="counter",
+    collect=lambda: {
+        ("completed",): password_hasher.completed,
+        ("rejected",): password_hasher.rejected,
+    },
+)
@@ -0,0 +1,137 @@
+"""
+Derivatives of uploaded images
+
+Field photos arrive as multi-megabyte camera files, rotated by their EXIF
+orientation and carrying metadata such as the GPS position. Once an upload
+completes a process pool renders small JPEG derivatives from it, upright and
+without metadata, so views never have to load the original. Derivatives are
+named after the sha256 of their source: content uploaded twice is processed
+once, and a derivative never changes, so it can be cached for good.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from app import metrics
+from app.config import settings
+from app.uploads import blob_path
+
+# longest side in pixels of each derivative
+DERIVATIVES = {"thumb": 320, "preview": 1280}
+JPEG_QUALITY = 82
+
+
+def derivative_path(digest: str, variant: str) -> Path:
+    return Path(settings.UPLOAD_DIR) / "derived" / digest[:2] / f"{digest}-{variant}.jpg"
+
+
+def remove_derivatives(digest: str) -> None:
+    for variant in DERIVATIVES:
+        derivative_path(digest, variant).unlink(missing_ok=True)
+
+
+def render_derivatives(source: str, targets: Dict[str, Tuple[str, int]]) -> bool:
+    """write `targets` {variant: (path, size)} from `source`, False if it is not an image"""
+    largest = max(size for _, size in targets.values())
+    try:
+        with Image.open(source) as original:
+            # let the JPEG decoder downscale while decoding, much cheaper than resizing
+            original.draft("RGB", (largest, largest))
+            image = ImageOps.exif_transpose(original)
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        return False
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    # largest first, each smaller one is resized from the previous
+    for path, size in sorted(targets.values(), key=lambda target: -target[1]):
+        image.thumbnail((size, size), Image.LANCZOS)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        # no exif/icc passed on, the derivative carries no metadata
+        image.save(tmp, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        os.replace(tmp, path)
+    return True
+
+
+class ImagePipeline:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.processed = self.skipped = self.failed = 0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    @staticmethod
+    def is_done(digest: str) -> bool:
+        return all(derivative_path(digest, variant).exists() for variant in DERIVATIVES)
+
+    def submit(self, digest: str) -> "asyncio.Future[bool]":
+        """derive `digest` in the background, resolves to False if it is not an image"""
+        loop = asyncio.get_running_loop()
+        future = self._pending.get(digest)
+        if future is not None:
+            return future
+        if self.is_done(digest):
+            self.skipped += 1
+            future = loop.create_future()
+            future.set_result(True)
+            return future
+
+        targets = {
+            variant: (str(derivative_path(digest, variant)), size)
+            for variant, size in DERIVATIVES.items()
+        }
+        future = loop.run_in_executor(
+            self.executor, render_derivatives, str(blob_path(digest)), targets
+        )
+        self._pending[digest] = future
+
+        def done(future: asyncio.Future) -> None:
+            del self._pending[digest]
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self.failed += 1
+                logger.opt(exception=future.exception()).error(f"deriving {digest} failed")
+            elif future.result():
+                self.processed += 1
+
+        future.add_done_callback(done)
+        return future
+
+
+pipeline = ImagePipeline(settings.IMAGE_WORKERS)
+
+metrics.Collected(
+    "image_derivatives_pending", "Uploads being derived", collect=lambda: {(): len(pipeline._pending)}
+)
+metrics.Collected(
+    "image_derivatives_total",
+    "Uploads derived, skipped as already derived, or failed",
+    ["outcome"],
+    type="counter",
+    collect=lambda: {
+        ("processed",): pipeline.processed,
+        ("skipped",): pipeline.skipped,
+        ("failed",): pipeline.failed,
+    },
+)
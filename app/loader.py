@@ -0,0 +1,378 @@
+"""
+Streaming bulk loaders for data feeds
+
+Records are read one at a time from JSON arrays, NDJSON or CSV files so memory
+stays flat regardless of the feed size, validated a batch at a time and
+written with a single executemany upsert per batch, or on PostgreSQL with a
+COPY into a staging table. Progress is checkpointed after every committed
+batch so a failed load resumes where it stopped.
+
+Facilities (`load_items`) are upserted on doh_code and replace the earlier
+copy. Their phone numbers are normalized through a cache, feeds send the
+same numbers over and over.
+"""
+import csv
+import enum
+import io
+import json
+import os
+import time
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional
+
+from loguru import logger
+from pydantic import ValidationError
+import sqlalchemy as sa
+
+from app import projections, schemas
+from app.database import dialect_insert, engine as default_engine
+from app.models import Bed, Item
+
+FORMATS = ("json", "ndjson", "csv")
+BED_KEY = ("hosp_id", "updated", "reportdate")  # uq_bed_hospid_upd_rep
+BED_FIELDS = (
+    "doh_id",
+    "hosp_id",
+    "icu_vacant",
+    "icu_occupied",
+    "isolbed_vacant",
+    "isolbed_occupied",
+    "beds_ward_vacant",
+    "beds_ward_occupied",
+    "reportdate",
+    "updated",
+    "source",
+)
+ITEM_FIELDS = (
+    "doh_code",
+    "name",
+    "address",
+    "region",
+    "municipality",
+    "lat",
+    "lng",
+    "map_url",
+    "phone",
+    "website",
+)
+
+
+class LoadStats(NamedTuple):
+    read: int
+    loaded: int
+    invalid: int
+    seconds: float
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.read / self.seconds if self.seconds else 0.0
+
+
+def guess_format(path: str) -> str:
+    suffix = Path(path).suffix.lower().lstrip(".")
+    if suffix in ("jsonl", "ndjson"):
+        return "ndjson"
+    if suffix in FORMATS:
+        return suffix
+    raise ValueError(f"Unable to guess the format of {path}, expected one of {FORMATS}")
+
+
+def iter_json_array(f, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """yield the elements of a top level JSON array without reading it whole"""
+    decoder = json.JSONDecoder()
+    buf, pos, eof, started = "", 0, False, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ",")):
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            fill()
+            continue
+        if not started:
+            if buf[pos] != "[":
+                raise ValueError("Expected a JSON array")
+            started, pos = True, pos + 1
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        if end == len(buf) and not eof:
+            # a scalar cut at the chunk boundary may decode short, read on
+            fill()
+            continue
+        yield obj
+        pos = end
+
+
+def read_records(path: str, fmt: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    fmt = fmt or guess_format(path)
+    if fmt == "csv":
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                yield {k: (v if v != "" else None) for k, v in row.items()}
+    elif fmt == "ndjson":
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif fmt == "json":
+        with open(path) as f:
+            yield from iter_json_array(f)
+    else:
+        raise ValueError(f"Unknown format {fmt}, expected one of {FORMATS}")
+
+
+class Checkpoint:
+    """number of source records already committed, tied to the source file"""
+
+    def __init__(self, source: str, path: Optional[str] = None):
+        self.path = Path(path or f"{source}.checkpoint")
+        stat = os.stat(source)
+        self.source = {"source": str(source), "size": stat.st_size, "mtime": stat.st_mtime}
+
+    def load(self) -> int:
+        if not self.path.exists():
+            return 0
+        data = json.loads(self.path.read_text())
+        if {k: data.get(k) for k in self.source} != self.source:
+            logger.warning(f"ignoring checkpoint {self.path}, the source file has changed")
+            return 0
+        return data["rows"]
+
+    def save(self, rows: int) -> None:
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({**self.source, "rows": rows}))
+        tmp.replace(self.path)
+
+    def clear(self) -> None:
+        if self.path.exists():
+            self.path.unlink()
+
+
+def validate_beds(records: List[Dict[str, Any]], hospitals: Dict[str, Any]) -> List[Dict]:
+    """validated rows ready for insert, invalid records are logged and dropped"""
+    rows = []
+    for record in records:
+        try:
+            bed = schemas.BedCreate.parse_obj(record)
+        except ValidationError as e:
+            logger.warning(f"invalid bed record {record}: {e}")
+            continue
+        row = bed.dict(include=set(BED_FIELDS))
+        if row["hosp_id"] is None:
+            row["hosp_id"] = hospitals.get(bed.doh_code)
+            if row["hosp_id"] is None:
+                logger.warning(f"unknown hospital doh_code {bed.doh_code}")
+                continue
+        rows.append(row)
+    return rows
+
+
+def validate_items(records: List[Dict[str, Any]]) -> List[Dict]:
+    """
+    Validated facility rows ready for insert, invalid records are logged and
+    dropped. Phone numbers are normalized once per distinct value, feeds and
+    repeated updates carry the same numbers over and over.
+    """
+    rows = []
+    for record in records:
+        try:
+            item = schemas.ItemCreate.parse_obj(record)
+        except ValidationError as e:
+            logger.warning(f"invalid item record {record}: {e}")
+            continue
+        rows.append(item.dict(include=set(ITEM_FIELDS)))
+    return rows
+
+
+def upsert_items(conn, rows: List[Dict]) -> None:
+    """upsert on doh_code, a facility sent again replaces the earlier copy"""
+    # one INSERT may not update a row twice, the last copy wins
+    rows = list({row["doh_code"]: row for row in rows}.values())
+    insert = dialect_insert(conn)
+    stmt = insert(Item.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["doh_code"],
+        set_={
+            **{c: stmt.excluded[c] for c in ITEM_FIELDS if c != "doh_code"},
+            "updated": datetime.utcnow(),
+        },
+    )
+    conn.execute(stmt, rows)
+
+
+def upsert_beds(conn, rows: List[Dict]) -> None:
+    """executemany upsert, a report sent again replaces the earlier copy"""
+    insert = dialect_insert(conn)
+    stmt = insert(Bed.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(BED_KEY),
+        set_={c: stmt.excluded[c] for c in BED_FIELDS if c not in BED_KEY},
+    )
+    conn.execute(stmt, rows)
+
+
+def _copy_value(value: Any) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def copy_beds(conn, rows: List[Dict]) -> None:
+    """
+    PostgreSQL upsert through COPY: rows are streamed into a temporary table
+    and merged with one INSERT .. SELECT, far cheaper than an executemany
+    for large batches. Same result as `upsert_beds`.
+    """
+    bed = Bed.__table__
+    stage = sa.Table(
+        "bed_stage",
+        sa.MetaData(),
+        *(sa.Column(c, bed.c[c].type) for c in BED_FIELDS),
+        prefixes=["TEMPORARY"],
+    )
+    stage.create(conn)
+    # one INSERT may not update a row twice, the last copy of a report wins
+    # as it does with executemany
+    rows = list({tuple(row[c] for c in BED_KEY): row for row in rows}.values())
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in rows:
+        writer.writerow([_copy_value(row[c]) for c in BED_FIELDS])
+    buf.seek(0)
+    with conn.connection.cursor() as cursor:
+        # unquoted empty fields are NULL in CSV format
+        cursor.copy_expert(
+            f"COPY {stage.name} ({', '.join(BED_FIELDS)}) FROM STDIN WITH (FORMAT csv)", buf
+        )
+
+    insert = dialect_insert(conn)
+    stmt = insert(bed).from_select(
+        [*BED_FIELDS, "created"], sa.select(*stage.c, sa.literal(datetime.utcnow(), sa.DateTime))
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(BED_KEY),
+        set_={c: stmt.excluded[c] for c in BED_FIELDS if c not in BED_KEY},
+    )
+    conn.execute(stmt)
+    stage.drop(conn)
+
+
+def write_beds(conn, rows: List[Dict]) -> None:
+    """the fastest upsert the backend has"""
+    if conn.dialect.name == "postgresql":
+        copy_beds(conn, rows)
+    else:
+        upsert_beds(conn, rows)
+
+
+def load_items(
+    path: str,
+    *,
+    fmt: Optional[str] = None,
+    batch_size: int = 1000,
+    resume: bool = True,
+    engine=None,
+) -> LoadStats:
+    """facilities keyed on doh_code, records without one are dropped"""
+    engine = engine or default_engine
+    checkpoint = Checkpoint(path)
+    start_at = checkpoint.load() if resume else 0
+    if start_at:
+        logger.info(f"resuming {path} after {start_at} records")
+
+    records = islice(read_records(path, fmt), start_at, None)
+    read = loaded = 0
+    started = time.perf_counter()
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        rows = []
+        for row in validate_items(batch):
+            if row["doh_code"] is None:
+                logger.warning(f"item record without doh_code {row}")
+                continue
+            rows.append(row)
+        if rows:
+            with engine.begin() as conn:
+                upsert_items(conn, rows)
+        read += len(batch)
+        loaded += len(rows)
+        checkpoint.save(start_at + read)
+        elapsed = time.perf_counter() - started
+        logger.info(f"{start_at + read} records, {loaded} loaded, {read / elapsed:.0f} rows/sec")
+
+    checkpoint.clear()
+    stats = LoadStats(read, loaded, read - loaded, time.perf_counter() - started)
+    logger.info(
+        f"loaded {stats.loaded} of {stats.read} records from {path} "
+        f"({stats.invalid} invalid) at {stats.rows_per_sec:.0f} rows/sec"
+    )
+    return stats
+
+
+def load_beds(
+    path: str,
+    *,
+    fmt: Optional[str] = None,
+    batch_size: int = 1000,
+    resume: bool = True,
+    engine=None,
+) -> LoadStats:
+    engine = engine or default_engine
+    checkpoint = Checkpoint(path)
+    start_at = checkpoint.load() if resume else 0
+    if start_at:
+        logger.info(f"resuming {path} after {start_at} records")
+
+    with engine.connect() as conn:
+        hospitals = dict(conn.execute(sa.select(Item.doh_code, Item.id)).all())
+
+    records = islice(read_records(path, fmt), start_at, None)
+    read = loaded = 0
+    started = time.perf_counter()
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            break
+        rows = validate_beds(batch, hospitals)
+        if rows:
+            with engine.begin() as conn:
+                write_beds(conn, rows)
+                projections.refresh_latest(conn, rows)
+                projections.refresh_rollups(conn, rows)
+            projections.latest_cache.clear()
+        read += len(batch)
+        loaded += len(rows)
+        checkpoint.save(start_at + read)
+        elapsed = time.perf_counter() - started
+        logger.info(f"{start_at + read} records, {loaded} loaded, {read / elapsed:.0f} rows/sec")
+
+    checkpoint.clear()
+    stats = LoadStats(read, loaded, read - loaded, time.perf_counter() - started)
+    logger.info(
+        f"loaded {stats.loaded} of {stats.read} records from {path} "
+        f"({stats.invalid} invalid) at {stats.rows_per_sec:.0f} rows/sec"
+    )
+    return stats
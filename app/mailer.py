@@ -0,0 +1,350 @@
+"""
+Outbound email queue
+
+`enqueue` stores a rendered message in the `outbound_email` table, so a request
+never waits on SMTP. A background worker claims due messages in batches, sends
+them over a small pool of reused SMTP connections and retries failures with
+exponential backoff until `MAIL_MAX_ATTEMPTS`. A claim is a lease: messages
+still `sending` `MAIL_LEASE_SECONDS` after they were claimed belong to a
+worker that died, and are queued again by whichever worker polls next.
+
+Bodies carry password reset and verification links, so the html of a message
+is blanked as soon as it is sent or given up on, and finished rows are
+deleted after `MAIL_RETENTION_DAYS`.
+"""
+import smtplib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from queue import Empty, LifoQueue
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+import emails
+from emails.template import JinjaTemplate
+from loguru import logger
+import sqlalchemy as sa
+
+from app import metrics
+from app.config import settings
+from app.database import SessionLocal
+from app.models import MailStatus, OutboundEmail
+
+# errors after which the SMTP connection is still usable
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException)
+# seconds between purges of finished messages
+PURGE_INTERVAL = 3600
+
+
+def is_permanent(error: Exception) -> bool:
+    """5xx replies will not get better with a retry"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class TemplateCache:
+    """compiled templates by path, reloaded when the file changes"""
+
+    def __init__(self):
+        self._templates: Dict[Path, Tuple[int, JinjaTemplate]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path: Union[str, Path]) -> JinjaTemplate:
+        path = Path(path)
+        mtime = path.stat().st_mtime_ns
+        entry = self._templates.get(path)
+        if entry is None or entry[0] != mtime:
+            template = JinjaTemplate(path.read_text())
+            template.template  # compile now, not on first render
+            entry = (mtime, template)
+            with self._lock:
+                self._templates[path] = entry
+        return entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._templates.clear()
+
+
+templates = TemplateCache()
+
+
+class SMTPPool:
+    """SMTP connections kept open between sends"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle: LifoQueue = LifoQueue()
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp_class = smtplib.SMTP_SSL if settings.SMTP_TLS else smtplib.SMTP
+        conn = smtp_class(settings.SMTP_HOST, settings.SMTP_PORT, timeout=settings.MAIL_SMTP_TIMEOUT)
+        if settings.SMTP_USER and settings.SMTP_PASSWORD:
+            conn.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+        return conn
+
+    def _checkout(self) -> smtplib.SMTP:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                return self._connect()
+            try:
+                if conn.noop()[0] == 250:
+                    return conn
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._discard(conn)
+
+    @staticmethod
+    def _discard(conn: smtplib.SMTP) -> None:
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    @contextmanager
+    def connection(self) -> Iterator[smtplib.SMTP]:
+        conn = self._checkout()
+        try:
+            yield conn
+        except BaseException:
+            self._discard(conn)
+            raise
+        if self._idle.qsize() < self.size:
+            self._idle.put(conn)
+        else:
+            self._discard(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                return
+            try:
+                conn.quit()
+            except (smtplib.SMTPException, OSError):
+                self._discard(conn)
+
+
+def enqueue(email_to: str, subject: str, html: str) -> int:
+    with SessionLocal() as db:
+        message = OutboundEmail(email_to=email_to, subject=subject, html=html)
+        db.add(message)
+        db.commit()
+        message_id = message.id
+    mail_worker.wake()
+    return message_id
+
+
+def render(message: OutboundEmail) -> str:
+    return emails.Message(
+        subject=message.subject,
+        html=message.html,
+        mail_from=(settings.EMAILS_FROM_NAME, settings.EMAILS_FROM_EMAIL),
+        mail_to=message.email_to,
+    ).as_string()
+
+
+class MailWorker:
+    def __init__(
+        self,
+        pool_size: int,
+        batch_size: int,
+        max_attempts: int,
+        retry_seconds: float,
+        poll_seconds: float,
+        retention: timedelta,
+        lease: timedelta,
+    ):
+        self.pool = SMTPPool(pool_size)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.poll_seconds = poll_seconds
+        self.retention = retention
+        self.lease = lease
+        self._purged_at: Optional[float] = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._senders: Optional[ThreadPoolExecutor] = None
+        self.sent = self.retried = self.failed = 0
+
+    def start(self) -> None:
+        if not settings.EMAILS_ENABLED or self._thread is not None:
+            return
+        self._stopping.clear()
+        self._senders = ThreadPoolExecutor(self.pool.size, thread_name_prefix="smtp")
+        self._thread = threading.Thread(target=self._run, name="mail-worker", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10) -> None:
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+        self._senders.shutdown()
+        self._senders = None
+        self.pool.close()
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            if self._purged_at is None or time.monotonic() - self._purged_at > PURGE_INTERVAL:
+                self._purged_at = time.monotonic()
+                try:
+                    self.purge()
+                except Exception:
+                    logger.exception("purging finished emails failed")
+            try:
+                claimed = self.process_batch()
+            except Exception:
+                logger.exception("mail worker batch failed")
+                claimed = 0
+            if claimed < self.batch_size:
+                self._wake.wait(self.poll_seconds)
+                self._wake.clear()
+
+    def _requeue_expired(self, db) -> int:
+        """queue again the messages whose claim outlived the lease"""
+        requeued = db.execute(
+            sa.update(OutboundEmail)
+            .where(
+                OutboundEmail.status == MailStatus.SENDING.value,
+                # claimed before claims carried a time
+                sa.or_(
+                    OutboundEmail.claimed_at < datetime.utcnow() - self.lease,
+                    OutboundEmail.claimed_at.is_(None),
+                ),
+            )
+            .values(status=MailStatus.PENDING.value, claim=None, claimed_at=None),
+            execution_options={"synchronize_session": False},
+        ).rowcount
+        if requeued:
+            logger.warning(f"requeued {requeued} emails left sending past their lease")
+        return requeued
+
+    def _claim(self, db) -> List[OutboundEmail]:
+        """mark a batch of due messages as ours, safe with several app workers"""
+        due = (
+            sa.select(OutboundEmail.id)
+            .where(
+                OutboundEmail.status == MailStatus.PENDING.value,
+                OutboundEmail.next_attempt_at <= datetime.utcnow(),
+            )
+            .order_by(OutboundEmail.next_attempt_at)
+            .limit(self.batch_size)
+        )
+        claim = uuid.uuid4().hex
+        self._requeue_expired(db)
+        db.execute(
+            sa.update(OutboundEmail)
+            .where(OutboundEmail.id.in_(due.scalar_subquery()))
+            .where(OutboundEmail.status == MailStatus.PENDING.value)
+            .values(status=MailStatus.SENDING.value, claim=claim, claimed_at=datetime.utcnow()),
+            execution_options={"synchronize_session": False},
+        )
+        db.commit()
+        return db.execute(sa.select(OutboundEmail).where(OutboundEmail.claim == claim)).scalars().all()
+
+    def _send_all(self, messages: List[OutboundEmail]) -> Dict[int, Optional[Exception]]:
+        """send over one pooled connection, the error per message id or None"""
+        results: Dict[int, Optional[Exception]] = {}
+        try:
+            with self.pool.connection() as conn:
+                for message in messages:
+                    try:
+                        conn.sendmail(settings.EMAILS_FROM_EMAIL, [message.email_to], render(message))
+                    except MESSAGE_ERRORS as e:
+                        results[message.id] = e
+                    else:
+                        results[message.id] = None
+        except (smtplib.SMTPException, OSError) as e:
+            results.update((m.id, e) for m in messages if m.id not in results)
+        return results
+
+    def process_batch(self) -> int:
+        """send one batch of due messages, returns how many were claimed"""
+        with SessionLocal() as db:
+            messages = self._claim(db)
+            if not messages:
+                return 0
+            chunks = [messages[i :: self.pool.size] for i in range(self.pool.size)]
+            results: Dict[int, Optional[Exception]] = {}
+            for chunk_results in self._senders.map(self._send_all, filter(None, chunks)):
+                results.update(chunk_results)
+            now = datetime.utcnow()
+            for message in messages:
+                error = results[message.id]
+                message.claim = message.claimed_at = None
+                if error is None:
+                    message.status = MailStatus.SENT.value
+                    message.sent_at = now
+                    message.html = ""
+                    self.sent += 1
+                    continue
+                message.attempts += 1
+                message.last_error = repr(error)
+                if message.attempts >= self.max_attempts or is_permanent(error):
+                    message.status = MailStatus.FAILED.value
+                    message.html = ""
+                    self.failed += 1
+                    logger.error(f"giving up on email {message.id} to {message.email_to}: {error}")
+                else:
+                    delay = self.retry_seconds * 2 ** (message.attempts - 1)
+                    message.status = MailStatus.PENDING.value
+                    message.next_attempt_at = now + timedelta(seconds=delay)
+                    self.retried += 1
+                    logger.warning(f"email {message.id} failed, retrying in {delay:.1f}s: {error}")
+            db.commit()
+        logger.info(f"mail batch of {len(messages)}, {sum(e is None for e in results.values())} sent")
+        return len(messages)
+
+    def purge(self, now: Optional[datetime] = None) -> int:
+        """delete sent and failed messages older than the retention, returns how many"""
+        cutoff = (now or datetime.utcnow()) - self.retention
+        with SessionLocal() as db:
+            deleted = db.execute(
+                sa.delete(OutboundEmail).where(
+                    OutboundEmail.status.in_((MailStatus.SENT.value, MailStatus.FAILED.value)),
+                    OutboundEmail.updated < cutoff,
+                ),
+                execution_options={"synchronize_session": False},
+            ).rowcount
+            db.commit()
+        if deleted:
+            logger.info(f"purged {deleted} finished emails")
+        return deleted
+
+
+mail_worker = MailWorker(
+    settings.MAIL_SMTP_POOL_SIZE,
+    settings.MAIL_BATCH_SIZE,
+    settings.MAIL_MAX_ATTEMPTS,
+    settings.MAIL_RETRY_SECONDS,
+    settings.MAIL_POLL_SECONDS,
+    timedelta(days=settings.MAIL_RETENTION_DAYS),
+    timedelta(seconds=settings.MAIL_LEASE_SECONDS),
+)
+
+metrics.Collected(
+    "mail_messages_total",
+    "Outbound emails sent, retried or given up on by this worker",
+    ["outcome"],
+    type="counter",
+    collect=lambda: {
+        ("sent",): mail_worker.sent,
+        ("retried",): mail_worker.retried,
+        ("failed",): mail_worker.failed,
+    },
+)
@@ -1,12 +1,11 @@
 from starlette.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from fastapi import Depends, FastAPI, Request, WebSocket
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.security import (
     APIKeyCookie,
 )
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from starlette.concurrency import run_until_first_complete
 
@@ -14,34 +13,61 @@ from loguru import logger
 
 from app import models
 
-# from app.database import async_db
+from app.database import async_engine, async_read_engine
 from app.api import api_router
 from app.api.deps import get_db
 from app.config import settings
-# from app import pubsub
+from app import metrics, profiler, pubsub, static
+from app.hashing import HashingOverloaded, password_hasher
+from app.images import pipeline as image_pipeline
+from app.mailer import mail_worker
 
 
+# lifespan events only run on the outer app, not on mounted sub-applications
 app = FastAPI(
+    on_startup=[
+        metrics.start_threadpool,
+        pubsub.broadcast.connect,
+        password_hasher.start,
+        mail_worker.start,
+        static.startup,
+    ],
+    on_shutdown=[
+        pubsub.broadcast.disconnect,
+        password_hasher.shutdown,
+        mail_worker.stop,
+        image_pipeline.shutdown,
+    ],
 )
 api = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
-    # on_startup=[pubsub.broadcast.connect],
-    # on_shutdown=[pubsub.broadcast.disconnect],
 )
 app.mount("/api", api)
 
 templates = Jinja2Templates(directory="templates")
-app.mount("/", StaticFiles(directory="web/public", html=True), name="root")
+# before the catch-all static mount
+app.add_route("/metrics", metrics.endpoint, include_in_schema=False)
+metrics.instrument_threadpool()
+app.mount(
+    "/", static.PrecompressedStaticFiles(directory=settings.STATIC_DIR, html=True), name="root"
+)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await async_engine.dispose()
+    await async_read_engine.dispose()
 
-# @app.on_event("startup")
-# async def startup():
-#     await async_db.connect()
 
+@api.exception_handler(HashingOverloaded)
+async def hashing_overloaded_handler(request: Request, exc: HashingOverloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many concurrent logins, please retry shortly"},
+        headers={"Retry-After": "1"},
+    )
 
-# @app.on_event("shutdown")
-# async def shutdown():
-#     await async_db.disconnect()
 
 # FIXME: When authentication exception is reaised, this is triggered
 # which prevents the client from capturing the error.
@@ -80,6 +106,23 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=[
+            "X-Next-Cursor",
+            "X-Prev-Cursor",
+            "ETag",
+            "X-SQL-Queries",
+            "X-SQL-Repeated",
+        ],
     )
 
 api.include_router(api_router, prefix=settings.API_V1_STR)
+
+app.add_middleware(
+    profiler.ProfilerMiddleware,
+    headers=settings.SQL_PROFILE_HEADERS,
+    sample_rate=settings.SQL_PROFILE_SAMPLE_RATE,
+    threshold=settings.SQL_PROFILE_REPEAT_THRESHOLD,
+)
+# outermost, so the time spent in the other middleware is measured too
+api.add_middleware(metrics.MetricsMiddleware, router=api.router)
+app.add_middleware(metrics.MetricsMiddleware, router=app.router)
@@ -0,0 +1,325 @@
+"""
+Prometheus metrics
+
+`MetricsMiddleware` wraps both the outer app and the mounted api. Every
+instance labels the request with the route template it matches
+(`/api/v1/items/{doh_code}` rather than the raw path, so the number of series
+stays bounded), the innermost label wins and the outermost instance records
+the request once: count by status, latency and response size histograms and
+the requests in flight. Event streams stay open for as long as the client
+listens, they are counted but kept out of the histograms.
+
+Modules register their own metrics, `Collected` ones are read from the
+component when `/metrics` is scraped, so collecting must be cheap and must
+not block. Threadpool calls are counted by the `run_in_threadpool` of this
+module. `instrument_threadpool` puts it in place of the framework's in the
+`THREADPOOL_CALLERS` modules, the one place the framework is patched, and
+gives the loop a default executor of `THREADPOOL_WORKERS` threads so the
+capacity is known.
+
+`/metrics` is only served with `METRICS_TOKEN` set, to scrapers sending it as
+a bearer token.
+"""
+import asyncio
+import hmac
+import importlib
+import math
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette import concurrency
+from starlette.requests import Request
+from starlette.responses import PlainTextResponse, Response
+from starlette.routing import Match, Mount, Router
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config import settings
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+UNMATCHED = "<unmatched>"
+
+Labels = Tuple[str, ...]
+
+registry: Dict[str, "Metric"] = {}
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        if name in registry:
+            raise ValueError(f"metric {name} is already registered")
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        registry[name] = self
+
+    def _labels(self, labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, labels))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{name}{labels} {_format(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Labels, float] = defaultdict(float)
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] += amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, self._labels(labels), value) for labels, value in values]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # per label set: count per bucket (not cumulative), sum
+        self._values: Dict[Labels, List[Any]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        samples = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(
+                    (f"{self.name}_bucket", self._labels(labels, ("le", _format(bound))), cumulative)
+                )
+            samples.append((f"{self.name}_sum", self._labels(labels), total))
+            samples.append((f"{self.name}_count", self._labels(labels), cumulative))
+        return samples
+
+
+class Collected(Metric):
+    """values read from `collect()` at scrape time, {labels: value}"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        *,
+        type: str = "gauge",
+        collect: Callable[[], Dict[Labels, float]],
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self.collect = collect
+
+    def samples(self):
+        return [(self.name, self._labels(labels), value) for labels, value in self.collect().items()]
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in list(registry.values())) + "\n"
+
+
+async def endpoint(request: Request) -> Response:
+    if not settings.METRICS_TOKEN:
+        return PlainTextResponse("Not Found", status_code=404)
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        token.encode(), settings.METRICS_TOKEN.encode()
+    ):
+        return PlainTextResponse(
+            "Unauthorized", status_code=401, headers={"WWW-Authenticate": "Bearer"}
+        )
+    return Response(render(), media_type=CONTENT_TYPE)
+
+
+requests_total = Counter(
+    "http_requests_total", "HTTP requests by route and status", ["method", "route", "status"]
+)
+request_seconds = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route"]
+)
+response_bytes = Histogram(
+    "http_response_size_bytes", "HTTP response body size", ["method", "route"], buckets=SIZE_BUCKETS
+)
+in_flight = Gauge("http_requests_in_flight", "HTTP requests being handled")
+
+
+def route_label(router: Router, scope: Scope) -> str:
+    """template of the route `scope` goes to, like the router picks it"""
+    partial = None
+    for route in router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            if isinstance(route, Mount):
+                return f"{scope.get('root_path', '')}{route.path}/*"
+            return f"{scope.get('root_path', '')}{route.path}"
+        if match == Match.PARTIAL and partial is None:
+            partial = f"{scope.get('root_path', '')}{route.path}"
+    return partial or UNMATCHED
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, router: Router):
+        self.app = app
+        self.router = router
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # mounted apps get the same scope dict, an outer instance already records
+        labels = scope.get("metrics")
+        if labels is not None:
+            labels["route"] = route_label(self.router, scope)
+            await self.app(scope, receive, send)
+            return
+        labels = scope["metrics"] = {"route": route_label(self.router, scope)}
+
+        status, size, content_length, streaming = 500, 0, 0, False
+
+        async def send_and_measure(message: Message) -> None:
+            nonlocal status, size, content_length, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                for key, value in message.get("headers", ()):
+                    if key == b"content-type" and value.startswith(b"text/event-stream"):
+                        streaming = True
+                    elif key == b"content-length":
+                        content_length = int(value)
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            else:
+                # path/zero-copy sends carry the file, not its bytes
+                size += content_length
+            await send(message)
+
+        method = scope["method"] if scope["method"] in METHODS else "OTHER"
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_and_measure)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_flight.dec()
+            requests_total.inc(method, labels["route"], str(status))
+            if not streaming:
+                request_seconds.observe(elapsed, method, labels["route"])
+                response_bytes.observe(size, method, labels["route"])
+
+
+threadpool_calls = Gauge(
+    "threadpool_calls",
+    "Calls handed to the default threadpool, by state (queued, running)",
+    ["state"],
+)
+threadpool_calls.set(0, "queued")
+threadpool_calls.set(0, "running")
+threadpool_max_workers = Gauge(
+    "threadpool_max_workers", "Threads of the default threadpool, busy when all run calls"
+)
+# modules that run sync endpoints and dependencies with the `run_in_threadpool`
+# they import from starlette.concurrency, checked by tests/test_metrics.py
+THREADPOOL_CALLERS = ("fastapi.routing", "fastapi.dependencies.utils", "starlette.routing")
+
+
+async def run_in_threadpool(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """`starlette.concurrency.run_in_threadpool`, counting the call while it waits and runs"""
+    # whoever pops the token takes the call out of the queue: the thread
+    # starting it, or the caller when it is cancelled before it started
+    token = [None]
+
+    def counted() -> Any:
+        try:
+            token.pop()
+        except IndexError:
+            return None
+        threadpool_calls.dec("queued")
+        threadpool_calls.inc("running")
+        try:
+            return func(*args, **kwargs)
+        finally:
+            threadpool_calls.dec("running")
+
+    threadpool_calls.inc("queued")
+    try:
+        return await concurrency.run_in_threadpool(counted)
+    finally:
+        try:
+            token.pop()
+        except IndexError:
+            pass
+        else:
+            threadpool_calls.dec("queued")
+
+
+def instrument_threadpool() -> None:
+    """count the threadpool calls of the framework, see `THREADPOOL_CALLERS`"""
+    for name in THREADPOOL_CALLERS:
+        module = importlib.import_module(name)
+        if not hasattr(module, "run_in_threadpool"):
+            raise ImportError(f"{name} no longer imports run_in_threadpool", name=name)
+        module.run_in_threadpool = run_in_threadpool
+
+
+async def start_threadpool() -> None:
+    """a default executor of known size, on startup"""
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(settings.THREADPOOL_WORKERS, thread_name_prefix="threadpool")
+    )
+    threadpool_max_workers.set(settings.THREADPOOL_WORKERS)
@@ -28,6 +28,9 @@ class User(Base, Timestamp):
     is_verified = sa.Column(sa.Boolean, default=False, nullable=False)
     is_superuser = sa.Column(sa.Boolean, default=False, nullable=False)
 
+    # keyset pagination seeks on (sort key, id)
+    __table_args__ = (sa.Index("ix_user_created_id", "created", "id"),)
+
     def __repr__(self):
         return f"<User id:{self.id}, email:{self.email} is_active:{self.is_active}>"
 
@@ -63,18 +66,31 @@ class Item(ByAt, Base):
     __tablename__ = "item"
 
     id = sa.Column(UUIDType(binary=False), default=uuid.uuid4, primary_key=True)
+    doh_code = sa.Column(sa.Unicode, unique=True, index=True)
     name = sa.Column(sa.Unicode, index=True)
     address = sa.Column(sa.Unicode)
+    region = sa.Column(sa.Unicode, index=True)
+    municipality = sa.Column(sa.Unicode, index=True)
     lat = sa.Column(sa.Float)
     lng = sa.Column(sa.Float)
     map_url = sa.Column(sa.Unicode)
     phone = sa.Column(sa.Unicode)
     website = sa.Column(URLType)
 
+    # keyset pagination seeks on (sort key, id)
+    __table_args__ = (
+        sa.Index("ix_item_doh_code_id", doh_code, id),
+        sa.Index("ix_item_name_id", name, id),
+    )
+
+    @property
+    def clean_name(self):
+        return self.name.strip() if self.name else self.name
+
     # functionality to find and group related questions display sequentially
     # with content displayed first
     def __repr__(self):
-        return f"<Hospital id:{self.id}, clean name:{self.clean_name}>"
+        return f"<Hospital id:{self.id}, doh_code:{self.doh_code}, name:{self.name}>"
 
     beds = relationship("Bed", backref="hospital")
 
@@ -95,7 +111,7 @@ class Bed(ByAt, Base):
 
     id = sa.Column(sa.Integer, primary_key=True)
     doh_id = sa.Column(sa.Integer, index=True)
-    hosp_id = sa.Column(UUIDType(binary=False), sa.ForeignKey("hospital.id"), index=True)
+    hosp_id = sa.Column(UUIDType(binary=False), sa.ForeignKey("item.id"), index=True)
     icu_vacant = sa.Column(sa.Integer)
     icu_occupied = sa.Column(sa.Integer)
     isolbed_vacant = sa.Column(sa.Integer)
@@ -109,6 +125,7 @@ class Bed(ByAt, Base):
     __table_args__ = (
         sa.UniqueConstraint("hosp_id", "updated", "reportdate", name="uq_bed_hospid_upd_rep"),
         sa.Index(None, updated.desc(), hosp_id),
+        sa.Index("ix_bed_hosp_id_reportdate", hosp_id, reportdate),
     )
 
     @hybrid_property
@@ -117,3 +134,116 @@ class Bed(ByAt, Base):
 
     def __repr__(self):
         return f"<Bed id:{self.id}, doh_id:{self.doh_id}, hosp_id: {self.hosp_id}, doh_code: {self.doh_code}>"
+
+
+class BedLatest(Base):
+    """
+    Latest bed report per hospital, a projection of Bed kept up to date on insert
+    """
+
+    __tablename__ = "bed_latest"
+
+    hosp_id = sa.Column(UUIDType(binary=False), sa.ForeignKey("item.id"), primary_key=True)
+    icu_vacant = sa.Column(sa.Integer)
+    icu_occupied = sa.Column(sa.Integer)
+    isolbed_vacant = sa.Column(sa.Integer)
+    isolbed_occupied = sa.Column(sa.Integer)
+    beds_ward_vacant = sa.Column(sa.Integer)
+    beds_ward_occupied = sa.Column(sa.Integer)
+    reportdate = sa.Column(sa.DateTime, nullable=False)
+    updated = sa.Column(sa.DateTime, nullable=False)
+    source = sa.Column(ChoiceType(SourceType))
+
+    def __repr__(self):
+        return f"<BedLatest hosp_id:{self.hosp_id}, reportdate:{self.reportdate}>"
+
+
+class BedRollup(Base):
+    """
+    Bed vacancy aggregated per time bucket, for a facility, region or municipality
+
+    Averages are `<metric>_sum / <metric>_count`, kept apart so buckets can be
+    merged into coarser ones.
+    """
+
+    __tablename__ = "bed_rollup"
+
+    scope = sa.Column(sa.String(16), primary_key=True)
+    key = sa.Column(sa.Unicode, primary_key=True)
+    granularity = sa.Column(sa.String(8), primary_key=True)
+    bucket = sa.Column(sa.DateTime, primary_key=True)
+    reports = sa.Column(sa.Integer, nullable=False, default=0)
+    icu_vacant_min = sa.Column(sa.Integer)
+    icu_vacant_max = sa.Column(sa.Integer)
+    icu_vacant_sum = sa.Column(sa.Integer)
+    icu_vacant_count = sa.Column(sa.Integer)
+    isolbed_vacant_min = sa.Column(sa.Integer)
+    isolbed_vacant_max = sa.Column(sa.Integer)
+    isolbed_vacant_sum = sa.Column(sa.Integer)
+    isolbed_vacant_count = sa.Column(sa.Integer)
+    beds_ward_vacant_min = sa.Column(sa.Integer)
+    beds_ward_vacant_max = sa.Column(sa.Integer)
+    beds_ward_vacant_sum = sa.Column(sa.Integer)
+    beds_ward_vacant_count = sa.Column(sa.Integer)
+
+    def __repr__(self):
+        return f"<BedRollup {self.scope}:{self.key} {self.granularity} {self.bucket}>"
+
+
+class Upload(ByAt, Base):
+    """
+    File sent to the upload endpoint, stored by content hash once complete
+    """
+
+    __tablename__ = "upload"
+
+    id = sa.Column(UUIDType(binary=False), default=uuid.uuid4, primary_key=True)
+    filename = sa.Column(sa.Unicode)
+    content_type = sa.Column(sa.String)
+    length = sa.Column(sa.BigInteger, nullable=False)
+    # bytes committed so far, the offset the next chunk has to start at
+    received = sa.Column(sa.BigInteger, nullable=False, default=0)
+    sha256 = sa.Column(sa.String(64), index=True)
+
+    # open uploads per user, expired partial uploads
+    __table_args__ = (sa.Index("ix_upload_created_by_sha256", "created_by_id", sha256),)
+
+    @property
+    def complete(self) -> bool:
+        return self.sha256 is not None
+
+    def __repr__(self):
+        return f"<Upload id:{self.id}, filename:{self.filename}, {self.received}/{self.length}>"
+
+
+class MailStatus(str, enum.Enum):
+    PENDING = "pending"
+    SENDING = "sending"
+    SENT = "sent"
+    FAILED = "failed"
+
+
+class OutboundEmail(Base, Timestamp):
+    """
+    Rendered email waiting in the outbound queue, see `app.mailer`
+    """
+
+    __tablename__ = "outbound_email"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    email_to = sa.Column(sa.Unicode, nullable=False)
+    subject = sa.Column(sa.Unicode, nullable=False)
+    html = sa.Column(sa.UnicodeText, nullable=False)
+    status = sa.Column(sa.String(8), nullable=False, default=MailStatus.PENDING.value)
+    attempts = sa.Column(sa.Integer, nullable=False, default=0)
+    next_attempt_at = sa.Column(sa.DateTime, nullable=False, default=datetime.utcnow)
+    # token of the worker batch that claimed the message, and when
+    claim = sa.Column(sa.String(32))
+    claimed_at = sa.Column(sa.DateTime)
+    last_error = sa.Column(sa.Unicode)
+    sent_at = sa.Column(sa.DateTime)
+
+    __table_args__ = (sa.Index("ix_outbound_email_status_next", status, next_attempt_at),)
+
+    def __repr__(self):
+        return f"<OutboundEmail id:{self.id}, to:{self.email_to}, status:{self.status}>"
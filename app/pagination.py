@@ -0,0 +1,152 @@
+"""
+Keyset (cursor) pagination helpers
+https://use-the-index-luke.com/no-offset
+
+Cursors are opaque, signed tokens that encode the (sort key, id) tuple of the
+row at the edge of a page, so the next page is a `WHERE (k, id) > (:k, :id)`
+seek on the composite index instead of an ever growing OFFSET.
+
+Nullable sort keys order NULLs last, the way a default btree index stores
+them. A row tuple comparison is never true for a NULL key, so those rows are
+sought with explicit IS NULL conditions and the cursor carries the NULL.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+from datetime import datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import sqlalchemy as sa
+from fastapi.encoders import jsonable_encoder
+
+from app.config import settings
+
+NEXT = "next"
+PREV = "prev"
+SIGNATURE_SIZE = 16
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Page(NamedTuple):
+    items: List[Any]
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.next_cursor:
+            headers["X-Next-Cursor"] = self.next_cursor
+        if self.prev_cursor:
+            headers["X-Prev-Cursor"] = self.prev_cursor
+        return headers
+
+
+def _sign(raw: bytes) -> bytes:
+    return hmac.new(settings.SECRET_KEY.encode(), raw, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+
+def encode_cursor(sort_key: str, values: Tuple[Any, Any], direction: str = NEXT) -> str:
+    raw = json.dumps(
+        {"k": sort_key, "v": jsonable_encoder(values), "d": direction}, separators=(",", ":")
+    ).encode()
+    return base64.urlsafe_b64encode(_sign(raw) + raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        blob = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    except (binascii.Error, ValueError) as e:
+        raise InvalidCursor("Malformed cursor") from e
+    signature, raw = blob[:SIGNATURE_SIZE], blob[SIGNATURE_SIZE:]
+    if not hmac.compare_digest(signature, _sign(raw)):
+        raise InvalidCursor("Invalid cursor signature")
+    payload = json.loads(raw)
+    if payload.get("d") not in (NEXT, PREV) or len(payload.get("v") or ()) != 2:
+        raise InvalidCursor("Malformed cursor")
+    return payload
+
+
+def _coerce(column, value: Any) -> Any:
+    if value is not None and isinstance(column.type, sa.DateTime):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def _seek(column, id_column, key: Any, id: Any, direction: str):
+    """rows after (NEXT) or before (PREV) the `(key, id)` edge row, NULL keys last"""
+    if not column.nullable:
+        seek = sa.tuple_(column, id_column)
+        return seek > (key, id) if direction == NEXT else seek < (key, id)
+    if key is None:
+        if direction == NEXT:
+            return sa.and_(column.is_(None), id_column > id)
+        return sa.or_(column.isnot(None), sa.and_(column.is_(None), id_column < id))
+    seek = sa.tuple_(column, id_column)
+    if direction == NEXT:
+        return sa.or_(seek > (key, id), column.is_(None))
+    return seek < (key, id)
+
+
+def keyset_query(
+    stmt,
+    model,
+    *,
+    sort_key: str,
+    cursor: Optional[str] = None,
+    after_value: Any = None,
+    limit: int = 100,
+):
+    """
+    Apply the keyset seek, ordering and limit to a `select()` statement.
+
+    Fetches one extra row so `keyset_page` can tell whether another page exists.
+    Returns the statement and the direction to hand over to `keyset_page`.
+    """
+    column = getattr(model, sort_key)
+    direction = NEXT
+    if cursor:
+        payload = decode_cursor(cursor)
+        if payload["k"] != sort_key:
+            raise InvalidCursor(f"Cursor was issued for sort key {payload['k']!r}")
+        direction = payload["d"]
+        key, id = payload["v"]
+        stmt = stmt.where(_seek(column, model.id, _coerce(column, key), id, direction))
+    elif after_value is not None:
+        if column.nullable:
+            stmt = stmt.where(sa.or_(column >= after_value, column.is_(None)))
+        else:
+            stmt = stmt.where(column >= after_value)
+
+    if direction == NEXT:
+        stmt = stmt.order_by(column.asc().nulls_last(), model.id.asc())
+    else:
+        stmt = stmt.order_by(column.desc().nulls_first(), model.id.desc())
+    return stmt.limit(limit + 1), direction
+
+
+def keyset_page(
+    rows: List[Any], *, sort_key: str, limit: int, direction: str, has_cursor: bool
+) -> Page:
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == PREV:
+        rows.reverse()
+    if not rows:
+        return Page(rows, None, None)
+
+    def edge(row, to):
+        return encode_cursor(sort_key, (getattr(row, sort_key), row.id), to)
+
+    if direction == NEXT:
+        next_cursor = edge(rows[-1], NEXT) if has_more else None
+        prev_cursor = edge(rows[0], PREV) if has_cursor else None
+    else:
+        next_cursor = edge(rows[-1], NEXT)
+        prev_cursor = edge(rows[0], PREV) if has_more else None
+    return Page(rows, next_cursor, prev_cursor)
@@ -0,0 +1,150 @@
+"""
+Per request SQL profile
+
+Lazy relationships (`Bed.hospital` behind `Bed.doh_code`, the `ByAt`
+`created_by`/`modified_by`, `Item.beds`) make it easy for a list endpoint to
+run one query per row. `ProfilerMiddleware` gives each profiled request a
+`QueryProfile` through a context variable, engine events add every statement
+to it: sync endpoints run in the threadpool with a copy of the context and
+the asyncio engines execute within the request task, so both are seen.
+Statements are grouped by shape, with IN lists collapsed, and a shape run
+SQL_PROFILE_REPEAT_THRESHOLD times or more is reported as a likely N+1.
+
+With SQL_PROFILE_HEADERS (development) every response carries the profile as
+`Server-Timing` and `X-SQL-*` headers. In production SQL_PROFILE_SAMPLE_RATE
+of the requests are profiled and logged. Requests that are not profiled only
+cost a context variable lookup per statement.
+"""
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# a bound parameter in the qmark, pyformat, numeric (asyncpg) or named style
+PARAM = r"\s*(?:\?|%\(\w+\)s|\$\d+|:\w+)\s*"
+# expanded IN (?, ?, ?) lists vary in length per call, not per shape
+IN_LIST = re.compile(rf"\((?:{PARAM},)+{PARAM}\)")
+SPACE = re.compile(r"\s+")
+SELECT_LIST = re.compile(r"^SELECT .+? FROM ", re.IGNORECASE)
+# statement text kept in headers and logs
+SHAPE_LENGTH = 120
+
+_profile: ContextVar[Optional["QueryProfile"]] = ContextVar("query_profile", default=None)
+
+
+def shape(statement: str) -> str:
+    return IN_LIST.sub("(?)", SPACE.sub(" ", statement).strip())
+
+
+def summary(shape: str) -> str:
+    """a shape short enough for a header, the FROM and WHERE tell more than the columns"""
+    return SELECT_LIST.sub("SELECT ... FROM ", shape)[:SHAPE_LENGTH]
+
+
+class QueryProfile:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.shapes: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, statement: str, seconds: float) -> None:
+        statement = shape(statement)
+        with self._lock:
+            self.queries += 1
+            self.seconds += seconds
+            self.shapes[statement] += 1
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """shapes run at least `threshold` times, most frequent first"""
+        with self._lock:
+            return [(s, n) for s, n in self.shapes.most_common() if n >= threshold]
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _profile.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    profile = _profile.get()
+    if profile is None:
+        return
+    started = conn.info.get("query_started")
+    if started:
+        profile.add(statement, time.perf_counter() - started.pop())
+
+
+@event.listens_for(Engine, "handle_error")
+def _execute_failed(exception_context):
+    started = exception_context.connection and exception_context.connection.info.get(
+        "query_started"
+    )
+    if started:
+        started.pop()
+
+
+class ProfilerMiddleware:
+    def __init__(self, app: ASGIApp, headers: bool, sample_rate: float, threshold: int):
+        self.app = app
+        self.headers = headers
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        sampled = bool(self.sample_rate) and random.random() < self.sample_rate
+        if not (sampled or self.headers):
+            await self.app(scope, receive, send)
+            return
+
+        profile = QueryProfile()
+        token = _profile.set(profile)
+
+        async def send_with_profile(message: Message) -> None:
+            if message["type"] == "http.response.start" and self.headers:
+                headers = MutableHeaders(scope=message)
+                repeated = profile.repeated(self.threshold)
+                headers["Server-Timing"] = (
+                    f'db;dur={profile.seconds * 1000:.1f};desc="{profile.queries} queries"'
+                )
+                headers["X-SQL-Queries"] = str(profile.queries)
+                if repeated:
+                    statement, count = repeated[0]
+                    headers["X-SQL-Repeated"] = f"{count}x {summary(statement)}"
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            _profile.reset(token)
+            self.report(scope, profile, sampled)
+
+    def report(self, scope: Scope, profile: QueryProfile, sampled: bool) -> None:
+        """log sampled requests, and N+1 suspects of every profiled one"""
+        repeated = profile.repeated(self.threshold)
+        if not (repeated or (sampled and profile.queries)):
+            return
+        route = (scope.get("metrics") or {}).get("route") or scope["path"]
+        message = (
+            f"{scope['method']} {route}: {profile.queries} queries "
+            f"in {profile.seconds * 1000:.1f}ms"
+        )
+        if repeated:
+            shapes = "; ".join(f"{n}x {summary(s)}" for s, n in repeated[:3])
+            logger.warning(f"{message}, likely N+1: {shapes}")
+        else:
+            logger.info(message)
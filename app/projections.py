@@ -0,0 +1,364 @@
+"""
+Read-optimised projections of the Bed history
+
+`bed_latest` holds the newest report of every hospital. It is updated in the
+same transaction as the Bed insert, from the ORM through a mapper event and
+from bulk loads through `refresh_latest`, so "what is free right now" is a
+primary key scan instead of a max-per-group query over the whole history.
+
+`bed_rollup` holds hourly, daily and weekly vacancy aggregates per facility,
+region and municipality for trend charts. Every write recomputes only the
+buckets it touched: hours from the raw reports, days from hours, weeks from
+days and regions/municipalities from their facilities, so reloading a report
+is idempotent.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session, object_session
+
+from app.cache import TTLCache
+from app.config import settings
+from app.database import dialect_insert
+from app.models import Bed, BedLatest, BedRollup, Item
+
+LATEST_FIELDS = (
+    "icu_vacant",
+    "icu_occupied",
+    "isolbed_vacant",
+    "isolbed_occupied",
+    "beds_ward_vacant",
+    "beds_ward_occupied",
+    "reportdate",
+    "updated",
+    "source",
+)
+
+METRICS = ("icu_vacant", "isolbed_vacant", "beds_ward_vacant")
+STATS = ("min", "max", "sum", "count")
+SCOPES = ("facility", "region", "municipality")
+GRANULARITIES = {
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+}
+# OR-ed (key, time range) conditions per query
+RANGE_CHUNK = 200
+
+latest_cache = TTLCache(maxsize=1, ttl=settings.BED_LATEST_CACHE_TTL)
+
+
+def _newest_per_hospital(rows: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    newest: Dict[Any, Dict[str, Any]] = {}
+    for row in rows:
+        current = newest.get(row["hosp_id"])
+        if current is None or (row["reportdate"], row["updated"]) >= (
+            current["reportdate"],
+            current["updated"],
+        ):
+            newest[row["hosp_id"]] = row
+    return list(newest.values())
+
+
+def refresh_latest(conn, rows: Iterable[Dict[str, Any]]) -> None:
+    """
+    Upsert bed report rows into `bed_latest`, run it in the transaction
+    that inserts them. Rows older than the current latest report are ignored.
+    """
+    rows = [
+        {"hosp_id": row["hosp_id"], **{f: row.get(f) for f in LATEST_FIELDS}}
+        for row in _newest_per_hospital(
+            row for row in rows if row["hosp_id"] is not None and row["reportdate"] is not None
+        )
+    ]
+    if not rows:
+        return
+    table = BedLatest.__table__
+    stmt = dialect_insert(conn)(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.hosp_id],
+        set_={f: stmt.excluded[f] for f in LATEST_FIELDS},
+        where=sa.tuple_(table.c.reportdate, table.c.updated)
+        <= sa.tuple_(stmt.excluded.reportdate, stmt.excluded.updated),
+    )
+    conn.execute(stmt, rows)
+
+
+def rebuild_latest(conn) -> None:
+    """recompute `bed_latest` from the whole Bed history"""
+    conn.execute(BedLatest.__table__.delete())
+    columns = [Bed.hosp_id, *(getattr(Bed, f) for f in LATEST_FIELDS)]
+    result = conn.execution_options(stream_results=True).execute(
+        sa.select(*columns).where(Bed.hosp_id.isnot(None), Bed.reportdate.isnot(None))
+    )
+    for chunk in result.mappings().partitions(10000):
+        refresh_latest(conn, chunk)
+
+
+def get_latest(db: Session) -> List[Dict[str, Any]]:
+    """current availability of every hospital with a report, cached"""
+
+    def query():
+        stmt = sa.select(
+            Item.doh_code,
+            Item.name,
+            *(c for c in BedLatest.__table__.c),
+        ).join(Item, Item.id == BedLatest.hosp_id)
+        return [dict(row) for row in db.execute(stmt).mappings()]
+
+    return latest_cache.get_or_set("all", query)
+
+
+def floor_bucket(granularity: str, dt: datetime) -> datetime:
+    if granularity == "hour":
+        return dt.replace(minute=0, second=0, microsecond=0)
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return day
+    return day - timedelta(days=day.weekday())
+
+
+def _empty_stats() -> Dict[str, Any]:
+    stats = {f"{m}_{s}": None for m in METRICS for s in STATS}
+    stats.update({f"{m}_count": 0 for m in METRICS}, reports=0)
+    return stats
+
+
+def _add(stats: Dict[str, Any], reports: int, values) -> None:
+    """fold `values`, a metric -> (min, max, sum, count) mapping, into `stats`"""
+    stats["reports"] += reports
+    for m in METRICS:
+        low, high, total, count = values[m]
+        if not count:
+            continue
+        if stats[f"{m}_count"]:
+            low = min(low, stats[f"{m}_min"])
+            high = max(high, stats[f"{m}_max"])
+            total += stats[f"{m}_sum"]
+        stats.update(
+            {
+                f"{m}_min": low,
+                f"{m}_max": high,
+                f"{m}_sum": total,
+                f"{m}_count": stats[f"{m}_count"] + count,
+            }
+        )
+
+
+def _ranges(buckets: Iterable[Tuple[Hashable, datetime]], step: timedelta):
+    """smallest [start, end) time range per key covering its buckets"""
+    ranges: Dict[Hashable, List[datetime]] = {}
+    for key, bucket in buckets:
+        span = ranges.setdefault(key, [bucket, bucket])
+        span[0], span[1] = min(span[0], bucket), max(span[1], bucket)
+    return [(key, low, high + step) for key, (low, high) in ranges.items()]
+
+
+def _in_ranges(ranges, key_column, time_column):
+    for i in range(0, len(ranges), RANGE_CHUNK):
+        yield sa.or_(
+            *(
+                sa.and_(key_column == key, time_column >= low, time_column < high)
+                for key, low, high in ranges[i : i + RANGE_CHUNK]
+            )
+        )
+
+
+def _read_reports(conn, buckets: Set[Tuple[Any, datetime]]):
+    """hourly stats of the touched (hosp_id, hour) buckets from raw reports"""
+    stats = defaultdict(_empty_stats)
+    columns = [Bed.hosp_id, Bed.reportdate, *(getattr(Bed, m) for m in METRICS)]
+    ranges = _ranges(buckets, GRANULARITIES["hour"])
+    for condition in _in_ranges(ranges, Bed.hosp_id, Bed.reportdate):
+        for row in conn.execute(sa.select(*columns).where(condition)).mappings():
+            bucket = (row["hosp_id"], floor_bucket("hour", row["reportdate"]))
+            if bucket in buckets:
+                values = {m: (row[m], row[m], row[m], int(row[m] is not None)) for m in METRICS}
+                _add(stats[bucket], 1, values)
+    return stats
+
+
+def _read_rollups(conn, scope: str, granularity: str, ranges, bucket_of):
+    """rollup rows of `scope` at `granularity` in `ranges`, merged by `bucket_of(row)`"""
+    stats = defaultdict(_empty_stats)
+    table = BedRollup.__table__
+    for condition in _in_ranges(ranges, table.c.key, table.c.bucket):
+        stmt = sa.select(table).where(
+            table.c.scope == scope, table.c.granularity == granularity, condition
+        )
+        for row in conn.execute(stmt).mappings():
+            bucket = bucket_of(row)
+            if bucket is not None:
+                values = {m: tuple(row[f"{m}_{s}"] for s in STATS) for m in METRICS}
+                _add(stats[bucket], row["reports"], values)
+    return stats
+
+
+def _write_rollups(conn, scope: str, granularity: str, stats) -> None:
+    if not stats:
+        return
+    table = BedRollup.__table__
+    primary_key = [c.name for c in table.primary_key]
+    rows = [
+        {"scope": scope, "key": key, "granularity": granularity, "bucket": bucket, **values}
+        for (key, bucket), values in stats.items()
+    ]
+    stmt = dialect_insert(conn)(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=primary_key,
+        set_={c: stmt.excluded[c] for c in rows[0] if c not in primary_key},
+    )
+    conn.execute(stmt, rows)
+
+
+def refresh_rollups(conn, rows: Iterable[Dict[str, Any]]) -> None:
+    """
+    Recompute the rollup buckets touched by bed report rows, run it in the
+    transaction that inserts them.
+    """
+    touched = {
+        (row["hosp_id"], floor_bucket("hour", row["reportdate"]))
+        for row in rows
+        if row["hosp_id"] is not None and row["reportdate"] is not None
+    }
+    if not touched:
+        return
+    hospitals = {hosp_id for hosp_id, _ in touched}
+    areas = {
+        id: {"region": region, "municipality": municipality}
+        for id, region, municipality in conn.execute(
+            sa.select(Item.id, Item.region, Item.municipality).where(Item.id.in_(hospitals))
+        )
+    }
+
+    previous = None
+    for granularity, step in GRANULARITIES.items():
+        buckets = {(hosp_id, floor_bucket(granularity, b)) for hosp_id, b in touched}
+        if previous is None:
+            facility = _read_reports(conn, buckets)
+        else:
+            # coarser buckets are merged from the finer rollups just written
+            facility = _read_rollups(
+                conn,
+                "facility",
+                previous,
+                _ranges(((str(h), b) for h, b in buckets), step),
+                lambda row: (row["key"], floor_bucket(granularity, row["bucket"])),
+            )
+        _write_rollups(
+            conn, "facility", granularity, {(str(h), b): v for (h, b), v in facility.items()}
+        )
+
+        for scope in ("region", "municipality"):
+            area_buckets = {
+                (areas[h][scope], b) for h, b in buckets if areas.get(h, {}).get(scope)
+            }
+            if not area_buckets:
+                continue
+            members = defaultdict(list)
+            for id, area in conn.execute(
+                sa.select(Item.id, getattr(Item, scope)).where(
+                    getattr(Item, scope).in_({area for area, _ in area_buckets})
+                )
+            ):
+                members[area].append(str(id))
+            member_area = {key: area for area, keys in members.items() for key in keys}
+            area_ranges = {area: (low, high) for area, low, high in _ranges(area_buckets, step)}
+            ranges = [(key, *area_ranges[area]) for key, area in member_area.items()]
+            stats = _read_rollups(
+                conn,
+                "facility",
+                granularity,
+                ranges,
+                lambda row: (
+                    (member_area[row["key"]], row["bucket"])
+                    if (member_area[row["key"]], row["bucket"]) in area_buckets
+                    else None
+                ),
+            )
+            _write_rollups(conn, scope, granularity, stats)
+        touched, previous = buckets, granularity
+
+
+def rebuild_rollups(conn) -> None:
+    """recompute `bed_rollup` from the whole Bed history"""
+    conn.execute(BedRollup.__table__.delete())
+    result = conn.execution_options(stream_results=True).execute(
+        sa.select(Bed.hosp_id, Bed.reportdate)
+        .where(Bed.hosp_id.isnot(None), Bed.reportdate.isnot(None))
+        .order_by(Bed.reportdate)
+    )
+    for chunk in result.mappings().partitions(10000):
+        refresh_rollups(conn, chunk)
+
+
+def pick_granularity(start: datetime, end: datetime, max_points: int) -> str:
+    """finest granularity that still covers start..end within max_points buckets"""
+    for granularity, step in GRANULARITIES.items():
+        if (end - start) / step <= max_points:
+            return granularity
+    return granularity
+
+
+def get_trend(
+    db: Session,
+    *,
+    scope: str,
+    key: str,
+    start: datetime,
+    end: datetime,
+    max_points: int = 500,
+    granularity: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Vacancy min/max/avg over time. Unless `granularity` is given, the series
+    comes from the finest rollup that covers start..end in `max_points` buckets.
+    """
+    granularity = granularity or pick_granularity(start, end, max_points)
+    table = BedRollup.__table__
+    stmt = (
+        sa.select(table)
+        .where(
+            table.c.scope == scope,
+            table.c.key == key,
+            table.c.granularity == granularity,
+            table.c.bucket >= floor_bucket(granularity, start),
+            table.c.bucket < end,
+        )
+        .order_by(table.c.bucket)
+    )
+    points = []
+    for row in db.execute(stmt).mappings():
+        point = {"bucket": row["bucket"], "reports": row["reports"]}
+        for m in METRICS:
+            count = row[f"{m}_count"]
+            point[m] = {
+                "min": row[f"{m}_min"],
+                "max": row[f"{m}_max"],
+                "avg": row[f"{m}_sum"] / count if count else None,
+            }
+        points.append(point)
+    return {"scope": scope, "key": key, "granularity": granularity, "points": points}
+
+
+@sa.event.listens_for(Bed, "after_insert")
+def _bed_inserted(mapper, connection, target):
+    row = {c: getattr(target, c) for c in ("hosp_id", *LATEST_FIELDS)}
+    refresh_latest(connection, [row])
+    refresh_rollups(connection, [row])
+    session = object_session(target)
+    if session is not None:
+        session.info["bed_latest_changed"] = True
+
+
+@sa.event.listens_for(Session, "after_commit")
+def _invalidate_latest(session):
+    if session.info.pop("bed_latest_changed", False):
+        latest_cache.clear()
+
+
+@sa.event.listens_for(Session, "after_soft_rollback")
+def _discard_latest(session, previous_transaction):
+    session.info.pop("bed_latest_changed", None)
@@ -0,0 +1,195 @@
+"""
+In-process publish/subscribe hub with named channels
+
+Every subscriber owns a bounded queue. Publishing appends to each queue
+without awaiting anything, so fan-out costs O(1) per subscriber and a slow
+consumer can never hold up the others; when its queue is full the
+subscription's overflow policy decides what gives:
+
+* `drop_oldest`: discard the oldest queued message
+* `coalesce`: replace the whole backlog with the newest message, for
+  channels where only the latest state matters
+* `disconnect`: close the subscription, the slow consumer has to reconnect
+
+`publish` must be called from the event loop thread, use
+`publish_threadsafe` from sync handlers running in the threadpool.
+"""
+import asyncio
+import enum
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Set
+
+from loguru import logger
+from starlette.websockets import WebSocket
+
+from app import metrics
+from app.config import settings
+
+# websocket close code for consumers dropped by the `disconnect` policy
+WS_TRY_AGAIN_LATER = 1013
+
+
+class Overflow(str, enum.Enum):
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+    DISCONNECT = "disconnect"
+
+
+class SubscriptionClosed(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, channel: str, maxsize: int, overflow: Overflow):
+        self.channel = channel
+        self.maxsize = maxsize
+        self.overflow = Overflow(overflow)
+        self.dropped = 0
+        self.closed = False
+        self.close_reason: Optional[str] = None
+        self._queue: deque = deque()
+        self._ready = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def put(self, message: Any) -> None:
+        if self.closed:
+            return
+        if len(self._queue) >= self.maxsize:
+            if self.overflow == Overflow.DISCONNECT:
+                self.close("slow consumer")
+                return
+            if self.overflow == Overflow.COALESCE:
+                self.dropped += len(self._queue)
+                self._queue.clear()
+            else:
+                self.dropped += 1
+                self._queue.popleft()
+        self._queue.append(message)
+        self._ready.set()
+
+    def close(self, reason: Optional[str] = None) -> None:
+        self.closed = True
+        self.close_reason = reason
+        self._ready.set()
+
+    async def get(self) -> Any:
+        while not self._queue:
+            if self.closed:
+                raise SubscriptionClosed(self.close_reason)
+            self._ready.clear()
+            await self._ready.wait()
+        return self._queue.popleft()
+
+    def __aiter__(self) -> AsyncIterator[Any]:
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            return await self.get()
+        except SubscriptionClosed:
+            raise StopAsyncIteration
+
+
+class Broadcast:
+    def __init__(
+        self,
+        url: str = "memory://",
+        queue_size: int = 100,
+        overflow: Overflow = Overflow.DROP_OLDEST,
+    ):
+        if not url.startswith("memory://"):
+            raise ValueError(f"Unsupported broadcast backend {url}, only memory:// is available")
+        self.queue_size = queue_size
+        self.overflow = Overflow(overflow)
+        self._channels: Dict[str, Set[Subscription]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def connect(self) -> None:
+        self._loop = asyncio.get_running_loop()
+
+    async def disconnect(self) -> None:
+        for subscriptions in self._channels.values():
+            for subscription in subscriptions:
+                subscription.close("shutdown")
+        self._channels.clear()
+
+    def publish(self, channel: str, message: Any) -> int:
+        """queue `message` for every subscriber of `channel`, returns the subscriber count"""
+        subscriptions = self._channels.get(channel, ())
+        for subscription in tuple(subscriptions):
+            subscription.put(message)
+        return len(subscriptions)
+
+    def publish_threadsafe(self, channel: str, message: Any) -> None:
+        loop = self._loop or asyncio.get_event_loop()
+        loop.call_soon_threadsafe(self.publish, channel, message)
+
+    @asynccontextmanager
+    async def subscribe(
+        self,
+        channel: str,
+        queue_size: Optional[int] = None,
+        overflow: Optional[Overflow] = None,
+    ) -> AsyncIterator[Subscription]:
+        subscription = Subscription(
+            channel, queue_size or self.queue_size, overflow or self.overflow
+        )
+        self._channels.setdefault(channel, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            subscription.close()
+            subscriptions = self._channels.get(channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._channels[channel]
+
+    def subscriber_count(self, channel: Optional[str] = None) -> int:
+        if channel is not None:
+            return len(self._channels.get(channel, ()))
+        return sum(len(s) for s in self._channels.values())
+
+    def channels(self) -> Dict[str, int]:
+        return {channel: len(s) for channel, s in self._channels.items()}
+
+
+broadcast = Broadcast(
+    settings.BROADCAST_URL,
+    queue_size=settings.BROADCAST_QUEUE_SIZE,
+    overflow=settings.BROADCAST_OVERFLOW,
+)
+
+metrics.Collected(
+    "pubsub_subscribers",
+    "Subscribers per channel, websockets on crowdsource, event streams on sse",
+    ["channel"],
+    collect=lambda: {(channel,): n for channel, n in broadcast.channels().items()},
+)
+
+
+def ws_receiver(channel: str):
+    """publish every text frame received on the websocket to `channel`"""
+
+    async def receiver(websocket: WebSocket) -> None:
+        async for message in websocket.iter_text():
+            broadcast.publish(channel, message)
+
+    return receiver
+
+
+def ws_sender(channel: str):
+    """forward `channel` messages to the websocket until it drops behind"""
+
+    async def sender(websocket: WebSocket) -> None:
+        async with broadcast.subscribe(channel) as subscription:
+            async for message in subscription:
+                await websocket.send_text(message)
+            if subscription.close_reason == "slow consumer":
+                logger.warning(f"closing slow {channel} websocket {websocket.client}")
+                await websocket.close(code=WS_TRY_AGAIN_LATER)
+
+    return sender
@@ -8,4 +8,7 @@ from .item import (
     ItemInDB,
     ItemUpdate,
     ItemOut,
+    ItemNear,
 )
+
+from .bed import BedCreate, BedLatest, BedTrend
@@ -0,0 +1,69 @@
+from typing import List, Optional
+from uuid import UUID
+from datetime import datetime
+
+from pydantic import BaseModel, conint, root_validator
+
+from app.models import SourceType
+
+
+class BedBase(BaseModel):
+    icu_vacant: Optional[conint(ge=0)] = None
+    icu_occupied: Optional[conint(ge=0)] = None
+    isolbed_vacant: Optional[conint(ge=0)] = None
+    isolbed_occupied: Optional[conint(ge=0)] = None
+    beds_ward_vacant: Optional[conint(ge=0)] = None
+    beds_ward_occupied: Optional[conint(ge=0)] = None
+    source: Optional[SourceType] = None
+
+
+# Properties of a bed occupancy report received from a data feed
+class BedCreate(BedBase):
+    doh_id: Optional[int] = None
+    hosp_id: Optional[UUID] = None
+    doh_code: Optional[str] = None
+    reportdate: datetime
+    updated: Optional[datetime] = None
+
+    @root_validator
+    def check_hospital(cls, values):
+        if not (values.get("hosp_id") or values.get("doh_code")):
+            raise ValueError("Either hosp_id or doh_code is required")
+        # a report without an update time is keyed on its report date
+        if values.get("updated") is None:
+            values["updated"] = values.get("reportdate")
+        return values
+
+
+# Current availability of a hospital, from the bed_latest projection
+class BedLatest(BedBase):
+    hosp_id: UUID
+    doh_code: Optional[str] = None
+    name: Optional[str] = None
+    reportdate: datetime
+    updated: datetime
+
+    class Config:
+        orm_mode = True
+
+
+class VacancyStats(BaseModel):
+    min: Optional[int]
+    max: Optional[int]
+    avg: Optional[float]
+
+
+class BedTrendPoint(BaseModel):
+    bucket: datetime
+    reports: int
+    icu_vacant: VacancyStats
+    isolbed_vacant: VacancyStats
+    beds_ward_vacant: VacancyStats
+
+
+# Bed vacancy over time from the bed_rollup tables
+class BedTrend(BaseModel):
+    scope: str
+    key: str
+    granularity: str
+    points: List[BedTrendPoint]
@@ -1,4 +1,5 @@
-from typing import Optional, List, TypeVar, Generic
+from functools import lru_cache
+from typing import Optional, List, Tuple, TypeVar, Generic
 from pydantic.fields import ModelField
 from datetime import datetime
 from loguru import logger
@@ -23,6 +24,9 @@ MOBILE_NUMBER_TYPES = (
     PhoneNumberType.FIXED_LINE,
 )
 
+# distinct phone strings remembered, invalid ones included
+PHONE_CACHE_SIZE = 65536
+
 # https://github.com/samuelcolvin/pydantic/issues/181#issuecomment-707186930
 PydanticField = TypeVar("PydanticField")
 
@@ -39,6 +43,34 @@ class EmptyStrToNone(Generic[PydanticField]):
         return v
 
 
+@lru_cache(maxsize=PHONE_CACHE_SIZE)
+def _normalize_phone(v: str) -> Tuple[Optional[str], Optional[str]]:
+    """(formatted number, error), errors are cached too as imports repeat them"""
+    try:
+        n = parse_phone_number(v, "PH")
+    except NumberParseException:
+        logger.error(f"Phone not valid {v}")
+        return None, "Phone parse error, please provide a valid phone number"
+
+    if not is_valid_number(n) or number_type(n) not in MOBILE_NUMBER_TYPES:
+        return None, "Please provide a valid phone number"
+    return (
+        format_number(
+            n,
+            PhoneNumberFormat.NATIONAL if n.country_code == 63 else PhoneNumberFormat.INTERNATIONAL,
+        ),
+        None,
+    )
+
+
+def normalize_phone(v: str) -> str:
+    """national format for PH numbers, international otherwise, ValueError if not valid"""
+    phone, error = _normalize_phone(v)
+    if error is not None:
+        raise ValueError(error)
+    return phone
+
+
 class ItemBase(BaseModel):
     name: Optional[str] = Field(..., description="Name of the hospital")
     clean_name: Optional[str]
@@ -64,25 +96,9 @@ class ItemBase(BaseModel):
     # https://github.com/samuelcolvin/pydantic/issues/1551#issuecomment-700154597
     @validator("phone")
     def check_phone_number(cls, v):
-        logger.debug(f"validating phone: {v}")
         if v is None:
             return v
-
-        try:
-            n = parse_phone_number(v, "PH")
-        except NumberParseException as e:
-            logger.error(f"Phone not valid {v}")
-            raise ValueError("Phone parse error, please provide a valid phone number") from e
-
-        if not is_valid_number(n) or number_type(n) not in MOBILE_NUMBER_TYPES:
-            logger.debug(f"valid: {is_valid_number(n)}, num type: {number_type(n)}")
-            raise ValueError("Please provide a valid phone number")
-        p = format_number(
-            n,
-            PhoneNumberFormat.NATIONAL if n.country_code == 63 else PhoneNumberFormat.INTERNATIONAL,
-        )
-        logger.debug(f"formated phone {p}")
-        return p
+        return normalize_phone(v)
 
 
 class ItemCreate(ItemBase):
@@ -127,6 +143,10 @@ class ItemOut(BaseModel):
         orm_mode = True
 
 
+class ItemNear(ItemOut):
+    distance: float = Field(..., description="Distance in km")
+
+
 class ItemBed(BaseModel):
     id: Optional[UUID] = None
     doh_code: Optional[str]
@@ -0,0 +1,175 @@
+"""
+In-memory grid index over Item.lat/lng for nearest and bounding box lookups
+
+Points are bucketed into square lat/lng cells so a query only visits the cells
+around it instead of scanning the item table. The index is built from the
+database on first use, kept up to date from committed ORM writes and rebuilt
+every `SPATIAL_INDEX_REFRESH_SECONDS` to pick up writes from other workers.
+"""
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models import Item
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """great circle distance in km"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GridIndex:
+    def __init__(self, cell_size: float = 0.1):
+        self.cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], Dict[Hashable, Tuple[float, float]]]
+        self._cells = defaultdict(dict)
+        self._points: Dict[Hashable, Tuple[float, float]] = {}
+        self._lock = threading.RLock()
+        self.loaded_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_size), math.floor(lng / self.cell_size)
+
+    def insert(self, key: Hashable, lat: Optional[float], lng: Optional[float]) -> None:
+        with self._lock:
+            self.remove(key)
+            if lat is None or lng is None:
+                return
+            self._points[key] = (lat, lng)
+            self._cells[self._cell(lat, lng)][key] = (lat, lng)
+
+    def remove(self, key: Hashable) -> None:
+        with self._lock:
+            point = self._points.pop(key, None)
+            if point is None:
+                return
+            cell = self._cell(*point)
+            self._cells[cell].pop(key, None)
+            if not self._cells[cell]:
+                del self._cells[cell]
+
+    def rebuild(self, points) -> None:
+        """replace the whole index with `(key, lat, lng)` rows"""
+        with self._lock:
+            self._cells.clear()
+            self._points.clear()
+            for key, lat, lng in points:
+                self.insert(key, lat, lng)
+            self.loaded_at = time.monotonic()
+
+    def bbox(
+        self, min_lat: float, min_lng: float, max_lat: float, max_lng: float, limit: int = 500
+    ) -> List[Hashable]:
+        lat0, lng0 = self._cell(min_lat, min_lng)
+        lat1, lng1 = self._cell(max_lat, max_lng)
+        found = []
+        with self._lock:
+            for i in range(lat0, lat1 + 1):
+                for j in range(lng0, lng1 + 1):
+                    for key, (lat, lng) in self._cells.get((i, j), {}).items():
+                        if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng:
+                            found.append(key)
+                            if len(found) >= limit:
+                                return found
+        return found
+
+    def near(
+        self, lat: float, lng: float, radius: float, k: int = 10
+    ) -> List[Tuple[float, Hashable]]:
+        """
+        k nearest points within `radius` km as `(distance, key)` pairs, nearest first.
+
+        Visits rings of cells around the query point and stops as soon as the
+        unvisited rings are provably farther than the k-th best match.
+        """
+        ci, cj = self._cell(lat, lng)
+        cell_km = self.cell_size * KM_PER_DEGREE
+        widest_lat = min(abs(lat) + self.cell_size, 89.9)
+        lng_cell_km = cell_km * math.cos(math.radians(widest_lat))
+        lat_rings = math.ceil(radius / cell_km) + 1
+        # near the poles cells shrink to nothing in longitude, a ring never needs
+        # to reach further than halfway around the globe
+        lng_rings = min(math.ceil(radius / lng_cell_km) + 1, math.ceil(180 / self.cell_size))
+        lowest, highest = self._cell(-90, 0)[0], self._cell(90, 0)[0]
+        best: List[Tuple[float, Any]] = []  # max heap of the k best as (-distance, key)
+        with self._lock:
+            for ring in range(max(lat_rings, lng_rings) + 1):
+                rows = min(ring, lat_rings)
+                for i in range(max(ci - rows, lowest), min(ci + rows, highest) + 1):
+                    if abs(i - ci) == ring:
+                        width = min(ring, lng_rings)
+                        columns = range(cj - width, cj + width + 1)
+                    elif ring <= lng_rings:
+                        columns = (cj - ring, cj + ring)
+                    else:
+                        continue
+                    for j in columns:
+                        for key, (plat, plng) in self._cells.get((i, j), {}).items():
+                            distance = haversine(lat, lng, plat, plng)
+                            if distance > radius:
+                                continue
+                            if len(best) < k:
+                                heapq.heappush(best, (-distance, key))
+                            elif distance < -best[0][0]:
+                                heapq.heapreplace(best, (-distance, key))
+                # everything outside this ring is at least `ring` cells away
+                if len(best) >= k and -best[0][0] <= ring * min(cell_km, lng_cell_km):
+                    break
+        return sorted((-d, key) for d, key in best)
+
+
+item_index = GridIndex(settings.SPATIAL_CELL_SIZE)
+
+
+def ensure_loaded(db: Session, index: GridIndex = item_index) -> GridIndex:
+    age = time.monotonic() - index.loaded_at if index.loaded_at is not None else None
+    if age is None or age > settings.SPATIAL_INDEX_REFRESH_SECONDS:
+        index.rebuild(db.execute(sa.select(Item.id, Item.lat, Item.lng)))
+    return index
+
+
+# keep the index in step with committed ORM writes
+@sa.event.listens_for(Session, "after_flush")
+def _collect_item_changes(session, flush_context):
+    changes = session.info.setdefault("spatial_changes", {})
+    for obj in session.new.union(session.dirty):
+        if isinstance(obj, Item):
+            changes[obj.id] = (obj.lat, obj.lng)
+    for obj in session.deleted:
+        if isinstance(obj, Item):
+            changes[obj.id] = None
+
+
+@sa.event.listens_for(Session, "after_commit")
+def _apply_item_changes(session):
+    changes = session.info.pop("spatial_changes", None)
+    if not changes or item_index.loaded_at is None:
+        return
+    for key, point in changes.items():
+        if point is None:
+            item_index.remove(key)
+        else:
+            item_index.insert(key, *point)
+
+
+@sa.event.listens_for(Session, "after_soft_rollback")
+def _discard_item_changes(session, previous_transaction):
+    session.info.pop("spatial_changes", None)
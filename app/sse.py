@@ -0,0 +1,102 @@
+"""
+Server-sent events on top of the pubsub hub
+
+Events get increasing ids and are kept in a ring buffer, so a client that
+reconnects with `Last-Event-ID` is replayed what it missed. Ids are
+`<epoch>-<sequence>` with an epoch drawn per process: an id from before a
+restart or from another worker, or one this log has not reached, cannot be
+placed in the buffer and the whole buffer is replayed. Subscribers that
+fall behind are disconnected by default (`SSE_OVERFLOW`), the browser's
+EventSource reconnects on its own and catches up from the buffer.
+"""
+import asyncio
+import itertools
+import secrets
+import threading
+from collections import deque
+from typing import Any, AsyncIterator, List, NamedTuple, Optional
+
+from app.config import settings
+from app.pubsub import SubscriptionClosed, broadcast
+
+CHANNEL = "sse"
+
+
+class ServerEvent(NamedTuple):
+    epoch: str
+    seq: int
+    event: str
+    data: str
+
+    @property
+    def id(self) -> str:
+        return f"{self.epoch}-{self.seq}"
+
+    def encode(self) -> str:
+        lines = "".join(f"data: {line}\n" for line in self.data.splitlines() or [""])
+        return f"id: {self.id}\nevent: {self.event}\n{lines}\n"
+
+
+class EventLog:
+    """ring buffer of the most recent events"""
+
+    def __init__(self, size: int, epoch: Optional[str] = None):
+        self.epoch = epoch or secrets.token_hex(4)
+        self._events: deque = deque(maxlen=size)
+        self._seqs = itertools.count(1)
+        self._newest = 0
+        self._lock = threading.Lock()
+
+    def append(self, event: str, data: str) -> ServerEvent:
+        with self._lock:
+            server_event = ServerEvent(self.epoch, next(self._seqs), event, data)
+            self._events.append(server_event)
+            self._newest = server_event.seq
+        return server_event
+
+    def position(self, last_event_id: str) -> int:
+        """sequence a client resumes after, 0 (replay everything) if it is not ours"""
+        epoch, _, seq = last_event_id.strip().rpartition("-")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self._newest:
+            return 0
+        return int(seq)
+
+    def since(self, seq: int) -> List[ServerEvent]:
+        """buffered events after `seq`, as many as are still kept"""
+        return [e for e in tuple(self._events) if e.seq > seq]
+
+
+log = EventLog(settings.SSE_REPLAY_SIZE)
+
+
+def notify(event: str, data: Any) -> ServerEvent:
+    """record and fan out an event, never waits on subscribers"""
+    server_event = log.append(event, data if isinstance(data, str) else str(data))
+    broadcast.publish(CHANNEL, server_event)
+    return server_event
+
+
+async def stream(last_event_id: Optional[str] = None) -> AsyncIterator[str]:
+    """encoded events for one client: replay after `last_event_id`, then live events"""
+    async with broadcast.subscribe(CHANNEL, overflow=settings.SSE_OVERFLOW) as subscription:
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n"
+        last_seq = 0
+        if last_event_id is not None:
+            last_seq = log.position(last_event_id)
+            for server_event in log.since(last_seq):
+                last_seq = server_event.seq
+                yield server_event.encode()
+        while True:
+            try:
+                server_event = await asyncio.wait_for(
+                    subscription.get(), timeout=settings.SSE_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            except SubscriptionClosed:
+                # subscription closed, the client reconnects with Last-Event-ID
+                return
+            if server_event.seq > last_seq:
+                last_seq = server_event.seq
+                yield server_event.encode()
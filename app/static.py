@@ -0,0 +1,232 @@
+"""
+Static files for the web app
+
+`PrecompressedStaticFiles` serves the `.br` or `.gz` sibling of a file when
+the client accepts that encoding, so text assets go out compressed without
+compressing them per request. ETags come from the file content and survive
+deploys that only touch mtimes; fingerprinted files (`bundle.3f2a9c1e.js`)
+are cached for a year as immutable, everything else is revalidated. Bodies
+are handed to the server with the ASGI path/zero-copy send extensions when it
+offers them, and streamed in 64KB chunks otherwise.
+
+`precompress` writes the siblings: run `manage.py generate static` after a web
+build, or set STATIC_PRECOMPRESS to do it on startup.
+"""
+import gzip
+import hashlib
+import os
+import re
+import stat
+from mimetypes import guess_type
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+from app.cache import etag_matches
+from app.config import settings
+from app.metrics import run_in_threadpool
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSIBLE = {
+    ".css",
+    ".geojson",
+    ".html",
+    ".ico",
+    ".js",
+    ".json",
+    ".map",
+    ".svg",
+    ".txt",
+    ".webmanifest",
+    ".xml",
+}
+# preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+FINGERPRINTED = re.compile(r"\.[0-9a-f]{8,}\.\w+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# a sibling that saves less than this is not worth keeping
+MIN_SAVING = 0.05
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def precompress(directory: str, min_size: int = 512) -> Tuple[int, int]:
+    """write `.br`/`.gz` siblings of the compressible files under `directory`
+
+    Siblings carry the mtime of their source, a source changed since is not
+    served compressed until this runs again. Returns (written, up to date).
+    """
+    encodings = [(e, s) for e, s in ENCODINGS if e != "br" or brotli is not None]
+    if brotli is None:
+        logger.warning("brotli is not installed, writing .gz siblings only")
+    written = fresh = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = Path(root) / name
+            if path.suffix not in COMPRESSIBLE:
+                continue
+            source = path.stat()
+            if source.st_size < min_size:
+                continue
+            data = None
+            for encoding, suffix in encodings:
+                target = path.with_name(name + suffix)
+                if target.exists() and target.stat().st_mtime_ns == source.st_mtime_ns:
+                    fresh += 1
+                    continue
+                data = data if data is not None else path.read_bytes()
+                compressed = compress(data, encoding)
+                if len(compressed) > len(data) * (1 - MIN_SAVING):
+                    target.unlink(missing_ok=True)
+                    continue
+                tmp = target.with_name(f".{target.name}.tmp")
+                tmp.write_bytes(compressed)
+                os.utime(tmp, ns=(source.st_atime_ns, source.st_mtime_ns))
+                os.replace(tmp, target)
+                written += 1
+    logger.info(f"precompressed {directory}: {written} written, {fresh} up to date")
+    return written, fresh
+
+
+def accepted_encodings(accept_encoding: str) -> List[str]:
+    accepted = []
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.append(coding.strip().lower())
+    return accepted
+
+
+class Asset(NamedTuple):
+    """content digest of a file and its fresh compressed siblings"""
+
+    mtime_ns: int
+    size: int
+    digest: str
+    variants: Dict[str, Tuple[str, os.stat_result]]
+
+
+class StaticFileResponse(FileResponse):
+    chunk_size = 64 * 1024
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        extensions = scope.get("extensions") or {}
+        if self.send_header_only or not (
+            "http.response.pathsend" in extensions
+            or "http.response.zerocopysend" in extensions
+        ):
+            await super().__call__(scope, receive, send)
+            return
+        await send(
+            {"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers}
+        )
+        if "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": os.path.abspath(self.path)})
+        else:
+            with open(self.path, "rb") as file:
+                await send({"type": "http.response.zerocopysend", "file": file})
+        if self.background is not None:
+            await self.background()
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._assets: Dict[str, Asset] = {}
+
+    def asset(self, full_path: str, stat_result: os.stat_result) -> Asset:
+        """digest cached per file version, siblings looked up every time"""
+        cached = self._assets.get(full_path)
+        if (
+            cached is None
+            or cached.mtime_ns != stat_result.st_mtime_ns
+            or cached.size != stat_result.st_size
+        ):
+            sha256 = hashlib.sha256()
+            with open(full_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 16), b""):
+                    sha256.update(chunk)
+            cached = Asset(stat_result.st_mtime_ns, stat_result.st_size, sha256.hexdigest(), {})
+            self._assets[full_path] = cached
+        variants = {}
+        if Path(full_path).suffix in COMPRESSIBLE:
+            for encoding, suffix in ENCODINGS:
+                try:
+                    sibling = os.stat(full_path + suffix)
+                except FileNotFoundError:
+                    continue
+                if sibling.st_mtime_ns == stat_result.st_mtime_ns:
+                    variants[encoding] = (full_path + suffix, sibling)
+        return cached._replace(variants=variants)
+
+    async def lookup_path(self, path: str) -> Tuple[str, Optional[os.stat_result]]:
+        full_path, stat_result = await super().lookup_path(path)
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            # hash new or changed files off the event loop
+            await run_in_threadpool(self.asset, full_path, stat_result)
+        return full_path, stat_result
+
+    def file_response(
+        self,
+        full_path: str,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        asset = self.asset(full_path, stat_result)
+        path, served = full_path, stat_result
+        headers = {
+            "cache-control": IMMUTABLE if FINGERPRINTED.search(full_path) else REVALIDATE,
+            "etag": f'"{asset.digest[:32]}"',
+        }
+        if Path(full_path).suffix in COMPRESSIBLE:
+            headers["vary"] = "Accept-Encoding"
+            accepted = accepted_encodings(request_headers.get("accept-encoding", ""))
+            for encoding, _ in ENCODINGS:
+                if encoding in accepted and encoding in asset.variants:
+                    path, served = asset.variants[encoding]
+                    headers["content-encoding"] = encoding
+                    # another representation, another strong validator
+                    headers["etag"] = f'"{asset.digest[:32]}-{encoding}"'
+                    break
+
+        response = StaticFileResponse(
+            path,
+            status_code=status_code,
+            headers=headers,
+            media_type=guess_type(full_path)[0] or "text/plain",
+            stat_result=served,
+            method=scope["method"],
+        )
+        if_none_match = request_headers.get("if-none-match")
+        if etag_matches(if_none_match, response.headers["etag"]) or (
+            if_none_match is None and self.is_not_modified(response.headers, request_headers)
+        ):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+async def startup() -> None:
+    if settings.STATIC_PRECOMPRESS:
+        await run_in_threadpool(precompress, settings.STATIC_DIR)
@@ -0,0 +1,320 @@
+"""
+Synthetic dataset for scale testing
+
+`generate` writes facilities clustered around Philippine population centres,
+users and a history of bed reports at a fixed cadence. Each facility has its
+own capacities and an occupancy that drifts with a shared seasonal wave, and
+misses the odd report. Everything comes from one `random.Random(seed)`
+consumed in a fixed order, ids included, so a seed always yields the same
+rows. The batch size only decides how the rows are written.
+
+Rows are produced by generators and written a batch at a time with Core
+executemany, bed reports through `loader.write_beds` (COPY on PostgreSQL), so
+memory stays flat whatever the size of the history. The projections are
+rebuilt once at the end rather than refreshed per batch: the rollups cost
+more than the reports themselves, skip them with `projections=False` when
+only the raw volume matters.
+"""
+
+import math
+import random
+import time
+import uuid
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Any, Dict, Iterator, List, NamedTuple, Tuple
+
+from loguru import logger
+import sqlalchemy as sa
+
+from app import loader
+from app import projections as bed_projections
+from app.database import engine as default_engine
+from app.models import Item, SourceType, User
+from app.utils import get_password_hash
+
+DOH_CODE_PREFIX = "SYN"
+EMAIL_DOMAIN = "synthetic.example.com"
+END = datetime(2022, 1, 1)
+# region: (lat, lng, share of the facilities, municipalities)
+REGIONS: Dict[str, Tuple[float, float, float, Tuple[str, ...]]] = {
+    "NCR": (
+        14.60,
+        121.00,
+        0.24,
+        ("Manila", "Quezon City", "Makati", "Pasig", "Taguig", "Caloocan"),
+    ),
+    "Region III": (
+        15.10,
+        120.70,
+        0.12,
+        ("San Fernando", "Angeles", "Tarlac City", "Malolos"),
+    ),
+    "Region IV-A": (
+        14.20,
+        121.20,
+        0.14,
+        ("Calamba", "Antipolo", "Batangas City", "Lucena"),
+    ),
+    "Region I": (16.60, 120.40, 0.05, ("San Fernando", "Laoag", "Vigan")),
+    "CAR": (16.41, 120.59, 0.03, ("Baguio", "La Trinidad")),
+    "Region VI": (10.70, 122.60, 0.09, ("Iloilo City", "Bacolod", "Roxas City")),
+    "Region VII": (
+        10.30,
+        123.90,
+        0.11,
+        ("Cebu City", "Mandaue", "Lapu-Lapu", "Dumaguete"),
+    ),
+    "Region X": (8.48, 124.65, 0.07, ("Cagayan de Oro", "Iligan", "Malaybalay")),
+    "Region XI": (7.10, 125.60, 0.09, ("Davao City", "Tagum", "Digos")),
+    "BARMM": (7.20, 124.25, 0.06, ("Cotabato City", "Marawi")),
+}
+KINDS = (
+    "General Hospital",
+    "Medical Center",
+    "Doctors Hospital",
+    "District Hospital",
+    "Community Hospital",
+    "Infirmary",
+)
+FIRST_NAMES = (
+    "Maria",
+    "Jose",
+    "Ana",
+    "Juan",
+    "Rosa",
+    "Carlo",
+    "Liza",
+    "Paolo",
+    "Grace",
+    "Mark",
+)
+LAST_NAMES = (
+    "Santos",
+    "Reyes",
+    "Cruz",
+    "Bautista",
+    "Garcia",
+    "Mendoza",
+    "Ramos",
+    "Aquino",
+)
+SOURCES = (SourceType.DOH, SourceType.HOSPITAL, SourceType.VOLUNTEER, SourceType.CROWD)
+SOURCE_WEIGHTS = (70, 20, 7, 3)
+# days per cycle of the shared occupancy wave
+WAVE_DAYS = 120
+MISSED_REPORTS = 0.03
+
+
+class SyntheticStats(NamedTuple):
+    facilities: int
+    users: int
+    beds: int
+    seconds: float
+
+
+class Facility(NamedTuple):
+    id: uuid.UUID
+    doh_id: int
+    icu: int
+    isolbed: int
+    ward: int
+
+
+def _uuid(rng: random.Random) -> uuid.UUID:
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def _municipalities(rng: random.Random) -> List[Tuple[str, str, float, float, float]]:
+    """(region, municipality, lat, lng, weight), spread around their region centre"""
+    places = []
+    for region, (lat, lng, share, names) in REGIONS.items():
+        for i, name in enumerate(names):
+            # the first municipality is the regional centre and gets the most facilities
+            spread = 0.25 if i else 0.0
+            places.append(
+                (
+                    region,
+                    name,
+                    lat + rng.gauss(0, spread),
+                    lng + rng.gauss(0, spread),
+                    share / (i + 1),
+                )
+            )
+    return places
+
+
+def facilities(
+    rng: random.Random, count: int, created: datetime
+) -> Iterator[Dict[str, Any]]:
+    places = _municipalities(rng)
+    weights = [p[-1] for p in places]
+    for n in range(count):
+        region, municipality, lat, lng, _ = rng.choices(places, weights)[0]
+        yield {
+            "id": _uuid(rng),
+            "doh_code": f"{DOH_CODE_PREFIX}{n:07d}",
+            "name": f"{municipality} {rng.choice(KINDS)} {n}",
+            "address": f"{rng.randint(1, 999)} Rizal Street, {municipality}",
+            "region": region,
+            "municipality": municipality,
+            "lat": round(lat + rng.gauss(0, 0.04), 6),
+            "lng": round(lng + rng.gauss(0, 0.04), 6),
+            "phone": f"+63 2 8{rng.randint(0, 9999999):07d}",
+            "created": created,
+            "updated": created,
+        }
+
+
+def users(
+    rng: random.Random, count: int, hashed_password: str, created: datetime
+) -> Iterator[Dict]:
+    for n in range(count):
+        yield {
+            "id": _uuid(rng),
+            "email": f"user{n:07d}@{EMAIL_DOMAIN}",
+            "full_name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "hashed_password": hashed_password,
+            "is_active": True,
+            "is_verified": rng.random() < 0.9,
+            "is_superuser": False,
+            "created": created,
+            "updated": created,
+        }
+
+
+def beds(
+    rng: random.Random,
+    hospitals: List[Facility],
+    start: datetime,
+    end: datetime,
+    every: timedelta,
+) -> Iterator[Dict[str, Any]]:
+    """one report per facility per step, oldest first"""
+    occupancy = {h.id: rng.uniform(0.3, 0.8) for h in hospitals}
+    reportdate = start
+    while reportdate < end:
+        wave = 0.15 * math.sin(2 * math.pi * (reportdate - start).days / WAVE_DAYS)
+        for h in hospitals:
+            rate = occupancy[h.id] = min(
+                max(occupancy[h.id] + rng.gauss(0, 0.03), 0.05), 0.95
+            )
+            if rng.random() < MISSED_REPORTS:
+                continue
+            icu, isolbed, ward = (
+                round(capacity * min(max(rate + wave + rng.gauss(0, 0.05), 0.0), 1.0))
+                for capacity in (h.icu, h.isolbed, h.ward)
+            )
+            yield {
+                "doh_id": h.doh_id,
+                "hosp_id": h.id,
+                "icu_vacant": h.icu - icu,
+                "icu_occupied": icu,
+                "isolbed_vacant": h.isolbed - isolbed,
+                "isolbed_occupied": isolbed,
+                "beds_ward_vacant": h.ward - ward,
+                "beds_ward_occupied": ward,
+                "reportdate": reportdate,
+                "updated": reportdate + timedelta(minutes=rng.randint(5, 240)),
+                "source": rng.choices(SOURCES, SOURCE_WEIGHTS)[0],
+            }
+        reportdate += every
+
+
+def _insert(conn, table: sa.Table, rows: Iterator[Dict], batch_size: int) -> int:
+    written = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return written
+        conn.execute(table.insert(), batch)
+        written += len(batch)
+
+
+def generate(
+    *,
+    facility_count: int = 1000,
+    user_count: int = 100,
+    years: float = 1.0,
+    every: timedelta = timedelta(days=1),
+    seed: int = 0,
+    end: datetime = END,
+    batch_size: int = 10000,
+    password: str = "synthetic",
+    projections: bool = True,
+    engine=None,
+) -> SyntheticStats:
+    engine = engine or default_engine
+    rng = random.Random(seed)
+    start = end - timedelta(days=365 * years)
+    started = time.perf_counter()
+
+    with engine.begin() as conn:
+        existing = conn.execute(
+            sa.select(sa.func.count()).where(Item.doh_code.startswith(DOH_CODE_PREFIX))
+        ).scalar()
+        if existing:
+            raise ValueError(
+                f"{existing} synthetic facilities exist already, use a fresh database"
+            )
+        hospitals: List[Facility] = []
+
+        def capacities(rows: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+            for row in rows:
+                hospitals.append(
+                    Facility(
+                        row["id"],
+                        len(hospitals) + 1,
+                        rng.randint(2, 40),
+                        rng.randint(5, 80),
+                        rng.randint(20, 400),
+                    )
+                )
+                yield row
+
+        _insert(
+            conn,
+            Item.__table__,
+            capacities(facilities(rng, facility_count, start)),
+            batch_size,
+        )
+        hashed_password = get_password_hash(password)
+        user_total = _insert(
+            conn,
+            User.__table__,
+            users(rng, user_count, hashed_password, start),
+            batch_size,
+        )
+    logger.info(f"{len(hospitals)} facilities and {user_total} users written")
+
+    reports = beds(rng, hospitals, start, end, every)
+    steps = math.ceil((end - start) / every)
+    logger.info(
+        f"writing up to {steps * len(hospitals)} bed reports, {steps} per facility"
+    )
+    written = 0
+    while True:
+        batch = list(islice(reports, batch_size))
+        if not batch:
+            break
+        with engine.begin() as conn:
+            loader.write_beds(conn, batch)
+        written += len(batch)
+        elapsed = time.perf_counter() - started
+        logger.info(f"{written} bed reports, {written / elapsed:.0f} rows/sec")
+
+    if projections:
+        logger.info("rebuilding the bed_latest and bed_rollup projections")
+        with engine.begin() as conn:
+            bed_projections.rebuild_latest(conn)
+            bed_projections.rebuild_rollups(conn)
+        bed_projections.latest_cache.clear()
+
+    stats = SyntheticStats(
+        len(hospitals), user_total, written, time.perf_counter() - started
+    )
+    logger.info(
+        f"generated {stats.facilities} facilities, {stats.users} users and "
+        f"{stats.beds} bed reports in {stats.seconds:.1f}s"
+    )
+    return stats
@@ -0,0 +1,212 @@
+"""
+Static GeoJSON tiles of the facility map
+
+`build_tiles` writes every `Item` with a position as one GeoJSON feature
+collection plus a z/x/y pyramid of per-tile GeoJSON (Web Mercator / slippy map
+numbering), so a map only downloads the tiles in its viewport. Both are
+plain files under `web/public`, served by the static mount.
+
+`manifest.json` remembers each item's feature fingerprint and position. A
+rebuild only rewrites the tiles that an added, changed or removed item falls
+in, before or after the change; tiles left empty are deleted.
+"""
+import hashlib
+import json
+import math
+import os
+import shutil
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from loguru import logger
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from app.models import Item
+
+Tile = Tuple[int, int, int]
+
+MANIFEST = "manifest.json"
+COLLECTION = "facilities.geojson"
+INDEX = "index.json"
+MANIFEST_VERSION = 1
+STREAM_CHUNK = 1000
+# Web Mercator is undefined at the poles
+MAX_LATITUDE = 85.05112878
+
+
+class TileStats(NamedTuple):
+    items: int
+    changed: int
+    written: int
+    removed: int
+    full: bool
+
+
+def tile_for(lat: float, lng: float, zoom: int) -> Tuple[int, int]:
+    n = 1 << zoom
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tiles_for(lat: float, lng: float, zooms: Iterable[int]) -> List[Tile]:
+    return [(z, *tile_for(lat, lng, z)) for z in zooms]
+
+
+def feature(item: Item) -> Dict[str, Any]:
+    return {
+        "type": "Feature",
+        "id": str(item.id),
+        "geometry": {"type": "Point", "coordinates": [item.lng, item.lat]},
+        "properties": {
+            "doh_code": item.doh_code,
+            "name": item.clean_name,
+            "address": item.address,
+            "region": item.region,
+            "municipality": item.municipality,
+            "phone": item.phone,
+            "website": str(item.website) if item.website else None,
+        },
+    }
+
+
+def fingerprint(feature: Dict[str, Any]) -> str:
+    return hashlib.sha1(dumps(feature)).hexdigest()
+
+
+def dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, sort_keys=True).encode()
+
+
+def write_atomic(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def tile_path(out_dir: Path, tile: Tile) -> Path:
+    z, x, y = tile
+    return out_dir / str(z) / str(x) / f"{y}.json"
+
+
+def collection(features: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"type": "FeatureCollection", "features": list(features)}
+
+
+def load_manifest(out_dir: Path) -> Optional[Dict[str, Any]]:
+    path = out_dir / MANIFEST
+    if not path.exists():
+        return None
+    manifest = json.loads(path.read_text())
+    return manifest if manifest.get("version") == MANIFEST_VERSION else None
+
+
+def build_tiles(
+    db: Session,
+    out_dir: str,
+    *,
+    min_zoom: int = 5,
+    max_zoom: int = 12,
+    url_prefix: str = "/tiles",
+    full: bool = False,
+) -> TileStats:
+    out = Path(out_dir)
+    zooms = range(min_zoom, max_zoom + 1)
+    # a server-side cursor where the backend has one, items are read in chunks
+    rows = (
+        db.execute(
+            sa.select(Item)
+            .where(Item.lat.isnot(None), Item.lng.isnot(None))
+            .order_by(Item.doh_code)
+            .execution_options(stream_results=True)
+        )
+        .yield_per(STREAM_CHUNK)
+        .scalars()
+    )
+
+    features: Dict[str, Dict[str, Any]] = {}
+    entries: Dict[str, Dict[str, Any]] = {}
+    by_tile: Dict[Tile, List[str]] = defaultdict(list)
+    for item in rows:
+        f = feature(item)
+        features[f["id"]] = f
+        entries[f["id"]] = {"fingerprint": fingerprint(f), "lat": item.lat, "lng": item.lng}
+        for tile in tiles_for(item.lat, item.lng, zooms):
+            by_tile[tile].append(f["id"])
+
+    manifest = None if full else load_manifest(out)
+    if manifest is not None and (manifest["min_zoom"], manifest["max_zoom"]) != (
+        min_zoom,
+        max_zoom,
+    ):
+        logger.info("tile zoom range changed, rebuilding every tile")
+        manifest = None
+
+    if manifest is None:
+        full = True
+        if out.exists():
+            for zoom_dir in out.iterdir():
+                if zoom_dir.is_dir() and zoom_dir.name.isdigit():
+                    shutil.rmtree(zoom_dir)
+        dirty: Set[Tile] = set(by_tile)
+        changed = len(entries)
+    else:
+        previous: Dict[str, Dict[str, Any]] = manifest["items"]
+        dirty = set()
+        changed = 0
+        for id in entries.keys() | previous.keys():
+            old, new = previous.get(id), entries.get(id)
+            if old is not None and new is not None and old["fingerprint"] == new["fingerprint"]:
+                continue
+            changed += 1
+            for entry in (old, new):
+                if entry is not None:
+                    dirty.update(tiles_for(entry["lat"], entry["lng"], zooms))
+
+    written = removed = 0
+    for tile in sorted(dirty):
+        path = tile_path(out, tile)
+        ids = by_tile.get(tile)
+        if ids:
+            write_atomic(path, dumps(collection(features[id] for id in ids)))
+            written += 1
+        elif path.exists():
+            path.unlink()
+            removed += 1
+
+    if full or changed:
+        write_atomic(out / COLLECTION, dumps(collection(features.values())))
+        lats = [e["lat"] for e in entries.values()]
+        lngs = [e["lng"] for e in entries.values()]
+        index = {
+            "tilejson": "2.2.0",
+            "name": "facilities",
+            "format": "geojson",
+            "tiles": [f"{url_prefix}/{{z}}/{{x}}/{{y}}.json"],
+            "data": [f"{url_prefix}/{COLLECTION}"],
+            "minzoom": min_zoom,
+            "maxzoom": max_zoom,
+            "bounds": [min(lngs), min(lats), max(lngs), max(lats)] if entries else None,
+        }
+        write_atomic(out / INDEX, dumps(index))
+    write_atomic(
+        out / MANIFEST,
+        dumps(
+            {
+                "version": MANIFEST_VERSION,
+                "min_zoom": min_zoom,
+                "max_zoom": max_zoom,
+                "items": entries,
+            }
+        ),
+    )
+    stats = TileStats(len(entries), changed, written, removed, full)
+    logger.info(
+        f"{stats.items} facilities, {stats.changed} changed: "
+        f"{stats.written} tiles written, {stats.removed} removed{' (full build)' if full else ''}"
+    )
+    return stats
@@ -0,0 +1,291 @@
+"""
+Upload storage
+
+Files arrive whole in a single multipart POST or in chunks, following
+FilePond's chunked protocol: a POST with `Upload-Length` reserves an upload,
+each PATCH appends one chunk at `Upload-Offset` and a HEAD reports the offset
+reached, so an interrupted upload resumes where it stopped instead of
+restarting. Bytes are streamed to a partial file and hashed as they arrive; a
+completed upload moves to `UPLOAD_DIR/<sha256[:2]>/<sha256>`, identical files
+are stored once.
+
+A user may have `UPLOAD_MAX_OPEN` unfinished uploads at a time. Unfinished
+uploads untouched for `UPLOAD_PARTIAL_TTL_HOURS` are dropped with their
+partial files by `expire_partials`, which runs every `SWEEP_INTERVAL` as new
+uploads and chunks come in. Chunks of one upload are written one at a time
+in a process.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+import weakref
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import AsyncIterator, Dict, Optional, Tuple
+from uuid import UUID
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.datastructures import UploadFile
+import sqlalchemy as sa
+
+from app import models
+from app.config import settings
+from app.metrics import run_in_threadpool
+
+CHUNK_SIZE = 1 << 16
+DIGEST = re.compile(r"^[0-9a-f]{64}$")
+# seconds between sweeps of expired partial uploads
+SWEEP_INTERVAL = 600
+
+
+class OffsetMismatch(ValueError):
+    def __init__(self, expected: int):
+        super().__init__(f"Expected a chunk at offset {expected}")
+        self.expected = expected
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class TooManyUploads(ValueError):
+    pass
+
+
+def partial_path(upload_id: UUID) -> Path:
+    return Path(settings.UPLOAD_DIR) / "partial" / str(upload_id)
+
+
+def blob_path(digest: str) -> Path:
+    return Path(settings.UPLOAD_DIR) / digest[:2] / digest
+
+
+# running sha256 of partial uploads in this process, keyed by upload id along
+# with the offset it has consumed and when it was last used. A chunk landing on
+# another worker, or after a restart, rehashes the partial file instead.
+_hashers: Dict[UUID, Tuple[int, "hashlib._Hash", float]] = {}
+# one chunk at a time per upload, a lock lives as long as someone holds it
+_locks: "weakref.WeakValueDictionary[UUID, asyncio.Lock]" = weakref.WeakValueDictionary()
+_swept_at: Optional[float] = None
+
+
+def _hasher_at(upload_id: UUID, offset: int) -> "hashlib._Hash":
+    entry = _hashers.pop(upload_id, None)
+    if entry is not None and entry[0] == offset:
+        return entry[1]
+    hasher = hashlib.sha256()
+    remaining = offset
+    with open(partial_path(upload_id), "rb") as f:
+        while remaining:
+            data = f.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            hasher.update(data)
+            remaining -= len(data)
+    return hasher
+
+
+def _open_at(path: Path, offset: int):
+    """the partial file positioned at `offset`, bytes of an unfinished chunk dropped"""
+    f = open(path, "r+b")
+    f.truncate(offset)
+    f.seek(offset)
+    return f
+
+
+def _create_partial(upload_id: UUID) -> None:
+    path = partial_path(upload_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch()
+
+
+def _store_blob(upload_id: UUID, digest: str) -> bool:
+    """move a finished partial file in place, False if the content was already stored"""
+    source, target = partial_path(upload_id), blob_path(digest)
+    if target.exists():
+        source.unlink()
+        return False
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(source, target)
+    return True
+
+
+def _remove_stale_partials(cutoff: float) -> int:
+    """partial files not written to since `cutoff`, whether or not a row is left"""
+    removed = 0
+    directory = Path(settings.UPLOAD_DIR) / "partial"
+    if not directory.exists():
+        return 0
+    for path in directory.iterdir():
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+async def expire_partials(db: AsyncSession, now: Optional[datetime] = None) -> int:
+    """drop unfinished uploads untouched for UPLOAD_PARTIAL_TTL_HOURS, returns how many"""
+    global _swept_at
+    _swept_at = time.monotonic()
+    ttl = timedelta(hours=settings.UPLOAD_PARTIAL_TTL_HOURS)
+    now = now or datetime.utcnow()
+    expired = (
+        await db.execute(
+            sa.select(models.Upload.id).where(
+                models.Upload.sha256.is_(None), models.Upload.updated < now - ttl
+            )
+        )
+    ).scalars().all()
+    if expired:
+        await db.execute(
+            sa.delete(models.Upload).where(models.Upload.id.in_(expired)),
+            execution_options={"synchronize_session": False},
+        )
+        await db.commit()
+    stale = time.monotonic() - ttl.total_seconds()
+    for upload_id, (_, _, used) in list(_hashers.items()):
+        if upload_id in expired or used < stale:
+            _hashers.pop(upload_id, None)
+    # the same cutoff in wall clock seconds, for file mtimes
+    cutoff = time.time() + (now - ttl - datetime.utcnow()).total_seconds()
+    files = await run_in_threadpool(_remove_stale_partials, cutoff)
+    if expired or files:
+        logger.info(f"expired {len(expired)} unfinished uploads, {files} partial files")
+    return len(expired)
+
+
+async def _sweep_if_due(db: AsyncSession) -> None:
+    if _swept_at is None or time.monotonic() - _swept_at > SWEEP_INTERVAL:
+        await expire_partials(db)
+
+
+async def start(
+    db: AsyncSession,
+    *,
+    length: int,
+    owner_id: UUID,
+    filename: str = None,
+    content_type: str = None,
+) -> models.Upload:
+    if length > settings.UPLOAD_MAX_BYTES:
+        raise UploadTooLarge(f"Uploads are limited to {settings.UPLOAD_MAX_BYTES} bytes")
+    await _sweep_if_due(db)
+    open_uploads = await db.scalar(
+        sa.select(sa.func.count())
+        .select_from(models.Upload)
+        .where(models.Upload.created_by_id == owner_id, models.Upload.sha256.is_(None))
+    )
+    if open_uploads >= settings.UPLOAD_MAX_OPEN:
+        raise TooManyUploads(
+            f"{open_uploads} uploads are unfinished, complete or revert one first"
+        )
+    upload = models.Upload(
+        filename=filename,
+        content_type=content_type,
+        length=length,
+        received=0,
+        created_by_id=owner_id,
+    )
+    db.add(upload)
+    await db.flush()
+    await run_in_threadpool(_create_partial, upload.id)
+    await db.commit()
+    return upload
+
+
+async def append(
+    db: AsyncSession, upload: models.Upload, offset: int, chunks: AsyncIterator[bytes]
+) -> models.Upload:
+    """write one chunk at `offset`, the upload is stored when its last byte arrives"""
+    lock = _locks.get(upload.id)
+    if lock is None:
+        lock = _locks[upload.id] = asyncio.Lock()
+    async with lock:
+        # another chunk may have landed while this one waited
+        await db.refresh(upload, ["received", "sha256"])
+        return await _append(db, upload, offset, chunks)
+
+
+async def _append(
+    db: AsyncSession, upload: models.Upload, offset: int, chunks: AsyncIterator[bytes]
+) -> models.Upload:
+    if upload.complete:
+        return upload
+    if offset != upload.received:
+        raise OffsetMismatch(upload.received)
+
+    hasher = await run_in_threadpool(_hasher_at, upload.id, offset)
+    f = await run_in_threadpool(_open_at, partial_path(upload.id), offset)
+    received = offset
+    try:
+        async for data in chunks:
+            received += len(data)
+            if received > upload.length:
+                raise UploadTooLarge(f"Upload {upload.id} is longer than {upload.length} bytes")
+            await run_in_threadpool(f.write, data)
+            hasher.update(data)
+    finally:
+        await run_in_threadpool(f.close)
+
+    upload.received = received
+    if received == upload.length:
+        digest = hasher.hexdigest()
+        if not await run_in_threadpool(_store_blob, upload.id, digest):
+            logger.info(f"upload {upload.id} duplicates {digest}")
+        upload.sha256 = digest
+    else:
+        _hashers[upload.id] = (received, hasher, time.monotonic())
+    await db.commit()
+    await _sweep_if_due(db)
+    return upload
+
+
+async def store(db: AsyncSession, file: UploadFile, *, owner_id: UUID) -> models.Upload:
+    """store a file received whole"""
+
+    def size() -> int:
+        file.file.seek(0, os.SEEK_END)
+        length = file.file.tell()
+        file.file.seek(0)
+        return length
+
+    async def read() -> AsyncIterator[bytes]:
+        while True:
+            data = await file.read(CHUNK_SIZE)
+            if not data:
+                return
+            yield data
+
+    upload = await start(
+        db,
+        length=await run_in_threadpool(size),
+        owner_id=owner_id,
+        filename=file.filename,
+        content_type=file.content_type,
+    )
+    return await append(db, upload, 0, read())
+
+
+async def remove(db: AsyncSession, upload: models.Upload) -> bool:
+    """drop an upload, its content too unless another upload shares it, True if it did"""
+    _hashers.pop(upload.id, None)
+    if upload.complete:
+        shared = await db.scalar(
+            sa.select(sa.func.count())
+            .select_from(models.Upload)
+            .where(models.Upload.sha256 == upload.sha256, models.Upload.id != upload.id)
+        )
+        path = None if shared else blob_path(upload.sha256)
+    else:
+        path = partial_path(upload.id)
+    await db.delete(upload)
+    await db.commit()
+    if path is not None and path.exists():
+        await run_in_threadpool(path.unlink)
+    return upload.complete and path is not None
@@ -4,11 +4,11 @@ from typing import Any, Dict, Optional, Union
 from uuid import UUID
 
 from passlib.context import CryptContext
-import emails
 from emails.template import JinjaTemplate
 from jose import jwt
 from loguru import logger
 
+from app import mailer
 from app.config import settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -17,38 +17,30 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 def send_email(
     email_to: str,
     subject_template: str = "",
-    html_template: str = "",
+    html_template: Union[str, JinjaTemplate] = "",
     environment: Dict[str, Any] = {},
 ) -> None:
-    message = emails.Message(
-        subject=JinjaTemplate(subject_template),
-        html=JinjaTemplate(html_template),
-        mail_from=(settings.EMAILS_FROM_NAME, settings.EMAILS_FROM_EMAIL),
-    )
-    smtp_options = {"host": settings.SMTP_HOST, "port": settings.SMTP_PORT}
-    if settings.SMTP_TLS:
-        smtp_options["ssl"] = True
-    if settings.SMTP_USER:
-        smtp_options["user"] = settings.SMTP_USER
-    if settings.SMTP_PASSWORD:
-        smtp_options["password"] = settings.SMTP_PASSWORD
+    """render the message and queue it for the mail worker"""
+    if isinstance(html_template, str):
+        html_template = JinjaTemplate(html_template)
+    subject = JinjaTemplate(subject_template).render(**environment)
+    html = html_template.render(**environment)
     if settings.EMAILS_ENABLED:
-        response = message.send(to=email_to, render=environment, smtp=smtp_options)
-        logger.info(f"send email result: {response}")
+        message_id = mailer.enqueue(email_to, subject, html)
+        logger.info(f"queued email {message_id} to {email_to}")
     else:
         logger.info("Email sending currently disabled")
-        logger.info(f"send email: {email_to}, {message.html.render(**environment)}")
+        logger.info(f"send email: {email_to}, {html}")
 
 
 def send_test_email(email_to: str) -> None:
     project_name = settings.PROJECT_NAME
     subject = f"{project_name} - Test email"
-    with open(Path(settings.EMAIL_TEMPLATES_DIR) / "test_email.html") as f:
-        template_str = f.read()
+    template = mailer.templates.get(Path(settings.EMAIL_TEMPLATES_DIR) / "test_email.html")
     send_email(
         email_to=email_to,
         subject_template=subject,
-        html_template=template_str,
+        html_template=template,
         environment={"project_name": settings.PROJECT_NAME, "email": email_to},
     )
 
@@ -56,14 +48,13 @@ def send_test_email(email_to: str) -> None:
 def send_reset_password_email(email_to: str, email: str, token: str) -> None:
     project_name = settings.PROJECT_NAME
     subject = f"{project_name} - Password recovery for user {email}"
-    with open(Path(settings.EMAIL_TEMPLATES_DIR) / "reset_password.html") as f:
-        template_str = f.read()
+    template = mailer.templates.get(Path(settings.EMAIL_TEMPLATES_DIR) / "reset_password.html")
     server_host = settings.SERVER_HOST
     link = f"{server_host}/#/reset-password/{token}"
     send_email(
         email_to=email_to,
         subject_template=subject,
-        html_template=template_str,
+        html_template=template,
         environment={
             "project_name": settings.PROJECT_NAME,
             "username": email,
@@ -77,13 +68,12 @@ def send_reset_password_email(email_to: str, email: str, token: str) -> None:
 def send_new_account_email(email_to: str, username: str, token: str) -> None:
     project_name = settings.PROJECT_NAME
     subject = f"{project_name} - New account verification for user {username}"
-    with open(Path(settings.EMAIL_TEMPLATES_DIR) / "new_account.html") as f:
-        template_str = f.read()
+    template = mailer.templates.get(Path(settings.EMAIL_TEMPLATES_DIR) / "new_account.html")
     link = f"{settings.SERVER_HOST}/#/confirm-registration/{token}"
     send_email(
         email_to=email_to,
         subject_template=subject,
-        html_template=template_str,
+        html_template=template,
         environment={
             "project_name": settings.PROJECT_NAME,
             "username": username,
@@ -97,12 +87,11 @@ def send_new_account_email(email_to: str, username: str, token: str) -> None:
 def send_new_account_info(email_to: str, username: str, full_name: str, about: str) -> None:
     project_name = settings.PROJECT_NAME
     subject = f"{project_name} - New account created for {username}"
-    with open(Path(settings.EMAIL_TEMPLATES_DIR) / "new_account_info.html") as f:
-        template_str = f.read()
+    template = mailer.templates.get(Path(settings.EMAIL_TEMPLATES_DIR) / "new_account_info.html")
     send_email(
         email_to=email_to,
         subject_template=subject,
-        html_template=template_str,
+        html_template=template,
         environment={
             "project_name": settings.PROJECT_NAME,
             "username": username,
@@ -116,12 +105,11 @@ def send_new_account_info(email_to: str, username: str, full_name: str, about: s
 def send_welcome_email(email_to: str, username: str) -> None:
     project_name = settings.PROJECT_NAME
     subject = f"{project_name} - Welcome {username}"
-    with open(Path(settings.EMAIL_TEMPLATES_DIR) / "welcome_confirmed.html") as f:
-        template_str = f.read()
+    template = mailer.templates.get(Path(settings.EMAIL_TEMPLATES_DIR) / "welcome_confirmed.html")
     send_email(
         email_to=email_to,
         subject_template=subject,
-        html_template=template_str,
+        html_template=template,
         environment={
             "project_name": settings.PROJECT_NAME,
             "username": username,
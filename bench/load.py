@@ -0,0 +1,350 @@
+"""
+HTTP load test of the API
+
+Seeds a scratch database, starts the app under uvicorn in a subprocess and
+drives each scenario with `--concurrency` concurrent clients, one scenario at
+a time. Reports p50/p95/p99 latency, throughput and errors per scenario as
+JSON. Given a `--baseline` from an earlier run it exits non-zero when a
+scenario's p95 or throughput got worse by more than `--threshold`, or its
+error rate went up.
+
+    python -m bench.load --requests 2000 --concurrency 32 --out after.json \\
+        --baseline before.json
+
+`--database-url` runs against another database (PostgreSQL): it must be a
+scratch database, its tables are dropped and seeded again.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+ADMIN = ("admin@example.com", "bench-admin-password")
+USER = ("user@example.com", "bench-user-password")
+
+
+class Scenario(NamedTuple):
+    name: str
+    # request number -> httpx.request kwargs
+    request: Callable[[int], Dict[str, Any]]
+    requests: int
+
+
+def seed(items: int) -> None:
+    from app import models
+    from app.database import Base, SessionLocal, engine
+    from app.utils import get_password_hash
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with SessionLocal() as db:
+        for (email, password), superuser in ((ADMIN, True), (USER, False)):
+            db.add(
+                models.User(
+                    email=email,
+                    hashed_password=get_password_hash(password),
+                    is_superuser=superuser,
+                    is_verified=True,
+                )
+            )
+        db.add_all(
+            models.Item(
+                doh_code=f"DOH{i:06d}",
+                name=f"Hospital {i}",
+                address=f"{i} Rizal Avenue",
+                region=f"Region {i % 17}",
+                municipality=f"Municipality {i % 150}",
+                lat=5 + (i % 1000) / 100,
+                lng=117 + (i // 1000) / 10,
+            )
+            for i in range(items)
+        )
+        db.commit()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, workers: int, env: Dict[str, str]) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app.main:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            sys.exit(f"the server exited with {server.returncode}")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return server
+        except httpx.TransportError:
+            time.sleep(0.2)
+    server.terminate()
+    sys.exit("the server did not start within 30s")
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    """nearest rank"""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+async def run(
+    client: httpx.AsyncClient, scenario: Scenario, concurrency: int
+) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    numbers = iter(range(scenario.requests))
+
+    async def worker() -> None:
+        # the workers share one iterator, each request is sent once
+        for i in numbers:
+            started = time.perf_counter()
+            try:
+                response = await client.request(**scenario.request(i))
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(
+        n for status, n in statuses.items() if not status.startswith(("2", "3"))
+    )
+    return {
+        "requests": scenario.requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(scenario.requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "errors": errors,
+        "error_rate": round(errors / scenario.requests, 4),
+        "statuses": dict(statuses),
+    }
+
+
+async def login(client: httpx.AsyncClient, credentials) -> Dict[str, str]:
+    email, password = credentials
+    response = await client.post(
+        "/api/v1/login/access-token", data={"username": email, "password": password}
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def drive(base_url: str, args) -> Dict[str, Dict[str, Any]]:
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=30
+    ) as client:
+        admin, user = await login(client, ADMIN), await login(client, USER)
+        # the login cookie would authenticate the scenarios that send no token
+        client.cookies.clear()
+        rng = random.Random(args.seed)
+        codes = [
+            f"DOH{rng.randrange(args.items):06d}" for _ in range(max(args.requests, 1))
+        ]
+
+        scenarios = [
+            Scenario(
+                "GET /api/v1/items/",
+                lambda i: {
+                    "method": "GET",
+                    "url": "/api/v1/items/",
+                    "params": {
+                        "after_value": codes[i % len(codes)],
+                        "limit": args.page_size,
+                    },
+                },
+                args.requests,
+            ),
+            Scenario(
+                "POST /api/v1/login/access-token",
+                lambda i: {
+                    "method": "POST",
+                    "url": "/api/v1/login/access-token",
+                    "data": {"username": USER[0], "password": USER[1]},
+                },
+                args.login_requests,
+            ),
+            Scenario(
+                "GET /api/v1/users/me",
+                lambda i: {"method": "GET", "url": "/api/v1/users/me", "headers": user},
+                args.requests,
+            ),
+            Scenario(
+                "PUT /api/v1/items/{doh_code}",
+                lambda i: {
+                    "method": "PUT",
+                    "url": f"/api/v1/items/{codes[i % len(codes)]}",
+                    "json": {"name": f"Hospital {codes[i % len(codes)]} rev {i}"},
+                    "headers": admin,
+                },
+                args.write_requests,
+            ),
+        ]
+        results = {}
+        for scenario in scenarios:
+            if args.scenario and not any(s in scenario.name for s in args.scenario):
+                continue
+            # warm up connections and caches, not measured
+            await run(client, scenario._replace(requests=min(scenario.requests, 20)), 4)
+            client.cookies.clear()
+            results[scenario.name] = await run(client, scenario, args.concurrency)
+            client.cookies.clear()
+            print(
+                f"{scenario.name}: {results[scenario.name]['throughput_rps']} req/s, "
+                f"p95 {results[scenario.name]['p95_ms']}ms",
+                file=sys.stderr,
+            )
+        return results
+
+
+def compare(
+    current: Dict[str, Any], baseline: Dict[str, Any], threshold: float
+) -> List[str]:
+    """regressions of `current` against `baseline`"""
+    regressions = []
+    for name, now in current["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            continue
+        if now["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {now['p95_ms']}ms")
+        if now["throughput_rps"] < before["throughput_rps"] * (1 - threshold):
+            regressions.append(
+                f"{name}: throughput {before['throughput_rps']} -> {now['throughput_rps']} req/s"
+            )
+        if now["error_rate"] > before["error_rate"] + 0.01:
+            regressions.append(
+                f"{name}: error rate {before['error_rate']:.2%} -> {now['error_rate']:.2%}"
+            )
+    return regressions
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return (
+            subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=ROOT,
+                capture_output=True,
+                text=True,
+            ).stdout.strip()
+            or None
+        )
+    except OSError:
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--database-url", help="scratch database, a temporary SQLite file by default"
+    )
+    parser.add_argument("--items", type=int, default=5000, help="items seeded")
+    parser.add_argument("--requests", type=int, default=2000, help="per read scenario")
+    parser.add_argument("--login-requests", type=int, default=100, help="bcrypt bound")
+    parser.add_argument("--write-requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument(
+        "--scenario", action="append", help="only scenarios containing this"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the results here")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="allowed regression"
+    )
+    args = parser.parse_args()
+
+    database_url = args.database_url or "sqlite:///" + os.path.join(
+        tempfile.mkdtemp(), "bench.db"
+    )
+    env = {
+        **os.environ,
+        "SQLALCHEMY_DATABASE_URL": database_url,
+        "EMAILS_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+    }
+    env.setdefault("SECRET_KEY", "bench-" + "x" * 32)
+    # app.config reads the environment on import
+    os.environ.update(env)
+    sys.path.insert(0, str(ROOT))
+    seed(args.items)
+
+    port = free_port()
+    server = start_server(port, args.workers, env)
+    try:
+        scenarios = asyncio.run(drive(f"http://127.0.0.1:{port}", args))
+    finally:
+        server.terminate()
+        server.wait(10)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "database": database_url.split(":", 1)[0],
+            "items": args.items,
+            "workers": args.workers,
+        },
+        "scenarios": scenarios,
+    }
+    output = json.dumps(results, indent=2)
+    if args.out:
+        Path(args.out).write_text(output + "\n")
+    print(output)
+
+    if args.baseline:
+        regressions = compare(
+            results, json.loads(Path(args.baseline).read_text()), args.threshold
+        )
+        if regressions:
+            sys.exit("regressions:\n" + "\n".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
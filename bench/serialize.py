@@ -0,0 +1,112 @@
+"""
+Per row cost of rendering item and user pages
+
+Compares the `response_model` path (ORM objects validated by pydantic, then
+`jsonable_encoder` and `JSONResponse`) with the column tuple + `RowEncoder`
+path of `app.serialize`, on a page read from a scratch SQLite database.
+Both must render the same JSON.
+
+    python -m bench.serialize --rows 500 --repeat 50
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# a scratch database, before app.config reads the environment
+os.environ["SQLALCHEMY_DATABASE_URL"] = "sqlite:///" + os.path.join(
+    tempfile.mkdtemp(), "bench.db"
+)
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+from app import crud, models, schemas  # noqa: E402
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.serialize import item_rows, user_rows  # noqa: E402
+
+
+def seed(rows: int) -> None:
+    Base.metadata.create_all(engine)
+    now = datetime(2021, 8, 1)
+    with SessionLocal() as db:
+        db.add_all(
+            models.Item(
+                id=uuid.uuid4(),
+                doh_code=f"DOH{i:06d}",
+                name=f" Hospital {i} ",
+                address=f"{i} Rizal Avenue",
+                region="NCR",
+                municipality="Manila",
+                lat=14.5 + i / 10000,
+                lng=121.0 + i / 10000,
+                phone="02 8123 4567 ",
+                website=f"https://hospital{i}.example.com/",
+            )
+            for i in range(rows)
+        )
+        db.add_all(
+            models.User(
+                id=uuid.uuid4(),
+                email=f"user{i}@example.com",
+                full_name=f"User {i}",
+                hashed_password="x",
+                created=now + timedelta(seconds=i),
+            )
+            for i in range(rows)
+        )
+        db.commit()
+
+
+def timed(fn, repeat: int) -> float:
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def bench(name, crud_obj, schema, encoder, sort_key, rows, repeat):
+    def orm():
+        with SessionLocal() as db:
+            page = crud_obj.get_page(db, sort_key=sort_key, limit=rows)
+            items = [schema.from_orm(obj) for obj in page.items]
+            return JSONResponse(jsonable_encoder(items)).body
+
+    def fast():
+        with SessionLocal() as db:
+            page = crud_obj.get_page(db, sort_key=sort_key, limit=rows, columns=encoder.columns)
+            return encoder.encode(page.items)
+
+    if json.loads(orm()) != json.loads(fast()):
+        sys.exit(f"{name}: the fast path renders different JSON")
+    before, after = timed(orm, repeat), timed(fast, repeat)
+    return {
+        "endpoint": name,
+        "rows": rows,
+        "before_us_per_row": round(before / rows * 1e6, 2),
+        "after_us_per_row": round(after / rows * 1e6, 2),
+        "speedup": round(before / after, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    seed(args.rows)
+    results = [
+        bench("GET /items", crud.item, schemas.ItemOut, item_rows, "doh_code", args.rows, args.repeat),
+        bench("GET /users", crud.user, schemas.User, user_rows, "email", args.rows, args.repeat),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,17 +22,106 @@ def generate():
     pass
 
 
-@generate.command()
+@load.command()
+@click.argument("data_file", type=click.Path(exists=True))
+@click.option("--format", "fmt", type=click.Choice(loader.FORMATS), default=None)
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option("--resume/--no-resume", default=True, help="continue from the last checkpoint")
+def beds(data_file, fmt, batch_size, resume):
+    """bulk load bed occupancy reports from a JSON, NDJSON or CSV feed"""
+    loader.load_beds(data_file, fmt=fmt, batch_size=batch_size, resume=resume)
+
+
+@load.command()
 @click.argument("data_file", type=click.Path(exists=True))
-def hospital_json(data_file="data/sample_geodetails.json"):
+@click.option("--format", "fmt", type=click.Choice(loader.FORMATS), default=None)
+@click.option("--batch-size", default=1000, show_default=True)
+@click.option("--resume/--no-resume", default=True, help="continue from the last checkpoint")
+def items(data_file, fmt, batch_size, resume):
+    """bulk load facilities from a JSON, NDJSON or CSV feed, upserted on doh_code"""
+    loader.load_items(data_file, fmt=fmt, batch_size=batch_size, resume=resume)
+
+
+@load.command()
+def projections():
+    """rebuild the bed_latest and bed_rollup projections from the bed history"""
+    from app import projections
+    from app.database import engine
+
+    with engine.begin() as conn:
+        projections.rebuild_latest(conn)
+        projections.rebuild_rollups(conn)
+
+
+@generate.command()
+@click.argument("data_file", type=click.Path(exists=True), default="data/sample_geodetails.json")
+def hospital_json(data_file):
 
     data = []
-    for row in json.load(open(geodetails_file)):
+    for row in json.load(open(data_file)):
         data.append(row)
 
     json.dump(data, open("web/public/data.json", "w"))
 
 
+@generate.command()
+@click.option("--out", "out_dir", default="web/public/tiles", show_default=True)
+@click.option("--min-zoom", default=5, show_default=True)
+@click.option("--max-zoom", default=12, show_default=True)
+@click.option("--full", is_flag=True, help="rebuild every tile, not only the changed ones")
+def tiles(out_dir, min_zoom, max_zoom, full):
+    """GeoJSON feature collection and z/x/y tiles of the facilities, served from web/public"""
+    from app import tiles
+    from app.database import SessionLocal
+
+    with SessionLocal() as db:
+        tiles.build_tiles(db, out_dir, min_zoom=min_zoom, max_zoom=max_zoom, full=full)
+
+
+@generate.command()
+@click.option("--dir", "directory", default="web/public", show_default=True)
+@click.option("--min-size", default=512, show_default=True, help="smaller files are left alone")
+def static(directory, min_size):
+    """write .br/.gz siblings of the web assets, run after building the web app"""
+    from app import static
+
+    static.precompress(directory, min_size=min_size)
+
+
+@generate.command()
+@click.option("--facilities", default=1000, show_default=True)
+@click.option("--users", default=100, show_default=True)
+@click.option("--years", default=1.0, show_default=True, help="of bed report history")
+@click.option("--every", default=24.0, show_default=True, help="hours between bed reports")
+@click.option("--seed", default=0, show_default=True)
+@click.option("--batch-size", default=10000, show_default=True)
+@click.option("--password", default="synthetic", show_default=True, help="of every user")
+@click.option(
+    "--projections/--no-projections",
+    default=True,
+    help="rebuild bed_latest and bed_rollup, the slow part of large runs",
+)
+def synthetic(facilities, users, years, every, seed, batch_size, password, projections):
+    """deterministic facilities, users and bed history for scale testing, into a fresh database"""
+    from datetime import timedelta
+
+    from app import synthetic
+
+    try:
+        synthetic.generate(
+            facility_count=facilities,
+            user_count=users,
+            years=years,
+            every=timedelta(hours=every),
+            seed=seed,
+            batch_size=batch_size,
+            password=password,
+            projections=projections,
+        )
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+
 cli.add_command(load)
 cli.add_command(generate)
 
@@ -0,0 +1,23 @@
+import os
+import tempfile
+
+import pytest
+
+# a scratch database and fixed settings, before app.config reads the environment
+os.environ["SQLALCHEMY_DATABASE_URL"] = "sqlite:///" + os.path.join(
+    tempfile.mkdtemp(), "test.db"
+)
+os.environ["READ_DATABASE_URL"] = ""
+os.environ["SECRET_KEY"] = "test-secret-key-" + "x" * 32
+os.environ["EMAILS_ENABLED"] = "false"
+
+
+@pytest.fixture
+def database():
+    """empty tables for one test"""
+    from app import models  # noqa: F401
+    from app.database import Base, engine
+
+    Base.metadata.create_all(engine)
+    yield engine
+    Base.metadata.drop_all(engine)
@@ -0,0 +1,76 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import crud, models
+from app.api import deps
+from app.cache import etag_matches, item_responses
+from app.database import SessionLocal, async_engine
+from app.main import api, app
+
+URL = "/api/v1/items/"
+
+
+@pytest.fixture
+def client(database):
+    with SessionLocal() as db:
+        for n in range(3):
+            db.add(models.Item(id=uuid.uuid4(), doh_code=f"DOH{n}", name=f"Hospital {n}"))
+        db.commit()
+    item_responses.invalidate()
+    admin = models.User(id=uuid.uuid4(), email="admin@example.com", is_superuser=True)
+    api.dependency_overrides[deps.get_current_active_superuser] = lambda: admin
+    yield TestClient(app)
+    api.dependency_overrides.clear()
+    item_responses.invalidate()
+    asyncio.run(async_engine.dispose())
+
+
+def test_etag_matches():
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches('W/"a", "b"', '"a"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches('"b"', '"a"')
+    assert not etag_matches(None, '"a"')
+
+
+def test_repeat_request_is_not_modified(client):
+    first = client.get(URL)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    again = client.get(URL, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+    # other pages are cached apart
+    assert client.get(URL, params={"limit": 1}).headers["ETag"] != etag
+
+
+def test_item_update_invalidates_the_cached_pages(client):
+    etag = client.get(URL).headers["ETag"]
+
+    response = client.put(f"{URL}DOH1", json={"name": "Renamed"})
+    assert response.status_code == 200, response.text
+
+    fresh = client.get(URL, headers={"If-None-Match": etag})
+    assert fresh.status_code == 200
+    assert fresh.headers["ETag"] != etag
+    assert [i["clean_name"] for i in fresh.json()] == ["Hospital 0", "Renamed", "Hospital 2"]
+
+
+def test_item_create_and_remove_invalidate_the_cached_pages(client):
+    etag = client.get(URL).headers["ETag"]
+    with SessionLocal() as db:
+        item = crud.item.create(db, obj_in=models.Item(name="New"))
+        created = client.get(URL, headers={"If-None-Match": etag})
+        assert created.status_code == 200
+        assert len(created.json()) == 4
+
+        crud.item.remove(db, id=item.id)
+    removed = client.get(URL, headers={"If-None-Match": created.headers["ETag"]})
+    assert removed.status_code == 200
+    assert removed.headers["ETag"] == etag
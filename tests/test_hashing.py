@@ -0,0 +1,37 @@
+import asyncio
+
+from starlette.concurrency import run_in_threadpool
+
+from app import hashing, utils
+
+
+def queued_count():
+    return {name: value for name, _, value in hashing.queue_seconds.samples()}.get(
+        "password_hashing_queue_seconds_count", 0
+    )
+
+
+def test_sync_callers_go_through_the_pool():
+    hasher = hashing.PasswordHasher(1, 1, 30)
+    before = queued_count()
+
+    async def hash_and_verify():
+        await hasher.start()
+        try:
+            hashed = await run_in_threadpool(hasher.hash_blocking, "secret")
+            verified = await run_in_threadpool(hasher.verify_blocking, "secret", hashed)
+        finally:
+            await hasher.shutdown()
+        return hashed, verified
+
+    hashed, verified = asyncio.run(hash_and_verify())
+    assert verified
+    assert hasher.completed == 2
+    assert queued_count() == before + 2
+
+
+def test_hashes_inline_without_a_running_app():
+    hasher = hashing.PasswordHasher(1, 1, 30)
+    hashed = hasher.hash_blocking("secret")
+    assert utils.verify_password("secret", hashed)
+    assert hasher.completed == 0
@@ -0,0 +1,66 @@
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import projections
+from app.database import SessionLocal
+from app.main import app
+from app.models import Bed, Item
+
+URL = "/api/v1/items/beds/trend"
+
+
+@pytest.fixture
+def client(database):
+    hospital_id = uuid.uuid4()
+    with SessionLocal() as db:
+        db.add(
+            Item(id=hospital_id, doh_code="DOH000001", name="Hospital", region="NCR")
+        )
+        for hour in (6, 18):
+            db.add(
+                Bed(
+                    doh_id=1,
+                    hosp_id=hospital_id,
+                    icu_vacant=hour,
+                    reportdate=datetime(2021, 6, 1, hour),
+                    updated=datetime(2021, 6, 1, hour),
+                )
+            )
+        db.commit()
+    with database.begin() as conn:
+        projections.rebuild_rollups(conn)
+    return TestClient(app)
+
+
+def test_trend_accepts_aware_datetimes(client):
+    params = {"scope": "region", "key": "NCR", "max_points": 48}
+    naive = client.get(
+        URL,
+        params={**params, "start": "2021-06-01T00:00:00", "end": "2021-06-02T00:00:00"},
+    )
+    aware = client.get(
+        URL,
+        params={
+            **params,
+            "start": "2021-06-01T08:00:00+08:00",
+            "end": "2021-06-02T08:00:00+08:00",
+        },
+    )
+    assert naive.status_code == aware.status_code == 200, aware.text
+    assert len(naive.json()["points"]) == 2
+    assert aware.json() == naive.json()
+
+
+def test_trend_accepts_an_aware_start_without_end(client):
+    response = client.get(
+        URL,
+        params={
+            "scope": "facility",
+            "key": "DOH000001",
+            "start": "2021-06-01T00:00:00Z",
+        },
+    )
+    assert response.status_code == 200, response.text
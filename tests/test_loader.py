@@ -0,0 +1,118 @@
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy as sa
+
+from app import loader
+from app.database import Base, SessionLocal
+from app.models import Bed, Item, SourceType
+
+# a PostgreSQL database to run the COPY path against, left as it was found
+POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL")
+
+
+@pytest.fixture
+def postgres():
+    if not POSTGRES_URL:
+        pytest.skip("TEST_POSTGRES_URL is not set")
+    engine = sa.create_engine(POSTGRES_URL)
+    with engine.connect() as conn:
+        # DDL is transactional on PostgreSQL, the whole test rolls back
+        outer = conn.begin()
+        Base.metadata.create_all(conn)
+        yield conn
+        outer.rollback()
+    engine.dispose()
+
+
+def bed_rows(hospitals):
+    start = datetime(2021, 8, 1, 6)
+    rows = []
+    for n, hosp_id in enumerate(hospitals):
+        for day in range(3):
+            reportdate = start + timedelta(days=day)
+            rows.append(
+                {
+                    "doh_id": n,
+                    "hosp_id": hosp_id,
+                    "icu_vacant": day,
+                    "icu_occupied": None if day == 1 else 10 - day,
+                    "isolbed_vacant": 5,
+                    "isolbed_occupied": 0,
+                    "beds_ward_vacant": 20 + n,
+                    "beds_ward_occupied": 30,
+                    "reportdate": reportdate,
+                    "updated": reportdate + timedelta(minutes=30),
+                    "source": SourceType.DOH if day else SourceType.CROWD,
+                }
+            )
+    # the same report sent again within the batch, the last copy wins
+    rows.append({**rows[0], "icu_vacant": 99, "source": SourceType.HOSPITAL})
+    return rows
+
+
+def written(conn, write, batches):
+    savepoint = conn.begin_nested()
+    for rows in batches:
+        write(conn, rows)
+    columns = [c for c in Bed.__table__.c if c.name not in ("id", "created")]
+    result = conn.execute(
+        sa.select(*columns).order_by(Bed.hosp_id, Bed.reportdate, Bed.updated)
+    ).all()
+    savepoint.rollback()
+    return result
+
+
+def test_copy_and_upsert_write_the_same_rows(postgres):
+    hospitals = [uuid.uuid4(), uuid.uuid4()]
+    postgres.execute(
+        Item.__table__.insert(),
+        [
+            {"id": h, "doh_code": f"DOH{n}", "name": f"H{n}"}
+            for n, h in enumerate(hospitals)
+        ],
+    )
+    first = bed_rows(hospitals)
+    # a later batch re-sends a report with corrected counts
+    second = [{**first[1], "icu_vacant": 7, "beds_ward_occupied": None}]
+
+    upserted = written(postgres, loader.upsert_beds, [first, second])
+    copied = written(postgres, loader.copy_beds, [first, second])
+    assert len(upserted) == 6
+    assert copied == upserted
+
+
+def facility(code, **fields):
+    return {
+        "doh_code": code,
+        "name": f"Hospital {code}",
+        "address": "1 Rizal Avenue",
+        "region": "NCR",
+        "municipality": "Manila",
+        **fields,
+    }
+
+
+def test_load_items_upserts_valid_facilities(database, tmp_path):
+    feed = tmp_path / "items.ndjson"
+    records = [
+        facility("DOH1", phone="02 8123 4567"),
+        facility("DOH2", phone="12"),  # not a valid number
+        facility(None),
+        facility("DOH3", phone="+63 2 8765 4321"),
+        facility("DOH1", phone="02 8123 4567", name="Renamed"),
+    ]
+    feed.write_text("".join(json.dumps(r) + "\n" for r in records))
+
+    stats = loader.load_items(str(feed), batch_size=2, engine=database)
+    assert (stats.read, stats.loaded, stats.invalid) == (5, 3, 2)
+    with SessionLocal() as db:
+        items = {i.doh_code: (i.name, i.phone) for i in db.query(Item)}
+    assert items == {
+        "DOH1": ("Renamed", "(02) 8123 4567"),
+        "DOH3": ("Hospital DOH3", "(02) 8765 4321"),
+    }
+    assert not (tmp_path / "items.ndjson.checkpoint").exists()
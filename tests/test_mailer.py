@@ -0,0 +1,142 @@
+import smtplib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import mailer
+from app.database import SessionLocal
+from app.models import MailStatus, OutboundEmail
+
+
+class FakeSMTP:
+    """stand-in SMTP connection, refuses recipients listed in `refuse`"""
+
+    def __init__(self, outbox, refuse):
+        self.outbox = outbox
+        self.refuse = refuse
+
+    def noop(self):
+        return 250, b"ok"
+
+    def sendmail(self, sender, recipients, message):
+        refused = {r: self.refuse[r] for r in recipients if r in self.refuse}
+        if refused:
+            raise smtplib.SMTPRecipientsRefused(refused)
+        self.outbox.append((recipients, message))
+
+    def close(self):
+        pass
+
+    def quit(self):
+        pass
+
+
+def make_worker(monkeypatch, outbox, refuse):
+    worker = mailer.MailWorker(
+        pool_size=2,
+        batch_size=10,
+        max_attempts=3,
+        retry_seconds=30,
+        poll_seconds=1,
+        retention=timedelta(days=7),
+        lease=timedelta(minutes=10),
+    )
+    monkeypatch.setattr(worker.pool, "_connect", lambda: FakeSMTP(outbox, refuse))
+    worker._senders = ThreadPoolExecutor(2)
+    return worker
+
+
+@pytest.fixture
+def worker(database, monkeypatch):
+    outbox, refuse = [], {}
+    worker = make_worker(monkeypatch, outbox, refuse)
+    monkeypatch.setattr(mailer, "mail_worker", worker)
+    yield worker, outbox, refuse
+    worker._senders.shutdown()
+
+
+def message(message_id):
+    with SessionLocal() as db:
+        return db.get(OutboundEmail, message_id)
+
+
+def test_sent_message_body_is_blanked(worker):
+    worker, outbox, _ = worker
+    message_id = mailer.enqueue(
+        "a@example.com", "Reset", "<a href='/reset?token=secret'>"
+    )
+
+    assert worker.process_batch() == 1
+    assert [(recipients, "Subject: Reset" in body) for recipients, body in outbox] == [
+        (["a@example.com"], True)
+    ]
+    sent = message(message_id)
+    assert sent.status == MailStatus.SENT.value
+    assert sent.sent_at is not None
+    assert sent.html == ""
+
+
+def test_temporary_failure_is_retried(worker):
+    worker, outbox, refuse = worker
+    refuse["b@example.com"] = (451, b"try later")
+    message_id = mailer.enqueue("b@example.com", "Verify", "<p>token</p>")
+
+    worker.process_batch()
+    retried = message(message_id)
+    assert retried.status == MailStatus.PENDING.value
+    assert retried.attempts == 1
+    assert retried.next_attempt_at > datetime.utcnow()
+    assert retried.html == "<p>token</p>"
+    assert outbox == []
+
+
+def test_permanent_failure_is_blanked_and_purged(worker):
+    worker, _, refuse = worker
+    refuse["c@example.com"] = (550, b"no such user")
+    failed_id = mailer.enqueue("c@example.com", "Verify", "<p>token</p>")
+    pending_id = mailer.enqueue("d@example.com", "Later", "<p>later</p>")
+    with SessionLocal() as db:
+        db.get(OutboundEmail, pending_id).next_attempt_at = (
+            datetime.utcnow() + timedelta(hours=1)
+        )
+        db.commit()
+
+    worker.process_batch()
+    failed = message(failed_id)
+    assert failed.status == MailStatus.FAILED.value
+    assert failed.html == ""
+
+    assert worker.purge() == 0
+    assert worker.purge(now=datetime.utcnow() + timedelta(days=8)) == 1
+    assert message(failed_id) is None
+    # messages still queued are never purged
+    assert message(pending_id) is not None
+
+
+def test_workers_sharing_a_queue_send_each_message_once(worker, monkeypatch):
+    first, outbox, refuse = worker
+    second = make_worker(monkeypatch, outbox, refuse)
+    ids = [mailer.enqueue(f"{n}@example.com", "Hello", "<p>hi</p>") for n in range(3)]
+
+    # the first worker claims the batch and is still sending it when a second
+    # worker starts and polls
+    with SessionLocal() as db:
+        assert len(first._claim(db)) == 3
+    assert second.process_batch() == 0
+    assert outbox == []
+
+    # the first worker dies, once the lease runs out the second sends the batch
+    with SessionLocal() as db:
+        for message_id in ids:
+            db.get(OutboundEmail, message_id).claimed_at -= timedelta(minutes=11)
+        db.commit()
+    assert second.process_batch() == 3
+    assert sorted(r for recipients, _ in outbox for r in recipients) == [
+        "0@example.com",
+        "1@example.com",
+        "2@example.com",
+    ]
+    assert first.process_batch() == 0
+    assert {message(i).status for i in ids} == {MailStatus.SENT.value}
+    second._senders.shutdown()
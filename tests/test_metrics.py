@@ -0,0 +1,83 @@
+import asyncio
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import metrics
+from app.config import settings
+from app.main import app
+
+
+def threadpool_calls():
+    return {labels: value for _, labels, value in metrics.threadpool_calls.samples()}
+
+
+def test_metrics_need_the_token(monkeypatch):
+    client = TestClient(app)
+    monkeypatch.setattr(settings, "METRICS_TOKEN", None)
+    assert client.get("/metrics").status_code == 404
+
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "scrape")
+    assert client.get("/metrics").status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape"})
+    assert response.status_code == 200
+    assert "# TYPE threadpool_calls gauge" in response.text
+
+
+@pytest.mark.parametrize("name", metrics.THREADPOOL_CALLERS)
+def test_framework_modules_run_the_counted_threadpool(name):
+    # fails when a framework upgrade moves the threadpool call elsewhere
+    assert importlib.import_module(name).run_in_threadpool is metrics.run_in_threadpool
+
+
+def test_instrumenting_a_module_without_the_threadpool_fails(monkeypatch):
+    monkeypatch.setattr(metrics, "THREADPOOL_CALLERS", ("json",))
+    with pytest.raises(ImportError, match="json no longer imports run_in_threadpool"):
+        metrics.instrument_threadpool()
+
+
+def test_threadpool_capacity_is_set_on_startup(monkeypatch):
+    monkeypatch.setattr(settings, "THREADPOOL_WORKERS", 3)
+
+    async def start():
+        await metrics.start_threadpool()
+        return await asyncio.get_running_loop().run_in_executor(
+            None, lambda: threading.current_thread().name
+        )
+
+    assert asyncio.run(start()).startswith("threadpool")
+    assert [value for _, _, value in metrics.threadpool_max_workers.samples()] == [3]
+
+
+def test_threadpool_calls_are_counted():
+    def running():
+        return threadpool_calls()
+
+    during = asyncio.run(metrics.run_in_threadpool(running))
+    assert during['{state="running"}'] == 1
+    assert during['{state="queued"}'] == 0
+    assert threadpool_calls() == {'{state="queued"}': 0, '{state="running"}': 0}
+
+
+def test_cancelled_calls_leave_the_queue():
+    async def cancel():
+        # a single thread, the second call is still queued when cancelled
+        release = threading.Event()
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(1))
+        first = asyncio.ensure_future(metrics.run_in_threadpool(release.wait))
+        second = asyncio.ensure_future(metrics.run_in_threadpool(lambda: None))
+        await asyncio.sleep(0.05)
+        assert threadpool_calls()['{state="queued"}'] == 1
+        second.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await first
+        await asyncio.sleep(0.05)
+
+    asyncio.run(cancel())
+    assert threadpool_calls() == {'{state="queued"}': 0, '{state="running"}': 0}
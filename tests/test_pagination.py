@@ -0,0 +1,64 @@
+import uuid
+
+import pytest
+
+from app import crud
+from app.database import SessionLocal
+from app.models import Item
+
+CODES = ["DOH3", None, "DOH1", None, "DOH2", None, "DOH4"]
+
+
+@pytest.fixture
+def db(database):
+    with SessionLocal() as db:
+        for n, code in enumerate(CODES):
+            db.add(Item(id=uuid.uuid4(), doh_code=code, name=f"Hospital {n}"))
+        db.commit()
+        yield db
+
+
+def pages(db, limit, **kwargs):
+    page = crud.item.get_page(db, sort_key="doh_code", limit=limit, **kwargs)
+    yield page
+    while page.next_cursor:
+        page = crud.item.get_page(
+            db, sort_key="doh_code", cursor=page.next_cursor, limit=limit
+        )
+        yield page
+
+
+def ids(pages):
+    return [item.id for page in pages for item in page.items]
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 10])
+def test_null_sort_keys_are_paged_last(db, limit):
+    everything = db.query(Item).all()
+    expected = sorted(
+        everything, key=lambda i: (i.doh_code is None, i.doh_code or "", i.id)
+    )
+
+    assert ids(pages(db, limit)) == [i.id for i in expected]
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3])
+def test_prev_cursor_returns_through_null_sort_keys(db, limit):
+    forward = list(pages(db, limit))
+    page = forward[-1]
+    backward = [page]
+    while page.prev_cursor:
+        page = crud.item.get_page(
+            db, sort_key="doh_code", cursor=page.prev_cursor, limit=limit
+        )
+        backward.append(page)
+    assert ids(reversed(backward)) == ids(forward)
+
+
+def test_after_value_keeps_null_sort_keys(db):
+    seen = [
+        item.doh_code
+        for page in pages(db, 2, after_value="DOH3")
+        for item in page.items
+    ]
+    assert seen == ["DOH3", "DOH4", None, None, None]
@@ -0,0 +1,73 @@
+import pytest
+from phonenumbers import (
+    NumberParseException,
+    PhoneNumberFormat,
+    format_number,
+    is_valid_number,
+    number_type,
+    parse as parse_phone_number,
+)
+from pydantic import ValidationError
+
+from app.schemas import item as item_schemas
+
+PHONES = {
+    "02 8123 4567": "(02) 8123 4567",
+    "+63 2 8123 4567": "(02) 8123 4567",
+    "0917 123 4567": "0917 123 4567",
+    "+1 650 253 0000": "+1 650-253-0000",
+    "12": None,
+    "not a phone": None,
+}
+
+
+def before(v):
+    """ItemBase.check_phone_number as it was before the cache"""
+    try:
+        n = parse_phone_number(v, "PH")
+    except NumberParseException as e:
+        raise ValueError(
+            "Phone parse error, please provide a valid phone number"
+        ) from e
+    if not is_valid_number(n) or number_type(n) not in item_schemas.MOBILE_NUMBER_TYPES:
+        raise ValueError("Please provide a valid phone number")
+    return format_number(
+        n,
+        (
+            PhoneNumberFormat.NATIONAL
+            if n.country_code == 63
+            else PhoneNumberFormat.INTERNATIONAL
+        ),
+    )
+
+
+def outcome(normalize, v):
+    try:
+        return normalize(v), None
+    except ValueError as e:
+        return None, str(e)
+
+
+@pytest.mark.parametrize("phone", PHONES)
+def test_cached_phone_matches_the_uncached_validation(phone):
+    item_schemas._normalize_phone.cache_clear()
+    expected = outcome(before, phone)
+    assert expected[0] == PHONES[phone]
+    # a miss, then a hit
+    assert outcome(item_schemas.normalize_phone, phone) == expected
+    assert outcome(item_schemas.normalize_phone, phone) == expected
+    info = item_schemas._normalize_phone.cache_info()
+    assert (info.misses, info.hits) == (1, 1)
+
+
+def test_item_schema_reports_the_cached_error():
+    record = {"name": "H", "address": "A", "region": "NCR", "municipality": "Manila"}
+    for _ in range(2):
+        with pytest.raises(
+            ValidationError, match="Please provide a valid phone number"
+        ):
+            item_schemas.ItemCreate(**record, phone="12")
+    assert (
+        item_schemas.ItemCreate(**record, phone=" 02 8123 4567 ").phone
+        == "(02) 8123 4567"
+    )
@@ -0,0 +1,36 @@
+import json
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+
+from app import crud, models, schemas
+from app.database import SessionLocal
+from app.serialize import item_rows
+
+
+def test_rows_render_like_the_response_model(database):
+    with SessionLocal() as db:
+        db.add_all(
+            [
+                models.Item(
+                    id=uuid.uuid4(),
+                    doh_code="DOH000001",
+                    name=" Hospital ",
+                    lat=14.6,
+                    lng=121.0,
+                    phone=" 02 8123 4567 ",
+                    website="https://example.com/",
+                ),
+                models.Item(id=uuid.uuid4(), doh_code="DOH000002", name="Clinic"),
+            ]
+        )
+        db.commit()
+        orm = crud.item.get_page(db, sort_key="doh_code").items
+        rows = crud.item.get_page(
+            db, sort_key="doh_code", columns=item_rows.columns
+        ).items
+
+    expected = jsonable_encoder([schemas.ItemOut.from_orm(item) for item in orm])
+    rendered = json.loads(item_rows.encode(rows))
+    assert rendered == expected
+    assert [list(item) for item in rendered] == [list(schemas.ItemOut.__fields__)] * 2
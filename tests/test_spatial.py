@@ -0,0 +1,43 @@
+import time
+
+import pytest
+
+from app.spatial import GridIndex, haversine
+
+
+@pytest.fixture
+def index():
+    index = GridIndex(cell_size=0.1)
+    index.rebuild(
+        [
+            ("manila", 14.5995, 120.9842),
+            ("quezon", 14.6760, 121.0437),
+            ("cebu", 10.3157, 123.8854),
+            ("north", 89.95, 120.0),
+            ("south", -89.95, -60.0),
+        ]
+    )
+    return index
+
+
+def test_near_nearest_first(index):
+    found = index.near(14.6, 121.0, radius=50, k=5)
+    assert [key for _, key in found] == ["manila", "quezon"]
+    assert found[0][0] == pytest.approx(haversine(14.6, 121.0, 14.5995, 120.9842))
+
+
+def test_near_respects_radius(index):
+    assert index.near(14.6, 121.0, radius=1, k=5) == []
+
+
+@pytest.mark.parametrize("lat, expected", [(89.9, "north"), (-89.9, "south")])
+def test_near_pole_is_bounded(index, lat, expected):
+    # longitude cells vanish at the poles, the ring count must not follow
+    started = time.perf_counter()
+    found = index.near(lat, 0.0, radius=500, k=10)
+    assert time.perf_counter() - started < 2
+    assert [key for _, key in found] == [expected]
+
+
+def test_bbox(index):
+    assert set(index.bbox(14, 120, 15, 122)) == {"manila", "quezon"}
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from app import sse
+
+
+@pytest.fixture
+def log(monkeypatch):
+    log = sse.EventLog(10, epoch="boot")
+    monkeypatch.setattr(sse, "log", log)
+    return log
+
+
+def test_ids_carry_the_epoch(log):
+    assert log.append("item", "a").id == "boot-1"
+    assert log.append("item", "b").encode().startswith("id: boot-2\n")
+
+
+def test_position(log):
+    for data in "abc":
+        log.append("item", data)
+    assert log.position("boot-2") == 2
+    assert [e.data for e in log.since(log.position("boot-2"))] == ["c"]
+    # another process, an id this log has not reached, garbage
+    assert log.position("other-2") == 0
+    assert log.position("boot-500") == 0
+    assert log.position("17") == 0
+
+
+def test_stream_after_restart_replays_and_goes_live(log):
+    log.append("item", "a")
+    log.append("item", "b")
+
+    async def run():
+        # an id from before a restart, far ahead of this log
+        events = sse.stream("previous-500")
+        assert (await events.__anext__()).startswith("retry:")
+        replayed = [await events.__anext__(), await events.__anext__()]
+        live = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0)
+        sse.notify("item", "c")
+        received = await asyncio.wait_for(live, 1)
+        await events.aclose()
+        return replayed, received
+
+    replayed, received = asyncio.run(run())
+    assert [e.split("\n")[0] for e in replayed] == ["id: boot-1", "id: boot-2"]
+    assert received.startswith("id: boot-3\n")
@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import models, uploads
+from app.api import deps
+from app.api.v1 import filepond
+from app.config import settings
+from app.database import AsyncSessionLocal, SessionLocal, async_engine
+from app.main import api, app
+
+URL = "/api/v1/upload/"
+
+
+def add_user(email):
+    with SessionLocal() as db:
+        user = models.User(id=uuid.uuid4(), email=email, hashed_password="x")
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        db.expunge(user)
+        return user
+
+
+@pytest.fixture
+def client(database, tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(filepond, "completed", lambda upload: None)
+    users = {name: add_user(f"{name}@example.com") for name in ("alice", "bob")}
+    current = {"user": users["alice"]}
+    api.dependency_overrides[deps.get_current_active_user] = lambda: current["user"]
+    client = TestClient(app)
+
+    def login(name):
+        current["user"] = users[name]
+
+    client.login = login
+    yield client
+    api.dependency_overrides.clear()
+    asyncio.run(async_engine.dispose())
+
+
+def stored(upload_id):
+    with SessionLocal() as db:
+        return db.get(models.Upload, uuid.UUID(str(upload_id)))
+
+
+def reserve(client, length):
+    response = client.post(URL, headers={"Upload-Length": str(length)})
+    assert response.status_code == 200, response.text
+    return response.text
+
+
+def test_routes_require_a_user(database):
+    client = TestClient(app)
+    assert client.post(URL, headers={"Upload-Length": "10"}).status_code == 401
+    assert client.patch(URL, params={"patch": str(uuid.uuid4())}).status_code in (
+        401,
+        422,
+    )
+    assert client.delete(URL, data=str(uuid.uuid4())).status_code == 401
+
+
+def test_chunked_upload(client, tmp_path):
+    data = b"0123456789" * 10
+    upload_id = reserve(client, len(data))
+    for offset in range(0, len(data), 40):
+        response = client.patch(
+            URL,
+            params={"patch": upload_id},
+            headers={"Upload-Offset": str(offset)},
+            data=data[offset : offset + 40],
+        )
+        assert response.status_code == 204, response.text
+    digest = hashlib.sha256(data).hexdigest()
+    assert (tmp_path / digest[:2] / digest).read_bytes() == data
+
+
+def test_uploads_of_other_users_are_hidden(client):
+    upload_id = reserve(client, 10)
+    client.login("bob")
+    response = client.patch(
+        URL, params={"patch": upload_id}, headers={"Upload-Offset": "0"}
+    )
+    assert response.status_code == 404
+    assert client.delete(URL, data=upload_id).status_code == 404
+    client.login("alice")
+    assert client.delete(URL, data=upload_id).status_code == 204
+
+
+def test_open_uploads_are_capped(client, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_MAX_OPEN", 2)
+    reserve(client, 10)
+    reserve(client, 10)
+    assert client.post(URL, headers={"Upload-Length": "10"}).status_code == 429
+    client.login("bob")
+    reserve(client, 10)
+
+
+def test_abandoned_partials_expire(client, tmp_path):
+    upload_id = reserve(client, 10)
+    partial = tmp_path / "partial" / upload_id
+
+    async def expire(now):
+        async with AsyncSessionLocal() as db:
+            return await uploads.expire_partials(db, now=now)
+
+    assert asyncio.run(expire(datetime.utcnow())) == 0
+    assert partial.exists()
+    later = datetime.utcnow() + timedelta(hours=settings.UPLOAD_PARTIAL_TTL_HOURS + 1)
+    assert asyncio.run(expire(later)) == 1
+    assert not partial.exists()
+    assert stored(upload_id) is None
+
+
+def test_chunks_at_the_same_offset_are_serialized(client):
+    upload_id = uuid.UUID(reserve(client, 8))
+
+    async def chunk(data):
+        yield data
+
+    async def send(data):
+        async with AsyncSessionLocal() as db:
+            upload = await db.get(models.Upload, upload_id)
+            try:
+                await uploads.append(db, upload, 0, chunk(data))
+                return "ok"
+            except uploads.OffsetMismatch as e:
+                return e.expected
+
+    async def race():
+        results = await asyncio.gather(send(b"abcd"), send(b"abcd"))
+        await async_engine.dispose()
+        return results
+
+    assert sorted(asyncio.run(race()), key=str) == [4, "ok"]
+    assert stored(upload_id).received == 4